@@ -2,70 +2,75 @@ import json
 import os
 from datetime import datetime
 
-import google.generativeai as genai
+import model_router
+import resilience
+from json_store import update_json
+from roadmap_model import Roadmap
+from utils import data_path, get_roadmap_path, get_test_scores_path
 
-# Configure Gemini API
-GEMINI_API_KEY = "YOUR_GEMINI_API_KEY_HERE"  # Replace with your API key
-genai.configure(api_key=GEMINI_API_KEY)
+# Per-user fields the adaptation writes into a roadmap: adaptive_metadata on the document,
+# the rest on subtopics (apply_ai_changes). Warm starts strip them from reused roadmaps.
+ADAPTATION_FIELDS = frozenset((
+    "adaptive_metadata",
+    "adaptive_status", "adaptive_priority", "performance_accuracy", "ai_recommendations", "ai_notes",
+    "block_progression", "original_duration", "adjusted_duration",
+))
 
 
 def log_adaptation(user_id, adaptation_details):
     """Logs adaptation changes to a JSON file."""
     try:
-        log_dir = "D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Adaptations"
+        log_dir = data_path("Adaptations")
         os.makedirs(log_dir, exist_ok=True)
         log_file = os.path.join(log_dir, f"{user_id}_adapt.json")
 
-        if os.path.exists(log_file):
-            with open(log_file, "r") as f:
-                log_data = json.load(f)
-        else:
-            log_data = {"user_id": user_id, "adaptations": []}
-
-        log_data["adaptations"].append(adaptation_details)
-
-        with open(log_file, "w") as f:
-            json.dump(log_data, f, indent=4)
+        update_json(
+            log_file,
+            lambda log_data: log_data["adaptations"].append(adaptation_details),
+            lambda: {"user_id": user_id, "adaptations": []},
+        )
 
     except Exception as e:
         print(f"✗ Error in logging adaptation: {e}")
 
 
 def adaptive_learning_model(user_id):
-    BASE_PATH = "D:\\Adaptive_Learning_model_V2\\Backend\\Model"
-    SCORES_PATH = f"{BASE_PATH}\\users_data\\Test_scores_data"
-    ROADMAP_PATH = f"{BASE_PATH}\\users_data\\Roadmap_data"
-    
     try:
         # Load test scores
-        with open(f"{SCORES_PATH}\\{user_id}_Scores.json", "r") as f:
+        with open(get_test_scores_path(user_id), "r") as f:
             scores_data = json.load(f)
         
         # Load original roadmap
-        roadmap_file = f"{ROADMAP_PATH}\\{user_id}.json"
+        roadmap_file = get_roadmap_path(user_id)
         with open(roadmap_file, "r") as f:
-            roadmap_data = json.load(f)
+            roadmap_data = Roadmap.parse(json.load(f))
         
         print(f"✓ Loaded roadmap for user {user_id}")
         
         # Let AI analyze scores and make roadmap changes
         ai_analysis = analyze_with_ai(scores_data, roadmap_data, user_id)
         
-        # Apply AI-recommended changes to specific subtopics only
-        changes_made = apply_ai_changes(user_id, roadmap_data, ai_analysis)
-        
-        # Add metadata to track changes
-        roadmap_data["adaptive_metadata"] = {
-            "user_id": user_id,
-            "last_updated": datetime.now().isoformat(),
-            "ai_analysis_summary": ai_analysis.get("summary", {}),
-            "subtopics_modified": changes_made["modified_subtopics"],
-            "total_changes": changes_made["total_changes"]
-        }
-        
-        # Save changes back to the original roadmap file
-        with open(roadmap_file, "w") as f:
-            json.dump(roadmap_data, f, indent=4)
+        changes_made = {}
+
+        def apply_changes(latest_document):
+            latest_roadmap = Roadmap.parse(latest_document)
+
+            # Apply AI-recommended changes to specific subtopics only
+            changes_made.update(apply_ai_changes(user_id, latest_roadmap, ai_analysis))
+
+            # Add metadata to track changes
+            latest_roadmap["adaptive_metadata"] = {
+                "user_id": user_id,
+                "last_updated": datetime.now().isoformat(),
+                "ai_analysis_summary": ai_analysis.get("summary", {}),
+                "subtopics_modified": changes_made["modified_subtopics"],
+                "total_changes": changes_made["total_changes"]
+            }
+            return latest_roadmap.to_dict()
+
+        # Re-read and save the roadmap under its lock; the slow AI call above stays outside it,
+        # and readers never see a half-written file
+        update_json(roadmap_file, apply_changes)
         
         print(f"✓ Roadmap updated and saved to {roadmap_file}")
         print(f"✓ Modified {changes_made['total_changes']} subtopic(s)")
@@ -91,8 +96,6 @@ def analyze_with_ai(scores_data, roadmap_data, user_id):
     subtopics need modification
     """
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
         # Extract subtopics from roadmap for AI context
         subtopics_list = extract_all_subtopics(roadmap_data)
         
@@ -145,12 +148,12 @@ You are an AI learning advisor. Analyze the student's test performance and ident
 Respond ONLY with valid JSON.
 """
         
-        response = model.generate_content(prompt)
+        response_text = resilience.call_with_retry(model_router.generate_text, "adaptation", prompt)
 
         
         # Parse AI response
         try:
-            response_text = response.text.strip()
+            response_text = response_text.strip()
             # Remove markdown code blocks if present
             if response_text.startswith("```"):
                 response_text = response_text.split("```")[1]
@@ -173,6 +176,9 @@ Respond ONLY with valid JSON.
             # Fallback to manual analysis
             return fallback_analysis(scores_data, subtopics_list)
         
+    except resilience.CircuitOpenError as e:
+        print(f"⚠ {e}; using rule-based analysis")
+        return fallback_analysis(scores_data, extract_all_subtopics(roadmap_data))
     except Exception as e:
         print(f"⚠ Gemini API error: {e}")
         return fallback_analysis(scores_data, extract_all_subtopics(roadmap_data))
@@ -180,40 +186,16 @@ Respond ONLY with valid JSON.
 
 def extract_all_subtopics(roadmap_data):
     """Extract all subtopic titles from the roadmap structure"""
-    subtopics = []
-    
-    if isinstance(roadmap_data, dict):
-        # Navigate nested structure
-        if 'roadmap' in roadmap_data and isinstance(roadmap_data['roadmap'], dict):
-            roadmap_inner = roadmap_data['roadmap'].get('roadmap_data', {})
-        elif 'roadmap_data' in roadmap_data:
-            roadmap_inner = roadmap_data['roadmap_data']
-        else:
-            roadmap_inner = roadmap_data
-        
-        phases = roadmap_inner.get('phases', [])
-        
-        for phase in phases:
-            if isinstance(phase, dict):
-                phase_name = phase.get('phase_name', 'Unknown Phase')
-                milestones = phase.get('milestones', [])
-                
-                for milestone in milestones:
-                    if isinstance(milestone, dict):
-                        milestone_title = milestone.get('milestone_title', 'Unknown Milestone')
-                        milestone_subtopics = milestone.get('subtopics', [])
-                        
-                        for subtopic in milestone_subtopics:
-                            if isinstance(subtopic, dict):
-                                subtopics.append({
-                                    'title': subtopic.get('title', ''),
-                                    'subtopic_id': subtopic.get('subtopic_id', ''),
-                                    'phase': phase_name,
-                                    'milestone': milestone_title,
-                                    'duration': subtopic.get('duration', '')
-                                })
-    
-    return subtopics
+    return [
+        {
+            'title': subtopic.get('title', ''),
+            'subtopic_id': subtopic.get('subtopic_id', ''),
+            'phase': subtopic.phase.get('phase_name', 'Unknown Phase'),
+            'milestone': subtopic.milestone.get('milestone_title', 'Unknown Milestone'),
+            'duration': subtopic.get('duration', '')
+        }
+        for subtopic in Roadmap.of(roadmap_data).subtopics
+    ]
 
 
 def prepare_scores_summary(scores_data):
@@ -326,7 +308,7 @@ def fallback_analysis(scores_data, subtopics_list):
 
 def apply_ai_changes(user_id, roadmap_data, ai_analysis):
     """
-    Apply AI-recommended changes to specific subtopics in the roadmap
+    Apply AI-recommended changes to specific subtopics in the roadmap (a Roadmap, changed in place)
     Returns a summary of changes made
     """
     changes_made = {
@@ -335,76 +317,60 @@ def apply_ai_changes(user_id, roadmap_data, ai_analysis):
     }
     
     subtopic_changes = ai_analysis.get("subtopic_changes", [])
-    
-    # Navigate to phases
-    if isinstance(roadmap_data, dict):
-        if 'roadmap' in roadmap_data and isinstance(roadmap_data['roadmap'], dict):
-            roadmap_inner = roadmap_data['roadmap'].get('roadmap_data', {})
-        elif 'roadmap_data' in roadmap_data:
-            roadmap_inner = roadmap_data['roadmap_data']
-        else:
-            roadmap_inner = roadmap_data
-        
-        phases = roadmap_inner.get('phases', [])
-        
-        # Create lookup for changes by subtopic title
-        changes_by_title = {change["subtopic_title"]: change for change in subtopic_changes}
-        
-        for phase in phases:
-            if not isinstance(phase, dict):
-                continue
-            
-            for milestone in phase.get('milestones', []):
-                if not isinstance(milestone, dict):
-                    continue
-                
-                for subtopic in milestone.get('subtopics', []):
-                    if not isinstance(subtopic, dict):
-                        continue
-                    
-                    subtopic_title = subtopic.get('title', '')
-                    
-                    # Check if this subtopic needs changes
-                    if subtopic_title in changes_by_title:
-                        change = changes_by_title[subtopic_title]
-                        
-                        # Apply changes to this specific subtopic
-                        subtopic['adaptive_status'] = change.get('status', 'needs_review')
-                        subtopic['adaptive_priority'] = change.get('priority', 'medium')
-                        subtopic['performance_accuracy'] = change.get('current_accuracy', 0)
-                        subtopic['ai_recommendations'] = change.get('recommendations', [])
-                        subtopic['ai_notes'] = change.get('ai_notes', '')
-                        subtopic['block_progression'] = change.get('block_progression', False)
-                        
-                        # Adjust duration if needed
-                        add_time = change.get('add_study_time', '0 days')
-                        if add_time != '0 days':
-                            original_duration = subtopic.get('duration', '')
-                            subtopic['original_duration'] = original_duration
-                            subtopic['adjusted_duration'] = f"{original_duration} + {add_time}"
-                        
-                        changes_made["modified_subtopics"].append(subtopic_title)
-                        changes_made["total_changes"] += 1
-                        
-                        # Log the adaptation
-                        adaptation_details = {
-                            "timestamp": datetime.now().isoformat(),
-                            "adaptation_type": "difficulty_adjustment",
-                            "affected_section": subtopic_title,
-                            "change_description": f"Status changed to {change.get('status')}, priority to {change.get('priority')}",
-                            "reason": f"User performance: {change.get('current_accuracy')}% accuracy"
-                        }
-                        log_adaptation(user_id, adaptation_details)
-                        
-                        print(f"  ✓ Modified: {subtopic_title} → {change.get('status')}")
+
+    # Look up the subtopics each change names by title, and apply them in roadmap order
+    roadmap = Roadmap.of(roadmap_data)
+    changes_by_title = {change["subtopic_title"]: change for change in subtopic_changes}
+    matches = sorted(
+        (subtopic for title in changes_by_title for subtopic in roadmap.with_title(title)),
+        key=lambda subtopic: subtopic.ordinal,
+    )
+
+    for subtopic in matches:
+        subtopic_title = subtopic.title
+        change = changes_by_title[subtopic_title]
+
+        # Apply changes to this specific subtopic
+        subtopic['adaptive_status'] = change.get('status', 'needs_review')
+        subtopic['adaptive_priority'] = change.get('priority', 'medium')
+        subtopic['performance_accuracy'] = change.get('current_accuracy', 0)
+        subtopic['ai_recommendations'] = change.get('recommendations', [])
+        subtopic['ai_notes'] = change.get('ai_notes', '')
+        subtopic['block_progression'] = change.get('block_progression', False)
+
+        # Adjust duration if needed
+        add_time = change.get('add_study_time', '0 days')
+        if add_time != '0 days':
+            original_duration = subtopic.get('duration', '')
+            subtopic['original_duration'] = original_duration
+            subtopic['adjusted_duration'] = f"{original_duration} + {add_time}"
+
+        changes_made["modified_subtopics"].append(subtopic_title)
+        changes_made["total_changes"] += 1
+
+        # Log the adaptation
+        adaptation_details = {
+            "timestamp": datetime.now().isoformat(),
+            "adaptation_type": "difficulty_adjustment",
+            "affected_section": subtopic_title,
+            "change_description": f"Status changed to {change.get('status')}, priority to {change.get('priority')}",
+            "reason": f"User performance: {change.get('current_accuracy')}% accuracy"
+        }
+        log_adaptation(user_id, adaptation_details)
+
+        print(f"  ✓ Modified: {subtopic_title} → {change.get('status')}")
     
     return changes_made
 
 
 # Example usage
 if __name__ == "__main__":
-    user_id = input("Enter The User ID: ")
-    result = adaptive_learning_model(user_id)
+    import sys
+    import profiling
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    user_id = args[0] if args else input("Enter The User ID: ")
+    with profiling.profile(f"adaptation-{user_id}", profiling.mode_from_argv()):
+        result = adaptive_learning_model(user_id)
     
     if result["success"]:
         print("\n" + "="*60)
@@ -412,8 +378,7 @@ if __name__ == "__main__":
         print("="*60)
         print(f"User ID: {result['user_id']}")
         print(f"\n📁 Files:")
-        print(f"  Original: {result['original_file']} (UNCHANGED)")
-        print(f"  Adaptive: {result['adaptive_file']} (NEW)")
+        print(f"  Roadmap: {result['roadmap_file']} (UPDATED)")
         
         print(f"\n📊 Changes Made:")
         print(f"  Total subtopics modified: {result['changes_summary']['total_changes']}")
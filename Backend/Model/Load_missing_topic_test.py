@@ -1,17 +1,17 @@
-
-from Topicwise_Test_generator import  manually_store_questionnaire
+from backfill_worker import fill_subtopic
 
 def main():
 
     user_id = input("Enter User ID: ")
-    phase_idx = input("Enter phase Number: ")
-    milestone_idx = input("Enter milestone idx: ")
-    subtopic_idx = input("Enter subtopic idx: ")
-    with open (f"Backend\\Model\\users_data\\Roadmap_data\\{user_id}.json" , "r") as f:
-        data = f.read()
-    subtopic_title = data["roadmap"]["phases"][phase_idx]["milestones"][milestone_idx]["subtopics"][subtopic_idx]["title"]
-    questionnaire_data = data
+    phase_idx = int(input("Enter phase idx: "))
+    milestone_idx = int(input("Enter milestone idx: "))
+    subtopic_idx = int(input("Enter subtopic idx: "))
 
-    manually_store_questionnaire(user_id, phase_idx, milestone_idx, subtopic_idx, subtopic_title, questionnaire_data)
+    # Generates the missing test through the same journal the backfill worker uses;
+    # `python backfill_worker.py --once` fills every missing test of every user.
+    if fill_subtopic(user_id, phase_idx, milestone_idx, subtopic_idx):
+        print("✅ Test stored")
+    else:
+        print("⚠️ Could not generate the test, see the errors above")
 
-main()
\ No newline at end of file
+main()
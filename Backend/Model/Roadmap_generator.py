@@ -2,6 +2,7 @@ import absl.logging
 import os
 os.environ['GRPC_VERBOSITY'] = 'ERROR'
 absl.logging.set_verbosity('fatal')  # Only show fatal errors (im using this to remove all the unnecessary cli warnings)
+import copy
 import json
 from datetime import datetime
 import pandas as pd
@@ -9,9 +10,29 @@ from dotenv import load_dotenv
 from sqlalchemy import create_engine, Engine
 from postgres_data_fuction import career_choice
 from urllib.parse import quote_plus
-from utils import spinner_with_timer
-from google import genai
+from utils import get_roadmap_path, get_roadmaps_folder, spinner_with_timer
 from Topicwise_Test_generator import store_questionnaire_data
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import fake_backends
+import model_router
+import roadmap_fanout
+import resilience
+import schemas
+from singleflight import generation_jobs
+from json_store import atomic_write_json
+from feature_store import get_feature_store
+from profile_index import get_profile_index, WARM_START_MAX_DISTANCE
+from Adaptive_Model import ADAPTATION_FIELDS
+from roadmap_model import Roadmap
+
+ROADMAPS_FOLDER = get_roadmaps_folder()
+
+# CPU-bound JSON parsing/serialization is pushed here so the async server's event loop stays responsive.
+_json_executor = None
+# Background test generation runs for minutes; it gets its own pool so it never starves
+# the default executor that serves database lookups.
+_test_generation_executor = None
 
 def connect_to_db(host: str, port: str, dbname: str, user: str, password: str) -> Engine | None:
     """Establishes a connection to the PostgreSQL database."""
@@ -28,7 +49,7 @@ def get_psychometry_data(connection: Engine, individual_id: str) -> pd.DataFrame
     """Fetches psychometry data for a given individual ID from the database."""
     query = "SELECT * FROM psychometry_data WHERE ID = %s;"
     try:
-        df = pd.read_sql_query(query, connection, params=(individual_id,))
+        df = resilience.call_with_retry(pd.read_sql_query, query, connection, params=(individual_id,), breaker="postgres")
         return df if not df.empty else None
     except pd.errors.DatabaseError as e:
         print(f"Database error while fetching psychometry data: {e}")
@@ -39,12 +60,9 @@ def get_psychometry_data(connection: Engine, individual_id: str) -> pd.DataFrame
 
 
 
-def generate_career_roadmap(career: str, psychometry_data: pd.DataFrame, user_data: dict | None) -> dict:
-    """Generates a career roadmap using the Gemini API."""
-    print(f"Generating roadmap for career: {career} using Gemini...")
-    stop_spinner = spinner_with_timer()
-    client = genai.Client(api_key = os.getenv("GOOGLE_GENAI_API_KEY"))
-    prompt = f"""You are an expert career counselor and learning strategist with deep expertise in psychometric analysis, skill development, and career planning. Your role is to create highly personalized, data-driven learning roadmaps in a two-phase approach for any given career path.
+def build_roadmap_prompt(career: str, psychometry_data: pd.DataFrame) -> str:
+    """Builds the two-phase roadmap prompt for a career and psychometric profile."""
+    return f"""You are an expert career counselor and learning strategist with deep expertise in psychometric analysis, skill development, and career planning. Your role is to create highly personalized, data-driven learning roadmaps in a two-phase approach for any given career path.
 
 **Output must be only one valid JSON object/array, no extra text, no multiple root-level objects.**
 
@@ -348,74 +366,253 @@ Before submitting the JSON response, verify:
 - No placeholder text like "[X]" remains in the final output
 - Response starts with {{ and ends with }} (pure JSON, no markdown)
 """
+
+def generate_career_roadmap(career: str, psychometry_data: pd.DataFrame, user_data: dict | None) -> dict:
+    """Generates a career roadmap using the Gemini API."""
+    print(f"Generating roadmap for career: {career} using Gemini...")
+    stop_spinner = spinner_with_timer()
     try:
-        response = client.models.generate_content(model="gemini-2.5-flash-lite",contents=prompt)
+        if roadmap_fanout.fanout_enabled():
+            gemini_roadmap = roadmap_fanout.generate_roadmap(career, psychometry_data)
+        else:
+            prompt = build_roadmap_prompt(career, psychometry_data)
+            gemini_roadmap = resilience.call_with_retry(model_router.generate_json, "roadmap", prompt, schema="roadmap")
+            gemini_roadmap = schemas.checked(gemini_roadmap, "roadmap",
+                                             schemas.llm_repairer("roadmap", f"{career} learning roadmap"))
         stop_spinner()
-        # To-Do: The model is not giving the output in the desired format, so this temporary fix is applied.
-        # Will be removed once the model is updated.
-        raw_json_output = response.text.replace("```json", "").replace("```", "")
-        try:
-            gemini_roadmap = json.loads(raw_json_output)
+        if "error" not in gemini_roadmap:
             print("Roadmap generated successfully by Gemini.")
-            return gemini_roadmap
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON from Gemini response: {e}")
-            # Print a snippet of the response around the error
-            error_pos = e.pos
-            context = 20
-            start = max(0, error_pos - context)
-            end = error_pos + context
-            snippet = raw_json_output[start:end]
-            print(f"...context around error...\n{snippet}\n...context around error...")
-            return {"error": "Failed to parse Gemini response JSON."}
+        return gemini_roadmap
     except Exception as e:
         stop_spinner()
         print(f"Error generating roadmap with Gemini: {e}")
         return {"error": str(e)}
 
-def get_or_generate_roadmap(user_id: str) -> dict:
-    """Gets a roadmap from the file system or generates a new one."""
-    roadmaps_folder = "D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Roadmap_data"
-    os.makedirs(roadmaps_folder, exist_ok=True)
-    user_roadmap_file = os.path.join(roadmaps_folder, f"{user_id}.json")
-    print(f"Checking for roadmap at: {os.path.abspath(user_roadmap_file)}")
-    if os.path.exists(user_roadmap_file):
-        print(f"Welcome User: {user_id}")
-        with open(user_roadmap_file, 'r') as f:
-            try:
-                return json.load(f)
-            except json.JSONDecodeError:
-                print(f"Invalid JSON in {user_roadmap_file}, regenerating.")
-    else:
-        print(f"No roadmap found for user {user_id}. Generating a new one.")
-    
+async def generate_career_roadmap_async(career: str, psychometry_data: pd.DataFrame) -> dict:
+    """Non-blocking variant of generate_career_roadmap used by the ASGI server."""
+    print(f"Generating roadmap for career: {career} using Gemini...")
+    if roadmap_fanout.fanout_enabled():
+        return await roadmap_fanout.generate_roadmap_async(career, psychometry_data, executor=get_json_executor())
+    loop = asyncio.get_running_loop()
+    prompt = await loop.run_in_executor(get_json_executor(), build_roadmap_prompt, career, psychometry_data)
+    try:
+        gemini_roadmap = await resilience.call_with_retry_async(
+            model_router.generate_json_async, "roadmap", prompt, executor=get_json_executor(), schema="roadmap"
+        )
+        return await schemas.checked_async(
+            gemini_roadmap, "roadmap",
+            schemas.llm_repairer_async("roadmap", f"{career} learning roadmap", get_json_executor()),
+        )
+    except Exception as e:
+        print(f"Error generating roadmap with Gemini: {e}")
+        return {"error": str(e)}
+
+def get_json_executor():
+    global _json_executor
+    if _json_executor is None:
+        _json_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="roadmap-json")
+    return _json_executor
+
+def get_test_generation_executor():
+    global _test_generation_executor
+    if _test_generation_executor is None:
+        _test_generation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="test-generation")
+    return _test_generation_executor
+
+def get_roadmap_file(user_id: str) -> str:
+    return get_roadmap_path(user_id)
+
+def load_saved_roadmap(user_roadmap_file: str) -> dict | None:
+    """Returns the stored roadmap, or None if it is missing, not valid JSON or a saved error."""
+    if not os.path.exists(user_roadmap_file):
+        return None
+    with open(user_roadmap_file, 'r') as f:
+        try:
+            roadmap = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Invalid JSON in {user_roadmap_file}, regenerating.")
+            return None
+    if isinstance(roadmap, dict) and "error" in roadmap:
+        # Older versions saved failed generations; retry them instead of serving the error
+        print(f"Saved error in {user_roadmap_file}, regenerating.")
+        return None
+    return roadmap
+
+def save_roadmap(user_roadmap_file: str, career_roadmap: dict):
+    atomic_write_json(user_roadmap_file, career_roadmap)
+
+def fetch_user_profile(user_id: str) -> tuple[pd.DataFrame, str] | dict:
+    """Loads the psychometry data and career choice for a user, or an error dict."""
+    store = get_feature_store()
+    if store is not None:
+        data = store.get_profile(user_id)
+        career = store.career_choice(user_id)
+        if data is not None and career:
+            return data, career
+        # Not in the snapshot yet (e.g. registered after the last refresh): ask the database
+
+    if fake_backends.fake_db_enabled():
+        data = fake_backends.fake_psychometry_data(user_id)
+        if data is None:
+            return {"error": f"No data found for ID: {user_id}"}
+        return data, fake_backends.fake_career_choice(user_id)
+
     load_dotenv()
     DB_HOST = os.environ.get("DB_HOST")
     DB_PORT = os.environ.get("DB_PORT")
     DB_NAME = os.environ.get("DB_NAME")
     DB_USER = os.environ.get("DB_USER")
     DB_PASS = os.environ.get("DB_PASS")
-    
+
     db_connection = connect_to_db(DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASS)
-    if db_connection:
-        data = get_psychometry_data(db_connection, user_id)
-        if data is not None:
-            career = career_choice(user_id)
-            if career:
-                career_roadmap = generate_career_roadmap(career, data, None)
-                with open(user_roadmap_file, 'w') as f:
-                    json.dump(career_roadmap, f, indent=4)
-                print(f"Roadmap for user {user_id} saved to {user_roadmap_file}")
-                try:
-                    print(f"Triggering questionnaire generation for user: {user_id}")
-                    store_questionnaire_data(user_id, career_roadmap)
-                    print(f"✅ Test generation completed for user_id: {user_id}")
-                except Exception as q_e:
-                    print(f"❌ Error generating questionnaires for user {user_id}: {q_e}")
-                return career_roadmap
-            else:
-                return {"error": f"Career choice not found for ID: {user_id}"}
+    if not db_connection:
+        return {"error": "Database connection failed"}
+    data = get_psychometry_data(db_connection, user_id)
+    if data is None:
+        return {"error": f"No data found for ID: {user_id}"}
+    career = career_choice(user_id)
+    if not career:
+        return {"error": f"Career choice not found for ID: {user_id}"}
+    return data, career
+
+def _strip_adaptations(node):
+    """Copy of a roadmap without the per-user fields Adaptive_Model writes into it."""
+    if isinstance(node, dict):
+        return {key: _strip_adaptations(value) for key, value in node.items()
+                if key not in ADAPTATION_FIELDS and key != "warm_start"}
+    if isinstance(node, list):
+        return [_strip_adaptations(item) for item in node]
+    return copy.copy(node)
+
+def _personalize(roadmap: dict, career: str, psychometry_data: pd.DataFrame):
+    """
+    Replaces the source user's personalization sections of a reused roadmap with ones
+    written for this profile, or drops them if they can't be generated.
+    """
+    outline = {"phases": [
+        {"phase_number": number, "phase_name": phase.get("phase_name", ""), "duration": phase.get("duration", "")}
+        for number, phase in enumerate(Roadmap.of(roadmap).phases, 1)
+    ]}
+    profile = roadmap_fanout.generate_profile(career, psychometry_data, outline)
+    for key in roadmap_fanout.PROFILE_KEYS:
+        if profile is not None:
+            roadmap[key] = profile[key]
         else:
-            return {"error": f"No data found for ID: {user_id}"}
+            roadmap.pop(key, None)
+
+def find_warm_start_roadmap(career: str, psychometry_data: pd.DataFrame) -> dict | None:
+    """
+    Reuses the roadmap of the closest indexed profile with the same career, if it is
+    within WARM_START_MAX_DISTANCE. Returns None when a fresh roadmap is needed.
+    """
+    try:
+        neighbours = get_profile_index().query(career, psychometry_data.iloc[0], k=3)
+    except Exception as e:
+        print(f"Profile index lookup failed: {e}")
+        return None
+    for source_user_id, distance in neighbours:
+        if distance > WARM_START_MAX_DISTANCE:
+            break
+        source = load_saved_roadmap(get_roadmap_file(source_user_id))
+        if source is None or "error" in source:
+            continue
+        roadmap = _strip_adaptations(source)
+        _personalize(roadmap, career, psychometry_data)
+        roadmap["created_at"] = datetime.now().isoformat()
+        roadmap["warm_start"] = {"source_user_id": source_user_id, "distance": round(distance, 4)}
+        print(f"Reusing roadmap of user {source_user_id} (profile distance {distance:.3f})")
+        return roadmap
+    return None
+
+def index_generated_profile(user_id: str, career: str, psychometry_data: pd.DataFrame):
+    """Makes a freshly generated roadmap available for warm starts."""
+    try:
+        get_profile_index().add(user_id, career, psychometry_data.iloc[0])
+    except Exception as e:
+        print(f"Could not add user {user_id} to the profile index: {e}")
+
+def generate_tests_for_roadmap(user_id: str, career_roadmap: dict):
+    try:
+        print(f"Triggering questionnaire generation for user: {user_id}")
+        # Duplicate triggers wait for the running generation instead of racing it on the same file
+        generation_jobs.do((user_id, "tests"), store_questionnaire_data, user_id, career_roadmap)
+        print(f"✅ Test generation completed for user_id: {user_id}")
+    except Exception as q_e:
+        print(f"❌ Error generating questionnaires for user {user_id}: {q_e}")
+
+def get_or_generate_roadmap(user_id: str, background_tests: bool = False) -> dict:
+    """
+    Gets a roadmap from the file system or generates a new one.
+
+    Tests for a new roadmap are generated before returning, or with background_tests in
+    the test generation executor, as the async variant does.
+    """
+    os.makedirs(ROADMAPS_FOLDER, exist_ok=True)
+    user_roadmap_file = get_roadmap_file(user_id)
+    print(f"Checking for roadmap at: {os.path.abspath(user_roadmap_file)}")
+    existing = load_saved_roadmap(user_roadmap_file)
+    if existing is not None:
+        print(f"Welcome User: {user_id}")
+        return existing
+    print(f"No roadmap found for user {user_id}. Generating a new one.")
+
+    profile = fetch_user_profile(user_id)
+    if isinstance(profile, dict):
+        return profile
+    data, career = profile
+
+    career_roadmap = find_warm_start_roadmap(career, data)
+    if career_roadmap is None:
+        career_roadmap = generate_career_roadmap(career, data, None)
+        if "error" in career_roadmap:
+            return career_roadmap  # not saved, so the next request tries again
+        index_generated_profile(user_id, career, data)
+    save_roadmap(user_roadmap_file, career_roadmap)
+    print(f"Roadmap for user {user_id} saved to {user_roadmap_file}")
+    if background_tests:
+        get_test_generation_executor().submit(generate_tests_for_roadmap, user_id, career_roadmap)
     else:
-        return {"error": "Database connection failed"}
\ No newline at end of file
+        generate_tests_for_roadmap(user_id, career_roadmap)
+    return career_roadmap
+
+async def get_or_generate_roadmap_async(user_id: str, background_tasks: set | None = None) -> dict:
+    """
+    Async counterpart of get_or_generate_roadmap.
+
+    The Gemini call is awaited, database and file I/O run in worker threads and JSON
+    work goes to the executor. Test generation is started in the background instead of
+    holding the request open; pass a set to keep a reference to that task.
+    """
+    loop = asyncio.get_running_loop()
+    os.makedirs(ROADMAPS_FOLDER, exist_ok=True)
+    user_roadmap_file = get_roadmap_file(user_id)
+    existing = await loop.run_in_executor(get_json_executor(), load_saved_roadmap, user_roadmap_file)
+    if existing is not None:
+        return existing
+
+    profile = await asyncio.to_thread(fetch_user_profile, user_id)
+    if isinstance(profile, dict):
+        return profile
+    data, career = profile
+
+    career_roadmap = await asyncio.to_thread(find_warm_start_roadmap, career, data)
+    if career_roadmap is None:
+        career_roadmap = await generate_career_roadmap_async(career, data)
+        if "error" in career_roadmap:
+            return career_roadmap  # not saved, so the next request tries again
+        await asyncio.to_thread(index_generated_profile, user_id, career, data)
+    await loop.run_in_executor(get_json_executor(), save_roadmap, user_roadmap_file, career_roadmap)
+    print(f"Roadmap for user {user_id} saved to {user_roadmap_file}")
+    task = asyncio.ensure_future(
+        loop.run_in_executor(get_test_generation_executor(), generate_tests_for_roadmap, user_id, career_roadmap))
+    if background_tasks is not None:
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+    return career_roadmap
+
+if __name__ == "__main__":
+    import sys
+    import profiling
+    with profiling.profile(f"roadmap-{sys.argv[1]}", profiling.mode_from_argv()):
+        result = get_or_generate_roadmap(sys.argv[1])
+    sys.exit(1 if "error" in result else 0)
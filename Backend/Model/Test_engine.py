@@ -3,51 +3,33 @@ We are gonna make functions for,
 > User teaking the test
 > Analyzing the test score
 > Storing the test score in a json string, under test_score_data folder in user_data
+> Adaptive testing: asking only the most informative questions (AdaptiveTest)
 """
-import json
 import os
 from datetime import datetime
 
+import numpy as np
+
+from cohort_analytics import record_test_answers
+from json_store import update_json
+import test_store
+from utils import get_scores_folder
+
 def load_test_questions(user_id, phase, milestone, subtopic):
     # Load test questions
-    test_file = f"D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Test_data\\{user_id}_Tests.json"
-    with open(test_file, "r") as f:
-        data = json.load(f)
-    
-    # Convert phase to string if it's an integer (JSON keys are strings)
-    questions = data[str(phase)][milestone][subtopic]
-    return questions
+    return test_store.get_test(user_id, phase, milestone, subtopic)
 
-def store_user_answers(user_id, phase, milestone, subtopic, mcq, user_answer, question_number):
+def store_user_answers(user_id, phase, milestone, subtopic, mcq, user_answer, question_number, time_taken=None,
+                       test=None):
+    # The test the mcq belongs to names the subtopic; it is loaded if not passed
+    if test is None:
+        test = load_test_questions(user_id, phase, milestone, subtopic) or {}
     # Create folder if doesn't exist
-    scores_folder = "D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Test_scores_data"
+    scores_folder = get_scores_folder()
     os.makedirs(scores_folder, exist_ok=True)
     
     scores_file = os.path.join(scores_folder, f"{user_id}_Scores.json")
     
-    # Load existing scores or create new structure
-    if os.path.exists(scores_file):
-        with open(scores_file, "r") as f:
-            try:
-                scores_data = json.load(f)
-            except json.JSONDecodeError:
-                scores_data = {}
-    else:
-        scores_data = {}
-    
-    # Create nested structure if doesn't exist
-    phase_key = str(phase)
-    if phase_key not in scores_data:
-        scores_data[phase_key] = {}
-    if milestone not in scores_data[phase_key]:
-        scores_data[phase_key][milestone] = {}
-    if subtopic not in scores_data[phase_key][milestone]:
-        scores_data[phase_key][milestone][subtopic] = {
-            "subtopic_name": mcq.get("subtopic_name", ""),
-            "attempted_at": datetime.now().isoformat(),
-            "answers": []
-        }
-    
     # Check if answer is correct
     correct_answer = mcq["answer"]
     is_correct = (user_answer == correct_answer)
@@ -63,11 +45,183 @@ def store_user_answers(user_id, phase, milestone, subtopic, mcq, user_answer, qu
         "difficulty": mcq.get("difficulty", ""),
         "answered_at": datetime.now().isoformat()
     }
+    if time_taken is not None:
+        answer_record["time_taken"] = time_taken
     
-    scores_data[phase_key][milestone][subtopic]["answers"].append(answer_record)
+    def add_answer(scores_data):
+        # Create nested structure if doesn't exist
+        phase_key = str(phase)
+        if phase_key not in scores_data:
+            scores_data[phase_key] = {}
+        if milestone not in scores_data[phase_key]:
+            scores_data[phase_key][milestone] = {}
+        if subtopic not in scores_data[phase_key][milestone]:
+            scores_data[phase_key][milestone][subtopic] = {
+                "subtopic_name": test.get("subtopic_name", ""),
+                "attempted_at": datetime.now().isoformat(),
+                "answers": []
+            }
+        scores_data[phase_key][milestone][subtopic]["answers"].append(answer_record)
     
-    # Save back to file
-    with open(scores_file, "w") as f:
-        json.dump(scores_data, f, indent=4)
+    # Read-modify-write under the document lock so concurrent answers are not lost
+    update_json(scores_file, add_answer)
+    record_test_answers(user_id, test, subtopic, [answer_record])
         
     return {"is_correct": is_correct, "correct_answer": correct_answer}
+
+
+# --- Computerized adaptive testing ---
+#
+# Each MCQ is treated as a 3PL IRT item: its "difficulty" label gives the location b,
+# all items share one discrimination a, and the guessing floor c is 1 / number of options.
+# Ability (theta) is tracked per topic_label as a posterior over a fixed grid, next to one
+# overall posterior fed by every answer. The pass bar is translated into theta space: the
+# test is passed when the expected score on the full question set reaches PASS_PERCENTAGE,
+# i.e. the decision a learner answering every question would get, with fewer questions.
+
+DIFFICULTY_LOCATIONS = {"easy": -1.0, "medium": 0.0, "hard": 1.0}
+DISCRIMINATION = 1.5
+PASS_PERCENTAGE = 85
+THETA_GRID = np.linspace(-4.0, 4.0, 161)
+_PRIOR = np.exp(-0.5 * THETA_GRID ** 2)
+_PRIOR /= _PRIOR.sum()
+
+
+class AdaptiveTest:
+    """
+    Adaptive run through one subtopic's MCQs.
+
+    Call next_item() for the index of the question to ask, record() the outcome, and stop
+    when finished(). The state is just the list of responses, so a session can be
+    persisted with to_dict() and rebuilt with from_dict().
+    """
+
+    def __init__(self, mcqs, confidence_z=1.64, se_target=0.35, max_items=None, min_items=3):
+        self.mcqs = mcqs
+        self.confidence_z = confidence_z
+        self.se_target = se_target
+        self.max_items = max_items or len(mcqs)
+        self.min_items = min(min_items, len(mcqs))
+        self.responses = []
+
+        labels = [mcq.get("topic_label", "") for mcq in mcqs]
+        self.topic_labels, self.topic_of_item = np.unique(np.array(labels, dtype=object), return_inverse=True)
+        self.topic_of_item = self.topic_of_item.reshape(-1)
+        b = np.array([DIFFICULTY_LOCATIONS.get(str(mcq.get("difficulty", "")).lower(), 0.0) for mcq in mcqs])
+        self.guessing = np.array([1.0 / max(len(mcq.get("options", {})), 2) for mcq in mcqs])
+        # P(correct | theta) for every item at every grid point: shape (items, grid)
+        logistic = 1.0 / (1.0 + np.exp(-DISCRIMINATION * (THETA_GRID[np.newaxis, :] - b[:, np.newaxis])))
+        self.p_correct = self.guessing[:, np.newaxis] + (1.0 - self.guessing[:, np.newaxis]) * logistic
+        self.log_posterior = np.tile(np.log(_PRIOR), (len(self.topic_labels), 1))
+        self.overall_log_posterior = np.log(_PRIOR)
+        self.asked = np.zeros(len(mcqs), dtype=bool)
+
+    # --- Ability estimates ---
+
+    @staticmethod
+    def _eap(log_posterior):
+        post = np.exp(log_posterior - log_posterior.max(axis=-1, keepdims=True))
+        post /= post.sum(axis=-1, keepdims=True)
+        theta = post @ THETA_GRID
+        se = np.sqrt(np.maximum(post @ THETA_GRID ** 2 - theta ** 2, 0.0))
+        return theta, se
+
+    def ability(self):
+        """EAP ability and its standard error per topic_label, as arrays."""
+        return self._eap(self.log_posterior)
+
+    def overall_ability(self):
+        theta, se = self._eap(self.overall_log_posterior)
+        return float(theta), float(se)
+
+    def _expected_percentage(self, theta):
+        """Expected full-test score; theta is one overall value or an array per topic."""
+        theta = np.broadcast_to(theta, len(self.topic_labels))
+        grid_idx = np.clip(np.searchsorted(THETA_GRID, theta[self.topic_of_item]), 0, len(THETA_GRID) - 1)
+        return float(self.p_correct[np.arange(len(self.mcqs)), grid_idx].mean() * 100)
+
+    # --- Test flow ---
+
+    def record(self, item_idx, is_correct):
+        p = self.p_correct[item_idx]
+        log_likelihood = np.log(p if is_correct else 1.0 - p)
+        self.log_posterior[self.topic_of_item[item_idx]] += log_likelihood
+        self.overall_log_posterior = self.overall_log_posterior + log_likelihood
+        self.asked[item_idx] = True
+        self.responses.append((int(item_idx), bool(is_correct)))
+
+    def decision(self):
+        """True/False once the pass/fail outcome is confident, otherwise None."""
+        theta, se = self.overall_ability()
+        low = self._expected_percentage(theta - self.confidence_z * se)
+        high = self._expected_percentage(theta + self.confidence_z * se)
+        if low >= PASS_PERCENTAGE:
+            return True
+        if high < PASS_PERCENTAGE:
+            return False
+        return None
+
+    def finished(self):
+        n = len(self.responses)
+        if n >= self.max_items or self.asked.all():
+            return True
+        if n < self.min_items:
+            return False
+        if self.decision() is not None:
+            return True
+        _, se = self.ability()
+        return bool((se <= self.se_target).all())
+
+    def next_item(self):
+        """Index of the most informative unasked question, or None when the test is over."""
+        if self.finished():
+            return None
+        theta, se = self.ability()
+        grid_idx = np.searchsorted(THETA_GRID, theta[self.topic_of_item]).clip(0, len(THETA_GRID) - 1)
+        p = self.p_correct[np.arange(len(self.mcqs)), grid_idx]
+        c = self.guessing
+        # 3PL Fisher information, weighted by how uncertain the item's topic still is
+        info = DISCRIMINATION ** 2 * ((p - c) ** 2 / (1.0 - c) ** 2) * ((1.0 - p) / p)
+        score = info * se[self.topic_of_item] ** 2
+        score[self.asked] = -np.inf
+        return int(np.argmax(score))
+
+    def result(self):
+        theta, se = self.ability()
+        correct = sum(1 for _, ok in self.responses if ok)
+        expected = self._expected_percentage(self.overall_ability()[0])
+        if self.asked.all():
+            # Every question was answered: the observed score decides, exactly as in a full test
+            passed = correct / len(self.mcqs) * 100 >= PASS_PERCENTAGE
+        else:
+            passed = self.decision()
+        return {
+            "questions_asked": len(self.responses),
+            "total_questions": len(self.mcqs),
+            "correct_answers": correct,
+            "expected_percentage": round(expected, 2),
+            "passed": bool(expected >= PASS_PERCENTAGE) if passed is None else passed,
+            "topic_ability": {
+                str(label): {"theta": round(float(t), 3), "se": round(float(e), 3)}
+                for label, t, e in zip(self.topic_labels, theta, se)
+            },
+            "weak_topics": [
+                str(label) for label, t in zip(self.topic_labels, theta)
+                if self._topic_expected(label, t) < PASS_PERCENTAGE
+            ],
+        }
+
+    def _topic_expected(self, label, topic_theta):
+        items = np.flatnonzero(self.topic_labels[self.topic_of_item] == label)
+        grid_idx = min(np.searchsorted(THETA_GRID, topic_theta), len(THETA_GRID) - 1)
+        return float(self.p_correct[items, grid_idx].mean() * 100)
+
+    def to_dict(self):
+        return {"responses": self.responses}
+
+    @classmethod
+    def from_dict(cls, mcqs, state, **kwargs):
+        test = cls(mcqs, **kwargs)
+        for item_idx, is_correct in state.get("responses", []):
+            test.record(item_idx, is_correct)
+        return test
@@ -1,3 +1,4 @@
+import heapq
 import json
 import os
 import time
@@ -6,7 +7,13 @@ from datetime import datetime
 from tqdm import tqdm
 from postgres_data_fuction import career_choice
 from utils import spinner_with_timer
-from google import genai
+import model_router
+import question_bank
+import resilience
+import schemas
+import test_store
+from generation_journal import GenerationJournal
+from roadmap_model import Roadmap
 
 '''
 def main():
@@ -18,28 +25,44 @@ def main():
 
 '''
 
-def generate_quetions(user_id, data, phase_idx, milestone_idx, subtopic_idx):
-    
-    phases = data.get("roadmap", {}).get("phases")
-    if not phases:
-        phases = data.get("roadmap_data", {}).get("phases", [])
+def generate_quetions(user_id, data, phase_idx, milestone_idx, subtopic_idx, career=None):
+    # Callers generating many tests pass the user's career, so it is looked up once per run
+    if career is None:
+        career = career_choice(user_id)
+    phases = Roadmap.of(data).phases
 
     if not phases or phase_idx >= len(phases):
         return {"error": "Invalid phase index or no phases found."}
 
     phase = phases[phase_idx]
-    milestone = phase["milestones"][milestone_idx]
-    subtopic = milestone["subtopics"][subtopic_idx]
+    milestone = phase.milestones[milestone_idx]
+    subtopic = milestone.subtopics[subtopic_idx]
+    topic_list = subtopic["topic_list"]
+
+    # Reuse questions other users already got for the same subtopic, and only ask the
+    # LLM about topics the question bank does not cover yet
+    banked_mcqs, missing_topics = question_bank.lookup(subtopic.title, topic_list)
+    if not missing_topics:
+        return {
+            "phase_number": phase.phase_number,
+            "milestone_id": milestone.milestone_id,
+            "subtopic_id": subtopic.subtopic_id,
+            "subtopic_name": subtopic.title,
+            "career_title": career,
+            "created_at": datetime.now().isoformat(),
+            "mcqs": banked_mcqs,
+            "source": "question_bank",
+        }
 
     prompt =f"""
                 Generate MCQ-based questions covering all topics in the given subtopic.
 
                 **Input Structure:**
-                - phase_number: {phase["phase_number"]}
-                - milestone_id: {milestone["milestone_id"]}
-                - subtopic_id: {subtopic["subtopic_id"]}
-                - subtopic_name: {subtopic["title"]}
-                - topics: {subtopic["topic_list"]}
+                - phase_number: {phase.phase_number}
+                - milestone_id: {milestone.milestone_id}
+                - subtopic_id: {subtopic.subtopic_id}
+                - subtopic_name: {subtopic.title}
+                - topics: {missing_topics}
 
                 **Requirements:**
                 1. Cover **all topics** with MCQs
@@ -54,11 +77,11 @@ def generate_quetions(user_id, data, phase_idx, milestone_idx, subtopic_idx):
 
                 **Output Format:**
                 {{
-                    "phase_number": {phase["phase_number"]},
-                    "milestone_id": "{milestone["milestone_id"]}",
-                    "subtopic_id": "{subtopic["subtopic_id"]}",
-                    "subtopic_name": "{subtopic["title"]}",
-                    "career_title": "{career_choice(user_id)}",
+                    "phase_number": {phase.phase_number},
+                    "milestone_id": "{milestone.milestone_id}",
+                    "subtopic_id": "{subtopic.subtopic_id}",
+                    "subtopic_name": "{subtopic.title}",
+                    "career_title": "{career}",
                     "created_at": "{datetime.now().isoformat()}",
                     "mcqs": [
                         {{
@@ -79,177 +102,98 @@ def generate_quetions(user_id, data, phase_idx, milestone_idx, subtopic_idx):
                 **Output valid JSON only. No explanations.**
             """
     try:
-        client = genai.Client(api_key = os.getenv("GOOGLE_GENAI_API_KEY"))
-   
-        response = client.models.generate_content(model="gemini-2.5-flash-lite",contents=prompt)
-        raw_json_output = response.text.replace("```json", "").replace("```", "")
-        try:
-            gemini_quetionaire = json.loads(raw_json_output)
-            return(gemini_quetionaire)
-        
-        except json.JSONDecodeError as e:
-            print(f"Error decoding JSON from Gemini response: {e}")
-            # Print a snippet of the response around the error
-            error_pos = e.pos
-            context = 20
-            start = max(0, error_pos - context)
-            end = error_pos + context
-            snippet = raw_json_output[start:end]
-            print(f"...context around error...\n{snippet}\n...context around error...")
-            return {"error": "Failed to parse Gemini response JSON."}
+        gemini_quetionaire = model_router.generate_json("mcqs", prompt, schema="mcq_set")
+        # Invalid MCQs are re-requested one by one, and dropped if still invalid
+        gemini_quetionaire = schemas.checked(gemini_quetionaire, "mcq_set",
+                                             schemas.llm_repairer("mcqs", f"MCQ test on {subtopic.title}"))
+        if "error" not in gemini_quetionaire:
+            new_mcqs = gemini_quetionaire.get("mcqs", [])
+            question_bank.store(subtopic.title, topic_list, missing_topics, new_mcqs)
+            gemini_quetionaire["mcqs"] = banked_mcqs + new_mcqs
+        return gemini_quetionaire
     except Exception as e:
-        
+        if resilience.is_retryable(e) or isinstance(e, resilience.CircuitOpenError):
+            raise  # the caller schedules the retry (or gives up on an open circuit)
         print(f"Error generating quetions with Gemini: {e}")
         return {"error": str(e)}
 
 
 def store_questionnaire_data(user_id: str, roadmap_data: dict):
-    Test_data_folder = "D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Test_data"
-    os.makedirs(Test_data_folder, exist_ok=True)
-    user_test_data_file = os.path.join(Test_data_folder, f"{user_id}_Tests.json")
-
-    if os.path.exists(user_test_data_file):
-        with open(user_test_data_file, "r") as file:
-            try:
-                all_questionnaires = json.load(file)
-            except json.JSONDecodeError:
-                all_questionnaires = []
-    else:
-        all_questionnaires = []
-
-    tasks = []
-    pending_subtopics = []
-    phases = roadmap_data.get("roadmap", {}).get("phases")
-    if not phases:
-        phases = roadmap_data.get("roadmap_data", {}).get("phases", [])
-
-    if phases:
-        for phase_idx, phase in enumerate(phases):
-            for milestone_idx, milestone in enumerate(phase.get("milestones", [])):
-                for subtopic_idx, subtopic in enumerate(milestone.get("subtopics", [])):
-                    if not any(
-                        q.get("subtopic_id") == subtopic.get("subtopic_id")
-                        for q in all_questionnaires
-                    ):
-                        tasks.append(
-                            (
-                                phase_idx,
-                                milestone_idx,
-                                subtopic_idx,
-                                subtopic.get("title"),
-                                subtopic.get("subtopic_id"),
-                            )
-                        )
+    # Each test is written once, to its own file in the test store; the journal records
+    # completed subtopics one by one, so resuming is a set lookup
+    journal = GenerationJournal.for_user(user_id)
+    stored = []
+
+    roadmap = Roadmap.of(roadmap_data)
+    tasks = [
+        (*subtopic.indexes, subtopic.title, subtopic.subtopic_id, subtopic.key)
+        for subtopic in roadmap.subtopics
+        if not journal.is_done(subtopic.subtopic_id)
+    ]
 
     if not tasks:
         print("All questionnaires have already been generated.")
-        return all_questionnaires
+        return stored
 
-    print(f"\nStarting test generation for {len(tasks)} subtopics...")
+    print(f"\nStarting test generation for {len(tasks)} subtopics ({len(journal.done)} already done)...")
+    career = career_choice(user_id)
 
+    # Retries wait in a heap ordered by when they are due, so a backoff on one subtopic
+    # never holds up the others; the loop only sleeps when nothing at all is ready.
+    policy = resilience.DEFAULT_POLICY
+    queue = [(0.0, order, task, 0, None) for order, task in enumerate(tasks)]
     with tqdm(total=len(tasks), desc="Generating Tests") as pbar:
-        for p_idx, m_idx, s_idx, title, subtopic_id in tasks:
-            retry_attempts = 5
-            backoff_factor = 2
-            for attempt in range(retry_attempts):
-                try:
-                    questionnaire = generate_quetions(
-                        user_id, roadmap_data, p_idx, m_idx, s_idx
-                    )
-                    if questionnaire and "error" not in questionnaire:
-                        all_questionnaires.append(questionnaire)
-                        with open(user_test_data_file, "w") as file:
-                            json.dump(all_questionnaires, file, indent=4)
-                        pbar.update(1)
-                        print("/n")
-                        print(f"Successfully generated test for subtopic: {title}")
-                        break
-                    else:
-                        error_msg = questionnaire.get("error", "Unknown error")
-                        if "503" in error_msg or "UNAVAILABLE" in error_msg:
-                            print(
-                                f"Gemini is overloaded. Retrying in {backoff_factor ** attempt} seconds..."
-                            )
-                            time.sleep(backoff_factor ** attempt)
-                        else:
-                            print(
-                                f"\nWarning: Failed to generate questionnaire for subtopic '{title}'. Error: {error_msg}"
-                            )
-                            break
-                except Exception as e:
-                    error_str = str(e)
-                    if "503" in error_str or "UNAVAILABLE" in error_str:
-                        print(
-                            f"Gemini is overloaded. Retrying in {backoff_factor ** attempt} seconds..."
-                        )
-                        time.sleep(backoff_factor ** attempt)
-                    else:
-                        print(
-                            f"\nError generating questionnaire for subtopic '{title}': {e}"
-                        )
-                        break
-            else:
-                pending_subtopics.append(subtopic_id)
+        while queue:
+            ready_at, order, task, attempt, delay = heapq.heappop(queue)
+            wait = ready_at - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            p_idx, m_idx, s_idx, title, subtopic_id, key = task
+            try:
+                questionnaire = generate_quetions(
+                    user_id, roadmap, p_idx, m_idx, s_idx, career
+                )
+            except resilience.CircuitOpenError as e:
+                print(f"\n{e}; leaving subtopic '{title}' pending.")
+                journal.record_pending(subtopic_id)
                 pbar.update(1)
-
-    if pending_subtopics:
-        for subtopic_id in pending_subtopics:
-            if not any(
-                q.get("subtopic_id") == subtopic_id for q in all_questionnaires
-            ):
-                all_questionnaires.append(
-                    {"subtopic_id": subtopic_id, "status": "pending"}
+                continue
+            except Exception as e:
+                delay = policy.retry_delay(e, attempt, delay)
+                if delay is not None:
+                    print(f"Gemini is unavailable ({e}). Retrying '{title}' in {delay:.1f} seconds...")
+                    heapq.heappush(queue, (time.monotonic() + delay, order, task, attempt + 1, delay))
+                elif resilience.is_retryable(e):
+                    journal.record_pending(subtopic_id)
+                    pbar.update(1)
+                else:
+                    print(f"\nError generating questionnaire for subtopic '{title}': {e}")
+                    pbar.update(1)
+                continue
+
+            if questionnaire and "error" not in questionnaire:
+                test_store.put_test(user_id, questionnaire, key)
+                journal.record_done(subtopic_id, key)
+                stored.append(questionnaire)
+                print(f"Successfully generated test for subtopic: {title}")
+            else:
+                error_msg = questionnaire.get("error", "Unknown error")
+                print(
+                    f"\nWarning: Failed to generate questionnaire for subtopic '{title}'. Error: {error_msg}"
                 )
-        with open(user_test_data_file, "w") as file:
-            json.dump(all_questionnaires, file, indent=4)
+            pbar.update(1)
 
-    if all_questionnaires:
+    if stored:
         print(
-            f"\nSuccessfully generated and stored {len(all_questionnaires)} questionnaires in {user_test_data_file}"
+            f"\nSuccessfully generated and stored {len(stored)} questionnaires in {test_store.user_dir(user_id)}"
         )
-        time.sleep(1)
-        print("orgainizing test data")
-        organize_tests_by_hierarchy(user_id)
+        bank_stats = question_bank.stats()
+        print(f"Question bank: {bank_stats['subtopic_hits']} subtopic(s) served locally, topic hit rate {bank_stats['topic_hit_rate']:.0%}")
     else:
         print(f"\nNo questionnaires were successfully generated for user {user_id}.")
 
-    return all_questionnaires
-
+    return stored
 
-def organize_tests_by_hierarchy(user_id):
-    """
-    Reorganizes flat test data into nested structure by phase > milestone > subtopic
-    
-    Args:
-        tests_data: List of test objects from JSON file
-        
-    Returns:
-        Dictionary with nested structure: {phase_number: {milestone_id: {subtopic_id: test_data}}}
-    """
-    with open(f"D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Test_data\\{user_id}_Tests.json", "r") as f:
-        tests_data = json.load(f)
-    organized = {}
-    
-    for test in tests_data:
-        phase_num = test.get("phase_number")
-        milestone_id = test.get("milestone_id")
-        subtopic_id = test.get("subtopic_id")
-        
-        # Initialize nested structure if doesn't exist
-        if phase_num not in organized:
-            organized[phase_num] = {}
-        
-        if milestone_id not in organized[phase_num]:
-            organized[phase_num][milestone_id] = {}
-        
-        # Store the entire test object under its subtopic
-        organized[phase_num][milestone_id][subtopic_id] = test
-    
-    nested_tests = organized
-    
-    with open(f"D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Test_data\\{user_id}_Tests.json", "w") as f:
-        json.dump(nested_tests, f, indent=4)
-    print("Orgainized the test data")
 
 def manually_store_questionnaire(user_id, phase_idx, milestone_idx, subtopic_idx, subtopic_title=None, questionnaire_data=None):
     """
@@ -263,20 +207,6 @@ def manually_store_questionnaire(user_id, phase_idx, milestone_idx, subtopic_idx
     - subtopic_title (str, optional): Title of the subtopic
     - questionnaire_data (dict, optional): Actual questionnaire content
     """
-    Test_data_folder = "D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Test_data"
-    os.makedirs(Test_data_folder, exist_ok=True)
-    user_test_data_file = os.path.join(Test_data_folder, f"{user_id}_Tests.json")
-
-    # Load existing questionnaires
-    if os.path.exists(user_test_data_file):
-        with open(user_test_data_file, "r") as file:
-            try:
-                all_questionnaires = json.load(file)
-            except json.JSONDecodeError:
-                all_questionnaires = []
-    else:
-        all_questionnaires = []
-
     # Create manual entry
     manual_entry = {
         "subtopic_id": f"manual_{phase_idx}_{milestone_idx}_{subtopic_idx}",
@@ -287,14 +217,11 @@ def manually_store_questionnaire(user_id, phase_idx, milestone_idx, subtopic_idx
         "questionnaire": questionnaire_data or {},
         "status": "manual"
     }
+    key = test_store.test_key(phase_idx, milestone_idx, manual_entry["subtopic_id"])
 
     # Check if already exists
-    if any(q.get("subtopic_id") == manual_entry["subtopic_id"] for q in all_questionnaires):
+    if test_store.get_test(user_id, *key) is not None:
         print(f"⚠️ Entry already exists for subtopic {manual_entry['subtopic_id']}. Skipping.")
     else:
-        all_questionnaires.append(manual_entry)
-        with open(user_test_data_file, "w") as file:
-            json.dump(all_questionnaires, file, indent=4)
+        test_store.put_test(user_id, manual_entry, key)
         print(f"✅ Successfully stored manual entry for subtopic {manual_entry['subtopic_id']}")
-
-
@@ -0,0 +1,137 @@
+"""
+Adaptive test sessions, shared by main_controller and async_server.
+
+A session asks only the most informative questions of a test (see Test_engine.AdaptiveTest)
+and lives in its own JSON file until the last answer, when the whole attempt is written
+to the scores file once and the session is deleted. Sessions nobody answered for
+NEXTPATH_TEST_SESSION_TTL_HOURS (default 24) are deleted when a new one starts.
+
+start() and answer() take the request body and return (response body, status); answer()
+also returns the user whose scores changed, so the server can queue their adaptation.
+"""
+import os
+import time
+import uuid
+
+import numpy as np
+
+from grading import feedback_for, load_answer_key, normalize_timings, store_graded_submission
+from json_store import atomic_write_json, document_lock, read_json, remove_json
+from Test_engine import AdaptiveTest
+from utils import get_test_scores_path, get_test_session_path, is_safe_id
+
+# Adaptive test sessions nobody answered for this long are deleted
+TEST_SESSION_TTL = float(os.getenv("NEXTPATH_TEST_SESSION_TTL_HOURS", "24")) * 3600
+
+
+def public_question(mcq):
+    """Question fields the learner may see (no answer)"""
+    return {key: mcq.get(key) for key in ("question", "options", "topic_label", "difficulty")}
+
+
+def expire_sessions():
+    """Deletes adaptive test sessions, and lock files left without one, idle for TEST_SESSION_TTL"""
+    folder = os.path.dirname(get_test_session_path("_"))
+    if not os.path.isdir(folder):
+        return
+    cutoff = time.time() - TEST_SESSION_TTL
+    for entry in os.scandir(folder):
+        try:
+            if entry.stat().st_mtime >= cutoff:
+                continue
+        except FileNotFoundError:
+            continue
+        if entry.name.endswith(".json"):
+            with document_lock(entry.path):
+                try:
+                    if os.stat(entry.path).st_mtime < cutoff:  # not answered meanwhile
+                        remove_json(entry.path)
+                except FileNotFoundError:
+                    pass
+        elif entry.name.endswith(".json.lock") and not os.path.exists(entry.path[:-len(".lock")]):
+            # Session IDs are never reused, so nobody waits on the lock of a session gone this long
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def start(data) -> tuple[dict, int]:
+    """Starts a session on the test named by data; returns its first question."""
+    user_id = data.get("userId")
+    phase, milestone, subtopic = data.get("phase"), data.get("milestone"), data.get("subtopic")
+    if not user_id or phase is None or not milestone or not subtopic:
+        return {"error": "userId, phase, milestone and subtopic are required"}, 400
+    if not is_safe_id(user_id):
+        return {"error": "Invalid userId"}, 400
+
+    answer_key = load_answer_key(user_id, phase, milestone, subtopic)
+    if answer_key is None:
+        return {"error": "Test not found for this topic"}, 404
+
+    expire_sessions()
+    adaptive_test = AdaptiveTest(answer_key.test["mcqs"])
+    item = adaptive_test.next_item()
+    session_id = uuid.uuid4().hex
+    atomic_write_json(get_test_session_path(session_id), {
+        "userId": user_id, "phase": phase, "milestone": milestone, "subtopic": subtopic,
+        "current": item, "answers": {}, "timings": {}, **adaptive_test.to_dict(),
+    })
+    return {
+        "sessionId": session_id,
+        "questionIndex": item,
+        "question": public_question(answer_key.test["mcqs"][item]),
+    }, 200
+
+
+def answer(data) -> tuple[dict, int, str | None]:
+    """Records one answer; returns the next question, or the final result and the user graded."""
+    session_id = data.get("sessionId")
+    given = data.get("answer")
+    if not session_id or given is None:
+        return {"error": "sessionId and answer are required"}, 400, None
+    if not is_safe_id(session_id):
+        return {"error": "Test session not found"}, 404, None
+
+    session_path = get_test_session_path(session_id)
+    with document_lock(session_path):
+        session = read_json(session_path)
+        if session is None:
+            return {"error": "Test session not found"}, 404, None
+        user_id, phase, milestone, subtopic = session["userId"], session["phase"], session["milestone"], session["subtopic"]
+        answer_key = load_answer_key(user_id, phase, milestone, subtopic)
+        if answer_key is None:
+            return {"error": "Test not found for this topic"}, 404, None
+
+        mcqs = answer_key.test["mcqs"]
+        adaptive_test = AdaptiveTest.from_dict(mcqs, session)
+        item = session["current"]
+        is_correct = str(given) == answer_key.answers[item]
+        adaptive_test.record(item, is_correct)
+        session["answers"][str(item)] = str(given)
+        if data.get("timeTaken") is not None:
+            session.setdefault("timings", {})[str(item)] = data["timeTaken"]
+        next_item = adaptive_test.next_item()
+
+        if next_item is not None:
+            atomic_write_json(session_path, {**session, "current": next_item, **adaptive_test.to_dict()})
+            return {
+                "isCorrect": is_correct,
+                "finished": False,
+                "questionIndex": next_item,
+                "question": public_question(mcqs[next_item]),
+            }, 200, None
+
+        # Finished: the whole attempt is written to the scores file once
+        submitted = np.full(len(mcqs), "", dtype=object)
+        for idx, value in session["answers"].items():
+            submitted[int(idx)] = value
+        asked = [idx for idx, _ in adaptive_test.responses]
+        timings = session.get("timings", {})  # keyed by question index
+        time_taken = normalize_timings([timings.get(str(i)) for i in range(len(mcqs))], len(mcqs))
+        store_graded_submission(get_test_scores_path(user_id), phase, milestone, subtopic, answer_key, submitted, asked,
+                                user_id=user_id, time_taken=time_taken)
+        remove_json(session_path)
+
+    result = adaptive_test.result()
+    return {"isCorrect": is_correct, "finished": True, "result": {**result, "feedback": feedback_for(result)}}, 200, user_id
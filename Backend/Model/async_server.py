@@ -0,0 +1,376 @@
+"""
+ASGI variant of server.py and main_controller.py.
+
+Exposes the same routes (only the X-NextPath-Profile request header is not honoured here;
+see profiling.py), but roadmap generation awaits Gemini instead of holding a
+worker thread, database and file access run in worker threads, and JSON parsing and
+serialization go through an executor. Roadmap jobs go through the same shared JobStore as
+main_controller, so with several workers any of them answers status checks; job worker
+threads (NEXTPATH_JOB_WORKERS, default 1) run the generation on the server's event loop.
+Run it with an ASGI server, e.g.
+
+    hypercorn async_server:app --bind 0.0.0.0:5000
+"""
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+from quart import Quart, Response, request, jsonify, send_from_directory
+from quart_cors import cors
+
+from Roadmap_generator import get_or_generate_roadmap_async, get_roadmap_file, get_json_executor
+import adaptive_sessions
+import http_cache
+from batch_reads import BatchError, read_roadmaps, read_tests, summarize
+from cohort_analytics import query as analytics_query
+from grading import (load_answer_key, grade, grade_submissions, store_graded_submission, normalize_timings,
+                     feedback_for, SubmissionError)
+from job_store import JobStore, JobWorker
+from singleflight import generation_jobs
+from backfill_worker import backfill_stats, start_backfill_worker
+from llm_client import hedge_stats
+from model_router import get_router
+import profiling
+from resilience import breaker_stats
+from roadmap_model import load_roadmap, outline_of, view_from_query
+import test_store
+from utils import get_roadmap_path, get_adaptive_roadmap_path, get_test_scores_path, is_safe_id
+
+app = cors(Quart(__name__))  # Enable CORS for React frontend
+
+# Job status lives in a shared store so any worker process can answer status checks
+job_store = JobStore()
+background_tasks = set()
+
+# --- Helper Functions ---
+
+async def read_json(path):
+    """Reads and parses a JSON file off the event loop."""
+    def _load():
+        with open(path, "r") as f:
+            return json.load(f)
+    return await asyncio.get_running_loop().run_in_executor(get_json_executor(), _load)
+
+@app.before_request
+async def reject_unsafe_user_id():
+    """User IDs in the URL name files, so one that could leave the data folder is refused"""
+    user_id = (request.view_args or {}).get("user_id")
+    if user_id is not None and not is_safe_id(user_id):
+        return jsonify({"error": "Invalid userId"}), 400
+
+# --- server.py routes ---
+
+@app.route('/generate_roadmap', methods=['POST'])
+async def generate_roadmap_endpoint():
+    user_id = (await request.get_json()).get('user_id')
+    if not user_id:
+        return jsonify({'error': 'User ID is required'}), 400
+    if not is_safe_id(user_id):
+        return jsonify({'error': 'Invalid user ID'}), 400
+
+    roadmap = await generation_jobs.do_async((user_id, "roadmap"), get_or_generate_roadmap_async, user_id, background_tasks)
+    if 'error' in roadmap:
+        return jsonify(roadmap), 500
+
+    return jsonify(roadmap), 200
+
+@app.route('/check_roadmap/<user_id>', methods=['GET'])
+async def check_roadmap_endpoint(user_id):
+    exists = await asyncio.to_thread(os.path.exists, get_roadmap_file(user_id))
+    return jsonify({'exists': exists}), 200
+
+@app.route('/roadmap/<user_id>', methods=['GET'])
+async def get_roadmap_data(user_id):
+    try:
+        return jsonify(await read_json(get_roadmap_file(user_id))), 200
+    except FileNotFoundError:
+        return jsonify({'error': 'Roadmap not found'}), 404
+    except json.JSONDecodeError:
+        return jsonify({'error': 'Malformed JSON in roadmap file'}), 500
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# --- main_controller.py routes ---
+
+@app.route('/api/roadmap/check/<user_id>', methods=['GET'])
+async def check_roadmap(user_id):
+    """Check if user's roadmap exists"""
+    if os.path.exists(get_adaptive_roadmap_path(user_id)) or os.path.exists(get_roadmap_path(user_id)):
+        return jsonify({"exists": True, "status": "completed"})
+
+    status = await asyncio.to_thread(job_store.status, user_id, "roadmap")
+    return jsonify({"exists": False, "status": status})
+
+@app.route('/api/roadmap/generate', methods=['POST'])
+async def generate_roadmap():
+    """Trigger roadmap generation"""
+    data = await request.get_json()
+    user_id = data.get("userId")
+    if not user_id:
+        return jsonify({"error": "userId is required"}), 400
+    if not is_safe_id(user_id):
+        return jsonify({"error": "Invalid userId"}), 400
+
+    # A double-click or a retrying frontend attaches to the job already queued or running,
+    # whichever worker process accepted it
+    queued = await asyncio.to_thread(job_store.submit, user_id, "roadmap")
+
+    return jsonify({"status": "generating", "userId": user_id, "deduplicated": not queued})
+
+async def json_file(path, transform=None, tag=""):
+    """Serves a JSON file with ETag/Last-Modified (304 when unchanged) and compression, or None if missing"""
+    result = await asyncio.to_thread(http_cache.json_file_response, path, request.headers, transform, tag)
+    if result is None:
+        return None
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
+
+@app.route('/api/roadmap/<user_id>', methods=['GET'])
+async def get_roadmap(user_id):
+    """Get original roadmap JSON; ?fields=, ?phase= and ?milestone= narrow it down"""
+    response = await json_file(get_roadmap_path(user_id), *view_from_query(request.args))
+    if response is None:
+        return jsonify({"error": "Roadmap not found"}), 404
+    return response
+
+@app.route('/api/roadmap/adaptive/<user_id>', methods=['GET'])
+async def get_adaptive_roadmap(user_id):
+    """Get adaptive roadmap if exists, otherwise original"""
+    response = await json_file(get_adaptive_roadmap_path(user_id), *view_from_query(request.args))
+    if response is not None:
+        return response
+
+    return await get_roadmap(user_id)
+
+@app.route('/api/roadmap/batch', methods=['POST'])
+async def get_roadmaps_batch():
+    """Roadmaps (outline, or narrowed like ?fields=&phase=&milestone=) of many users in one call"""
+    data = (await request.get_json(silent=True)) or {}
+    try:
+        results = await asyncio.to_thread(read_roadmaps, data.get("userIds"), data.get("view", "summary"),
+                                        data.get("fields"), data.get("phase"), data.get("milestone"))
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(summarize(results))
+
+@app.route('/api/roadmap/summary/<user_id>', methods=['GET'])
+async def get_roadmap_summary(user_id):
+    """Outline of the (adaptive) roadmap: IDs, titles, durations and statuses only"""
+    response = await json_file(get_adaptive_roadmap_path(user_id), outline_of, "outline")
+    if response is None:
+        response = await json_file(get_roadmap_path(user_id), outline_of, "outline")
+    if response is None:
+        return jsonify({"error": "Roadmap not found"}), 404
+    return response
+
+@app.route('/api/test/check/<user_id>/<topic_id>', methods=['GET'])
+async def check_test(user_id, topic_id):
+    """Check if test exists for topic"""
+    if await asyncio.to_thread(test_store.find_test, user_id, topic_id) is not None:
+        return jsonify({"exists": True, "testId": topic_id})
+    return jsonify({"exists": False})
+
+@app.route('/api/test/batch', methods=['POST'])
+async def get_tests_batch():
+    """Questions of many tests in one call; tests that cannot be read get their own error"""
+    data = (await request.get_json(silent=True)) or {}
+    try:
+        results = await asyncio.to_thread(read_tests, data.get("tests"))
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(summarize(results))
+
+@app.route('/api/test/<user_id>/<phase>/<milestone>/<subtopic>', methods=['GET'])
+async def get_test(user_id, phase, milestone, subtopic):
+    """Get test questions"""
+    test_path = await asyncio.to_thread(test_store.stored_test_path, user_id, phase, milestone, subtopic)
+    response = await json_file(test_path, test_questions, "questions")
+    if response is None:
+        return jsonify({"error": "Test not found for this topic"}), 404
+    return response
+
+def test_questions(test):
+    return {"questions": test.get("mcqs", [])}
+
+@app.route('/api/test/submit', methods=['POST'])
+async def submit_test():
+    """Submit test answers and trigger adaptive model"""
+    data = await request.get_json()
+    user_id = data.get("userId")
+    answers = data.get("answers")
+    phase, milestone, subtopic = data.get("phase"), data.get("milestone"), data.get("subtopic")
+
+    if not user_id or not answers:
+        return jsonify({"error": "userId and answers are required"}), 400
+    if not is_safe_id(user_id):
+        return jsonify({"error": "Invalid userId"}), 400
+    if phase is None or not milestone or not subtopic:
+        return jsonify({"error": "phase, milestone and subtopic are required"}), 400
+
+    def grade_and_store():
+        answer_key = load_answer_key(user_id, phase, milestone, subtopic)
+        if answer_key is None:
+            return None
+        result, submitted = grade(answer_key, answers)
+        time_taken = normalize_timings(data.get("timeTaken"), len(answer_key), answers)
+        store_graded_submission(get_test_scores_path(user_id), phase, milestone, subtopic, answer_key, submitted,
+                                user_id=user_id, time_taken=time_taken)
+        return result
+
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(get_json_executor(), grade_and_store)
+    except SubmissionError as e:
+        return jsonify({"error": str(e)}), 400
+    if result is None:
+        return jsonify({"error": "Test not found for this topic"}), 404
+
+    # Trigger the adaptive model without blocking the event loop
+    process = await asyncio.create_subprocess_exec(sys.executable, "Adaptive_Model.py", user_id)
+    returncode = await process.wait()
+    if returncode != 0:
+        return jsonify({"error": f"Failed to update adaptive model: exit status {returncode}"}), 500
+    return jsonify({**result, "feedback": feedback_for(result)})
+
+@app.route('/api/test/submit/batch', methods=['POST'])
+async def submit_test_batch():
+    """Grade many users' submissions in one call; adaptive updates are queued as jobs"""
+    submissions = ((await request.get_json()) or {}).get("submissions", [])
+    if not submissions:
+        return jsonify({"error": "submissions are required"}), 400
+
+    results, graded_users = await asyncio.to_thread(grade_submissions, submissions)
+    for user_id in graded_users:
+        await asyncio.to_thread(job_store.submit, user_id, "adaptation", None, True)
+
+    return jsonify({"results": results})
+
+# --- Adaptive Test Endpoints ---
+
+@app.route('/api/test/adaptive/start', methods=['POST'])
+async def start_adaptive_test():
+    """Start an adaptive test that only asks the most informative questions"""
+    body, status = await asyncio.to_thread(adaptive_sessions.start, (await request.get_json()) or {})
+    return jsonify(body), status
+
+@app.route('/api/test/adaptive/answer', methods=['POST'])
+async def answer_adaptive_test():
+    """Record one answer; returns the next question or the final result"""
+    body, status, graded_user = await asyncio.to_thread(adaptive_sessions.answer, (await request.get_json()) or {})
+    if graded_user is not None:
+        await asyncio.to_thread(job_store.submit, graded_user, "adaptation", None, True)
+    return jsonify(body), status
+
+# --- Analytics Endpoints ---
+
+@app.route('/api/analytics/<level>', methods=['GET'])
+async def get_cohort_analytics(level):
+    """Cohort accuracy, attempts and time per question (see main_controller)"""
+    body, status = await asyncio.to_thread(analytics_query, level, request.args)
+    return jsonify(body), status
+
+@app.route('/jobs/stats', methods=['GET'])
+async def job_stats_endpoint():
+    """In-flight generation jobs of the server.py routes and how many duplicates were coalesced"""
+    return jsonify(generation_jobs.stats())
+
+@app.route('/api/jobs/stats', methods=['GET'])
+async def get_job_stats():
+    """Jobs per status and how many duplicate requests were coalesced"""
+    return jsonify(await asyncio.to_thread(job_store.stats))
+
+@app.route('/api/health/dependencies', methods=['GET'])
+async def get_dependency_health():
+    """Circuit breaker state of Gemini and PostgreSQL"""
+    return jsonify(breaker_stats())
+
+@app.route('/api/backfill/stats', methods=['GET'])
+async def get_backfill_stats():
+    """Missing-test backlog, its drain rate and the backfill's LLM budget"""
+    return jsonify(backfill_stats())
+
+@app.route('/api/llm/stats', methods=['GET'])
+async def get_llm_stats():
+    """Hedged LLM requests: hedge rate, budget denials and the p99 they save"""
+    return jsonify(hedge_stats())
+
+@app.route('/api/llm/routes', methods=['GET'])
+async def get_llm_routes():
+    """Model routing config and recent latency/error rate of every route and tier"""
+    return jsonify(get_router().stats())
+
+@app.route('/api/http/stats', methods=['GET'])
+async def get_http_cache_stats():
+    """304s served, compression savings and the serialized-document cache"""
+    return jsonify(http_cache.stats())
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@profiling.admin_required
+async def get_profiles():
+    """Saved profiling captures of requests and jobs, newest first"""
+    return jsonify(await asyncio.to_thread(profiling.stats))
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+@profiling.admin_required
+async def get_profile(name):
+    """Download one capture (folded stacks or a .prof file)"""
+    captures = await asyncio.to_thread(profiling.list_captures)
+    if name not in {capture["name"] for capture in captures}:
+        return jsonify({"error": "Profile not found"}), 404
+    return await send_from_directory(os.path.abspath(profiling.PROFILE_DIR), name, as_attachment=True)
+
+@app.route('/api/recommendations/<user_id>', methods=['GET'])
+async def get_recommendations(user_id):
+    """Get personalized recommendations"""
+    roadmap = await asyncio.to_thread(load_roadmap, get_roadmap_path(user_id))
+    if roadmap is None:
+        return jsonify({"error": "Roadmap not found"}), 404
+
+    try:
+        recommendations = roadmap.phases[0]["personalized_recommendations"]
+        return jsonify({"recommendations": recommendations})
+    except (KeyError, IndexError):
+        return jsonify({"error": "Recommendations not found"}), 404
+
+# --- Job Workers ---
+
+# The loop the app serves on; job worker threads run generations on it
+serving_loop = None
+
+def run_roadmap_generation(user_id):
+    # Runs in a job worker thread; raising marks the job as failed in the store
+    roadmap = asyncio.run_coroutine_threadsafe(
+        generation_jobs.do_async((user_id, "roadmap"), get_or_generate_roadmap_async, user_id, background_tasks),
+        serving_loop,
+    ).result()
+    if "error" in roadmap:
+        raise RuntimeError(roadmap["error"])
+
+def run_adaptive_model(user_id):
+    subprocess.run([sys.executable, "Adaptive_Model.py", user_id], check=True)
+
+job_handlers = {"roadmap": run_roadmap_generation, "adaptation": run_adaptive_model}
+job_workers = []
+
+@app.before_serving
+async def start_job_workers():
+    """Starts worker threads that claim jobs from the shared store"""
+    global serving_loop
+    serving_loop = asyncio.get_running_loop()
+    # Set NEXTPATH_JOB_WORKERS=0 on processes that should only accept requests
+    for _ in range(int(os.getenv("NEXTPATH_JOB_WORKERS", "1"))):
+        worker = JobWorker(job_store, job_handlers)
+        worker.start()
+        job_workers.append(worker)
+
+@app.after_serving
+async def stop_job_workers():
+    for worker in job_workers:
+        worker.stop()
+
+# Set NEXTPATH_BACKFILL=1 to fill missing tests in the background
+backfill_worker = start_backfill_worker()
+
+if __name__ == '__main__':
+    app.run(debug=True, port=5000)
@@ -0,0 +1,391 @@
+"""
+Background backfill of pending and missing subtopic tests for every user.
+
+Test generation can leave subtopics without a test: a run that hit an open circuit or
+ran out of retries journals them as pending, and a crashed run never reached the rest.
+The backfill worker scans every saved roadmap against its user's generation journal and
+queues each subtopic that has no test in a priority heap, nearest-upcoming first: the
+subtopic right after the last one the user was scored on comes before the ones further
+ahead, and those before subtopics the user already moved past. Users are interleaved by
+that distance, so nobody's next test waits behind another user's whole roadmap.
+
+Every LLM request the backfill sends (retries, model fallbacks, MCQ repairs and hedges
+included) draws from a token bucket of NEXTPATH_BACKFILL_BUDGET requests per minute, charged
+through llm_client.charging, so the backfill only uses the capacity it is given; subtopics
+the question bank already covers cost nothing. Retryable failures wait on the
+resilience policy's backoff without blocking the rest of the queue. Each completed test
+is written to the test store and journaled right away. stats() reports the backlog and
+how fast it is draining.
+
+    NEXTPATH_BACKFILL=1                  run the worker in the server process
+    NEXTPATH_BACKFILL_BUDGET=20          LLM requests per minute the backfill may send
+    NEXTPATH_BACKFILL_SCAN_INTERVAL=300  seconds between scans for new work
+
+Run `python backfill_worker.py --once` to drain the current backlog and exit.
+"""
+import argparse
+import heapq
+import os
+import threading
+import time
+from collections import deque
+
+import llm_client
+import profiling
+import resilience
+import test_store
+from generation_journal import GenerationJournal
+from json_store import read_json
+from postgres_data_fuction import career_choice
+from roadmap_model import Roadmap, load_roadmap
+from singleflight import generation_jobs
+from Topicwise_Test_generator import generate_quetions
+from utils import get_roadmap_path, get_roadmaps_folder, get_test_scores_path, is_safe_id
+
+DEFAULT_BUDGET = 20  # LLM requests per minute
+DEFAULT_SCAN_INTERVAL = 300
+IN_FLIGHT_DELAY = 30  # seconds to wait while the user's own generation run is going
+MAX_FAILURES = 3  # permanent failures before a subtopic is left alone until restart
+DRAIN_WINDOW = 600  # seconds of completions the drain rate is measured over
+
+
+def backfill_enabled() -> bool:
+    return os.getenv("NEXTPATH_BACKFILL", "").lower() in ("1", "true", "yes")
+
+
+class BackfillStopped(Exception):
+    """Raised in place of an LLM request when the worker stops while waiting for budget."""
+
+
+class LLMBudget:
+    """Token bucket of LLM requests: `per_minute` refill rate, bursts up to `burst` requests."""
+
+    def __init__(self, per_minute: float, burst: float | None = None):
+        self.per_minute = per_minute
+        self.capacity = burst if burst is not None else max(1.0, per_minute / 6)
+        self.tokens = self.capacity
+        self.spent = 0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+
+    def try_acquire(self) -> float:
+        """Takes a request if one is available; otherwise returns the seconds until one is."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                self.spent += 1
+                return 0.0
+            return (1 - self.tokens) * 60 / self.per_minute
+
+    def acquire(self, stop: threading.Event | None = None) -> bool:
+        """Blocks until a request is available; False if stop was set while waiting."""
+        while True:
+            wait = self.try_acquire()
+            if wait == 0:
+                return True
+            if stop is not None:
+                if stop.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill()
+            return {"per_minute": self.per_minute, "available": round(self.tokens, 2), "spent": self.spent}
+
+
+def _iter_subtopics(roadmap):
+    """(ordinal, (phase_idx, milestone_idx, subtopic_idx), test key, subtopic) in roadmap order."""
+    for subtopic in Roadmap.of(roadmap).subtopics:
+        yield subtopic.ordinal, subtopic.indexes, subtopic.key, subtopic
+
+
+def _scored_subtopics(user_id) -> set:
+    scores = read_json(get_test_scores_path(user_id), {})
+    return {
+        subtopic_id
+        for milestones in scores.values() if isinstance(milestones, dict)
+        for subtopics in milestones.values() if isinstance(subtopics, dict)
+        for subtopic_id in subtopics
+    }
+
+
+def _priority(ordinal, position) -> tuple:
+    """Upcoming subtopics by distance from the user's position, then the ones behind it."""
+    if ordinal > position:
+        return 0, ordinal - position - 1
+    return 1, position - ordinal
+
+
+class BackfillWorker:
+    def __init__(self, budget: LLMBudget | None = None, scan_interval: float | None = None):
+        self.budget = budget or LLMBudget(float(os.getenv("NEXTPATH_BACKFILL_BUDGET", DEFAULT_BUDGET)))
+        self.scan_interval = scan_interval if scan_interval is not None else float(
+            os.getenv("NEXTPATH_BACKFILL_SCAN_INTERVAL", DEFAULT_SCAN_INTERVAL))
+        self.policy = resilience.DEFAULT_POLICY
+        self._queue = []    # (priority, user_id, subtopic_id, item)
+        self._waiting = []  # (ready_at, user_id, subtopic_id, item): retries in backoff
+        self._roadmaps = {}
+        self._careers = {}  # looked up once per user, not once per test
+        self._journals = {}
+        self._failures = {}
+        self._completed = deque()
+        self.completed = 0
+        self.failed = 0
+        self.last_scan = None
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _journal(self, user_id) -> GenerationJournal:
+        journal = self._journals.get(user_id)
+        if journal is None:
+            journal = self._journals[user_id] = GenerationJournal.for_user(user_id)
+        else:
+            journal.refresh()  # picks up tests generated by store_questionnaire_data meanwhile
+        return journal
+
+    def scan(self) -> int:
+        """Rebuilds the backlog from every saved roadmap; returns its size."""
+        with self._lock:
+            waiting = {(user_id, subtopic_id) for _, user_id, subtopic_id, _ in self._waiting}
+        queue = []
+        folder = get_roadmaps_folder()
+        for name in sorted(os.listdir(folder)) if os.path.isdir(folder) else []:
+            if not name.endswith(".json"):
+                continue
+            user_id = name[:-len(".json")]
+            if not is_safe_id(user_id):
+                continue
+            roadmap = load_roadmap(get_roadmap_path(user_id))  # parsed again only once changed
+            if roadmap is None:
+                continue
+            self._roadmaps[user_id] = roadmap
+            journal = self._journal(user_id)
+            subtopics = list(_iter_subtopics(roadmap))
+            scored = _scored_subtopics(user_id)
+            position = max((ordinal for ordinal, _, _, subtopic in subtopics
+                            if subtopic.subtopic_id in scored), default=-1)
+            for ordinal, indexes, key, subtopic in subtopics:
+                subtopic_id = subtopic.subtopic_id
+                if (journal.is_done(subtopic_id) or (user_id, subtopic_id) in waiting
+                        or self._failures.get((user_id, subtopic_id), 0) >= MAX_FAILURES):
+                    continue
+                item = {"user_id": user_id, "subtopic_id": subtopic_id, "title": subtopic.title,
+                        "indexes": indexes, "key": key, "attempt": 0, "delay": None}
+                queue.append((_priority(ordinal, position), user_id, subtopic_id, item))
+        heapq.heapify(queue)
+        with self._lock:
+            self._queue = queue
+            self.last_scan = time.time()
+        print(f"Backfill scan: {len(queue)} subtopic test(s) missing")
+        return len(queue)
+
+    def _next(self):
+        with self._lock:
+            now = time.monotonic()
+            while self._waiting and self._waiting[0][0] <= now:
+                _, user_id, subtopic_id, item = heapq.heappop(self._waiting)
+                heapq.heappush(self._queue, ((0, -1), user_id, subtopic_id, item))  # retries go first
+            if self._queue:
+                return heapq.heappop(self._queue)[3]
+            return None
+
+    def _requeue(self, item):
+        with self._lock:
+            heapq.heappush(self._queue, ((0, -1), item["user_id"], item["subtopic_id"], item))
+
+    def _retry_later(self, item, delay):
+        item = {**item, "attempt": item["attempt"] + 1, "delay": delay}
+        with self._lock:
+            heapq.heappush(self._waiting, (time.monotonic() + delay, item["user_id"], item["subtopic_id"], item))
+
+    def _give_up(self, item, journal, error):
+        key = (item["user_id"], item["subtopic_id"])
+        self._failures[key] = self._failures.get(key, 0) + 1
+        self.failed += 1
+        journal.record_pending(item["subtopic_id"])
+        print(f"Backfill of '{item['title']}' for user {item['user_id']} failed: {error}")
+
+    def _charge(self):
+        if not self.budget.acquire(self._stop):
+            raise BackfillStopped("backfill stopped while waiting for LLM budget")
+
+    def fill(self, item) -> bool:
+        """Generates one missing test. Returns True if it was stored."""
+        user_id, subtopic_id = item["user_id"], item["subtopic_id"]
+        journal = self._journal(user_id)
+        if journal.is_done(subtopic_id):
+            return False
+        try:
+            if user_id not in self._careers:
+                self._careers[user_id] = career_choice(user_id)
+            with llm_client.charging(self._charge):
+                questionnaire = generate_quetions(user_id, self._roadmaps[user_id], *item["indexes"],
+                                                  career=self._careers[user_id])
+        except resilience.CircuitOpenError as e:
+            self._retry_later(item, e.retry_in)
+            return False
+        except Exception as e:
+            if self._stop.is_set():
+                self._requeue(item)
+                return False
+            delay = self.policy.retry_delay(e, item["attempt"], item["delay"])
+            if delay is not None:
+                self._retry_later(item, delay)
+            else:
+                self._give_up(item, journal, e)
+            return False
+        if not questionnaire or "error" in questionnaire:
+            if self._stop.is_set():  # the generator turned BackfillStopped into an error result
+                self._requeue(item)
+                return False
+            self._give_up(item, journal, (questionnaire or {}).get("error", "Unknown error"))
+            return False
+        test_store.put_test(user_id, questionnaire, item["key"])
+        journal.record_done(subtopic_id, item["key"])
+        with self._lock:
+            self._completed.append(time.monotonic())
+            self.completed += 1
+        return True
+
+    def run_once(self) -> bool:
+        """Fills at most one subtopic within the budget. Returns False if there was nothing to do."""
+        item = self._next()
+        if item is None:
+            return False
+        if generation_jobs.in_flight((item["user_id"], "tests")):
+            self._retry_later(item, IN_FLIGHT_DELAY)
+            return True
+        self.fill(item)
+        return True
+
+    def drain(self, scan=True):
+        """Scans once and works until nothing is queued or waiting for a retry."""
+        if scan:
+            self.scan()
+        while not self._stop.is_set():
+            if not self.run_once():
+                with self._lock:
+                    next_retry = self._waiting[0][0] if self._waiting else None
+                if next_retry is None:
+                    break
+                self._stop.wait(max(0.0, next_retry - time.monotonic()))
+
+    def run_forever(self):
+        next_scan = 0.0
+        while not self._stop.is_set():
+            if time.monotonic() >= next_scan:
+                try:
+                    self.scan()
+                except Exception as e:
+                    print(f"Backfill scan failed: {e}")
+                next_scan = time.monotonic() + self.scan_interval
+            if not self.run_once():
+                self._stop.wait(min(5.0, max(0.0, next_scan - time.monotonic())))
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run_forever, name="backfill-worker", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+
+    def drain_rate(self) -> float:
+        """Tests completed per minute over the last DRAIN_WINDOW seconds."""
+        with self._lock:
+            now = time.monotonic()
+            while self._completed and self._completed[0] < now - DRAIN_WINDOW:
+                self._completed.popleft()
+            return len(self._completed) * 60 / max(1.0, min(DRAIN_WINDOW, now - self._started))
+
+    def stats(self) -> dict:
+        rate = self.drain_rate()
+        with self._lock:
+            backlog = len(self._queue) + len(self._waiting)
+            users = len({user_id for _, user_id, _, _ in self._queue + self._waiting})
+            retrying = len(self._waiting)
+        return {
+            "backlog": backlog,
+            "retrying": retrying,
+            "users_with_backlog": users,
+            "completed": self.completed,
+            "failed": self.failed,
+            "drain_rate_per_minute": round(rate, 2),
+            "eta_minutes": round(backlog / rate, 1) if rate else None,
+            "last_scan": self.last_scan,
+            "budget": self.budget.stats(),
+        }
+
+
+_worker = None
+
+
+def get_backfill_worker() -> BackfillWorker | None:
+    return _worker
+
+
+def start_backfill_worker() -> BackfillWorker | None:
+    """Starts the worker thread if NEXTPATH_BACKFILL is set."""
+    global _worker
+    if _worker is None and backfill_enabled():
+        _worker = BackfillWorker()
+        _worker.start()
+    return _worker
+
+
+def backfill_stats() -> dict:
+    if _worker is None:
+        return {"enabled": False}
+    return {"enabled": True, **_worker.stats()}
+
+
+def fill_subtopic(user_id, phase_idx, milestone_idx, subtopic_idx) -> bool:
+    """Generates the test of one subtopic right away, retrying transient errors, and saves it."""
+    worker = BackfillWorker(budget=LLMBudget(per_minute=60))
+    roadmap = load_roadmap(get_roadmap_path(user_id))
+    if roadmap is None:
+        print(f"No roadmap found for user {user_id}")
+        return False
+    worker._roadmaps[user_id] = roadmap
+    subtopic = roadmap.at(phase_idx, milestone_idx, subtopic_idx)
+    item = {"user_id": user_id, "subtopic_id": subtopic.subtopic_id, "title": subtopic.title,
+            "indexes": subtopic.indexes, "key": subtopic.key, "attempt": 0, "delay": None}
+    if worker._journal(user_id).is_done(item["subtopic_id"]):
+        print(f"Subtopic {item['subtopic_id']} already has a test")
+        return True
+    heapq.heappush(worker._queue, ((0, 0), user_id, item["subtopic_id"], item))
+    worker.drain(scan=False)
+    return worker.completed == 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill pending and missing subtopic tests")
+    parser.add_argument("--once", action="store_true", help="drain the current backlog and exit")
+    parser.add_argument("--budget", type=float, help="LLM requests per minute")
+    parser.add_argument("--profile", nargs="?", const=profiling.SAMPLE, default=profiling.default_mode(),
+                        choices=[profiling.SAMPLE, profiling.CPROFILE], help="profile the run (see profiling.py)")
+    args = parser.parse_args()
+    worker = BackfillWorker(budget=LLMBudget(args.budget) if args.budget else None)
+    start = time.perf_counter()
+    try:
+        with profiling.profile("backfill", args.profile):
+            if args.once:
+                worker.drain()
+            else:
+                worker.run_forever()
+    except KeyboardInterrupt:
+        worker.stop()
+    print(f"Backfill finished in {time.perf_counter() - start:.1f}s: {worker.stats()}")
+
+
+if __name__ == "__main__":
+    main()
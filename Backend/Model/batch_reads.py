@@ -0,0 +1,160 @@
+"""
+Batch reads of tests and roadmaps for dashboards and teacher views.
+
+Instead of one request per subtopic test or per learner, a batch names many keys and gets
+one response with a result per key, in request order. A failed key gets its own error and
+status while the others succeed: 400 if its userId could name a file outside the data
+folder, 404 if it is missing, 500 if its file is malformed or cannot be read. Keys are grouped by user, the
+test store's partition: each user's legacy tests are checked once and each test file is
+read once however often it is asked for. Users are read in parallel, up to
+NEXTPATH_BATCH_READ_WORKERS (default 8) at a time. Roadmaps come from
+roadmap_model.load_roadmap, so unchanged ones are not parsed again.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import test_store
+from roadmap_model import load_roadmap
+from utils import get_adaptive_roadmap_path, get_roadmap_path, is_safe_id
+
+MAX_BATCH_SIZE = 500
+READ_WORKERS = int(os.getenv("NEXTPATH_BATCH_READ_WORKERS", "8"))
+ROADMAP_VIEWS = ("summary", "roadmap")
+
+
+class BatchError(ValueError):
+    """The batch as a whole is malformed (not a list, too large)."""
+
+
+def _check_size(items, name):
+    if not isinstance(items, list) or not items:
+        raise BatchError(f"{name} must be a non-empty list")
+    if len(items) > MAX_BATCH_SIZE:
+        raise BatchError(f"at most {MAX_BATCH_SIZE} {name} per batch")
+
+
+def _by_user(requests: dict, read):
+    """Runs read(user_id, requests) for every user, in parallel, and merges the results."""
+    results = {}
+    if len(requests) == 1 or READ_WORKERS <= 1:
+        for user_id, keys in requests.items():
+            results.update(read(user_id, keys))
+        return results
+    with ThreadPoolExecutor(max_workers=min(READ_WORKERS, len(requests))) as pool:
+        for partial in pool.map(lambda item: read(*item), requests.items()):
+            results.update(partial)
+    return results
+
+
+def read_tests(items) -> list:
+    """
+    Questions of many tests. Each item is {"userId", "phase", "milestone", "subtopic"};
+    each result is the item with "questions", or with "error" and "status".
+    """
+    _check_size(items, "tests")
+    keys = []
+    requests = {}
+    for item in items:
+        ref = (item.get("userId"), item.get("phase"), item.get("milestone"), item.get("subtopic")) \
+            if isinstance(item, dict) else (None,) * 4
+        if any(part is None or part == "" for part in ref):
+            keys.append(None)
+            continue
+        if not is_safe_id(ref[0]):
+            keys.append("invalid")
+            continue
+        user_id, key = str(ref[0]), test_store.test_key(*ref[1:])
+        keys.append((user_id, key))
+        requests.setdefault(user_id, []).append(key)
+
+    def read(user_id, user_keys):
+        try:
+            tests = test_store.get_tests(user_id, user_keys)
+        except OSError as e:
+            print(f"Batch read of tests of user {user_id} failed: {e}")
+            return {(user_id, key): e for key in user_keys}
+        return {(user_id, key): test for key, test in tests.items()}
+
+    tests = _by_user(requests, read)
+    results = []
+    for item, ref in zip(items, keys):
+        if ref is None:
+            results.append({**(item if isinstance(item, dict) else {}), "status": 400,
+                            "error": "userId, phase, milestone and subtopic are required"})
+            continue
+        if ref == "invalid":
+            results.append({**item, "status": 400, "error": "Invalid userId"})
+            continue
+        test = tests.get(ref)
+        if isinstance(test, OSError):
+            results.append({**item, "status": 500, "error": f"Could not read test: {test}"})
+        elif not isinstance(test, dict):
+            results.append({**item, "status": 404, "error": "Test not found for this topic"})
+        else:
+            results.append({**item, "status": 200, "questions": test.get("mcqs", [])})
+    return results
+
+
+def _values(value):
+    """A view parameter given as "a,b" or ["a", "b"], as a set (None if not given)."""
+    if value is None or value == "":
+        return None
+    parts = value.split(",") if isinstance(value, str) else value
+    return frozenset(str(part).strip() for part in parts if str(part).strip())
+
+
+class MalformedRoadmap(ValueError):
+    """A saved roadmap that is not valid JSON or has no phases."""
+
+
+def _load_roadmap(user_id):
+    """
+    The user's adaptive roadmap, else their original one; None if neither exists. A file
+    that exists but cannot be parsed raises MalformedRoadmap rather than falling through
+    to the other file or reading as missing.
+    """
+    for path in (get_adaptive_roadmap_path(user_id), get_roadmap_path(user_id)):
+        roadmap = load_roadmap(path)
+        if roadmap is not None and roadmap.phases:
+            return roadmap
+        if roadmap is not None or os.path.exists(path):
+            raise MalformedRoadmap(os.path.basename(path))
+    return None
+
+
+def read_roadmaps(user_ids, view="summary", fields=None, phase=None, milestone=None) -> list:
+    """
+    Roadmaps of many users (the adaptive one where there is one), as their outline
+    (view="summary") or as the roadmap narrowed down like ?fields=&phase=&milestone=.
+    """
+    _check_size(user_ids, "userIds")
+    if view not in ROADMAP_VIEWS:
+        raise BatchError(f"view must be one of {', '.join(ROADMAP_VIEWS)}")
+    fields, phases, milestones = _values(fields), _values(phase), _values(milestone)
+
+    def read(user_id, _):
+        try:
+            roadmap = _load_roadmap(user_id)
+            if roadmap is not None:
+                document = roadmap.outline() if view == "summary" else roadmap.project(fields, phases, milestones)
+        except OSError as e:
+            print(f"Batch read of the roadmap of user {user_id} failed: {e}")
+            return {user_id: {"userId": user_id, "status": 500, "error": f"Could not read roadmap: {e}"}}
+        except MalformedRoadmap as e:
+            return {user_id: {"userId": user_id, "status": 500, "error": f"Malformed roadmap: {e}"}}
+        if roadmap is None:
+            return {user_id: {"userId": user_id, "status": 404, "error": "Roadmap not found"}}
+        return {user_id: {"userId": user_id, "status": 200, "roadmap": document}}
+
+    requests = {str(user_id): None for user_id in user_ids if user_id not in (None, "") and is_safe_id(user_id)}
+    roadmaps = _by_user(requests, read)
+    return [
+        roadmaps[str(user_id)] if str(user_id) in requests
+        else {"userId": user_id, "status": 400,
+              "error": "userId is required" if user_id in (None, "") else "Invalid userId"}
+        for user_id in user_ids
+    ]
+
+
+def summarize(results) -> dict:
+    return {"results": results, "errors": sum(1 for result in results if result["status"] != 200)}
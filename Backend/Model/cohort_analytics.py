@@ -0,0 +1,285 @@
+"""
+Incrementally maintained cohort analytics.
+
+Every recorded answer bumps counters instead of being rescanned later. For each answer,
+rows are updated at three levels, each per career and across all careers (career "*"):
+
+    career     accuracy and timing of all answers given by learners of a career
+               (career "*" is the whole platform)
+    subtopic   ... of one subtopic (matched by normalized subtopic name)
+    topic      ... of one topic_label
+
+A row holds attempt and correct counts plus a fixed-bucket histogram of time per
+question, so reading any aggregate is a primary-key lookup whose cost does not depend
+on how many learners or answers there are. Percentiles are estimated from the histogram.
+
+Counters live in SQLite (NEXTPATH_ANALYTICS_DB) like the job store, so every worker
+process updates and reads the same numbers.
+"""
+import os
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from utils import data_path
+
+DEFAULT_DB_PATH = os.getenv("NEXTPATH_ANALYTICS_DB", data_path("analytics.sqlite3"))
+ALL_CAREERS = "*"
+LEVELS = ("career", "subtopic", "topic")
+# Upper bounds (seconds) of the time-per-question buckets; the last bucket is open-ended
+TIME_BUCKETS = (5, 10, 15, 20, 30, 45, 60, 90, 120, 180, 300)
+CAREER_CACHE_SIZE = 10_000
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS answer_stats (
+    level TEXT NOT NULL,
+    career TEXT NOT NULL,
+    name TEXT NOT NULL,
+    display_career TEXT,
+    display_name TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    timed INTEGER NOT NULL DEFAULT 0,
+    time_sum REAL NOT NULL DEFAULT 0,
+    {", ".join(f"t{i} INTEGER NOT NULL DEFAULT 0" for i in range(len(TIME_BUCKETS) + 1))},
+    PRIMARY KEY (level, career, name)
+);
+"""
+
+_BUCKET_COLUMNS = [f"t{i}" for i in range(len(TIME_BUCKETS) + 1)]
+
+
+def normalize(text) -> str:
+    return " ".join(str(text or "").split()).lower()
+
+
+def time_bucket(seconds) -> int:
+    for i, upper in enumerate(TIME_BUCKETS):
+        if seconds <= upper:
+            return i
+    return len(TIME_BUCKETS)
+
+
+class CohortAnalytics:
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def record(self, career, subtopic_name, records):
+        """
+        Adds answer records (dicts with is_correct, topic_label and optional time_taken in
+        seconds) of one subtopic. All counters are updated in one transaction.
+        """
+        rows = {}
+
+        def bump(level, row_career, name, display_name, is_correct, seconds):
+            key = (level, normalize(row_career) if row_career != ALL_CAREERS else ALL_CAREERS, normalize(name))
+            row = rows.get(key)
+            if row is None:
+                row = rows[key] = {"display_career": row_career, "display_name": display_name, "counts": Counter()}
+            counts = row["counts"]
+            counts["attempts"] += 1
+            counts["correct"] += int(bool(is_correct))
+            if seconds is not None:
+                counts["timed"] += 1
+                counts["time_sum"] += seconds
+                counts[_BUCKET_COLUMNS[time_bucket(seconds)]] += 1
+
+        career = career or "Unknown"
+        for record in records:
+            is_correct = record.get("is_correct")
+            seconds = record.get("time_taken")
+            try:
+                seconds = None if seconds is None else max(float(seconds), 0.0)
+            except (TypeError, ValueError):
+                seconds = None
+            if seconds is not None and seconds != seconds:  # NaN
+                seconds = None
+            topic = record.get("topic_label") or ""
+            for row_career in (career, ALL_CAREERS):
+                bump("career", row_career, "", "", is_correct, seconds)
+                bump("subtopic", row_career, subtopic_name, subtopic_name, is_correct, seconds)
+                bump("topic", row_career, topic, topic, is_correct, seconds)
+        if not rows:
+            return
+
+        counters = ["attempts", "correct", "timed", "time_sum"] + _BUCKET_COLUMNS
+        sql = (
+            f"INSERT INTO answer_stats (level, career, name, display_career, display_name, {', '.join(counters)})"
+            f" VALUES (?, ?, ?, ?, ?, {', '.join('?' for _ in counters)})"
+            " ON CONFLICT (level, career, name) DO UPDATE SET"
+            " display_career = excluded.display_career, display_name = excluded.display_name, "
+            + ", ".join(f"{c} = {c} + excluded.{c}" for c in counters)
+        )
+        params = [
+            (*key, row["display_career"], row["display_name"], *(row["counts"][c] for c in counters))
+            for key, row in rows.items()
+        ]
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany(sql, params)
+            conn.execute("COMMIT")
+
+    @staticmethod
+    def _summary(row) -> dict:
+        histogram = [row[c] for c in _BUCKET_COLUMNS]
+        timed = row["timed"]
+        return {
+            "career": row["display_career"] if row["career"] != ALL_CAREERS else ALL_CAREERS,
+            "name": row["display_name"],
+            "attempts": row["attempts"],
+            "correct": row["correct"],
+            "accuracy": round(row["correct"] / row["attempts"] * 100, 2) if row["attempts"] else None,
+            "time_per_question": {
+                "count": timed,
+                "mean": round(row["time_sum"] / timed, 2) if timed else None,
+                "p50": _histogram_percentile(histogram, 0.5),
+                "p90": _histogram_percentile(histogram, 0.9),
+                "histogram": [
+                    {"le": upper, "count": count}
+                    for upper, count in zip(list(TIME_BUCKETS) + [None], histogram)
+                ],
+            },
+        }
+
+    def get(self, level, career=ALL_CAREERS, name="") -> dict | None:
+        """One aggregate: a single primary-key lookup."""
+        career_key = ALL_CAREERS if career in (None, "", ALL_CAREERS) else normalize(career)
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM answer_stats WHERE level = ? AND career = ? AND name = ?",
+                (level, career_key, normalize(name)),
+            ).fetchone()
+        return None if row is None else {"level": level, **self._summary(row)}
+
+    def top(self, level, career=ALL_CAREERS, limit=50, order_by="attempts") -> list[dict]:
+        """
+        The most attempted (or lowest-accuracy) rows of one level and career.
+
+        Cost is bounded by the number of distinct careers/subtopics/topics, not by the
+        number of learners.
+        """
+        career_key = ALL_CAREERS if career in (None, "", ALL_CAREERS) else normalize(career)
+        if level == "career":
+            career_key = None  # list every career
+        order = "CAST(correct AS REAL) / attempts ASC" if order_by == "accuracy" else "attempts DESC"
+        with self._connect() as conn:
+            if career_key is None:
+                rows = conn.execute(
+                    f"SELECT * FROM answer_stats WHERE level = 'career' ORDER BY {order} LIMIT ?", (limit,)
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    f"SELECT * FROM answer_stats WHERE level = ? AND career = ? ORDER BY {order} LIMIT ?",
+                    (level, career_key, limit),
+                ).fetchall()
+        return [{"level": level, **self._summary(row)} for row in rows]
+
+
+def _histogram_percentile(histogram, q):
+    """Upper bound of the bucket holding the q-quantile (None for the open-ended bucket)."""
+    total = sum(histogram)
+    if not total:
+        return None
+    running = 0
+    for upper, count in zip(list(TIME_BUCKETS) + [None], histogram):
+        running += count
+        if running >= q * total:
+            return upper
+    return None
+
+
+_analytics = None
+_analytics_lock = threading.Lock()
+_career_cache = {}
+
+
+def get_analytics() -> CohortAnalytics:
+    global _analytics
+    with _analytics_lock:
+        if _analytics is None:
+            _analytics = CohortAnalytics()
+        return _analytics
+
+
+def query(level, args) -> tuple[dict, int]:
+    """
+    The /api/analytics/<level> response for query args: one aggregate with ?name= (and
+    optionally ?career=), else the top rows of the level (?limit=, ?orderBy=). Returns
+    (body, status).
+    """
+    if level not in LEVELS:
+        return {"error": f"level must be one of {', '.join(LEVELS)}"}, 400
+    career = args.get("career", ALL_CAREERS)
+    name = args.get("name")
+    if level == "career" and name is None and "career" in args:
+        name = ""
+    if name is not None:
+        stats = get_analytics().get(level, career, name)
+        if stats is None:
+            return {"error": "No answers recorded for this selection"}, 404
+        return stats, 200
+    try:
+        limit = int(args.get("limit", 50))
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return {"error": "limit must be a positive integer"}, 400
+    limit = min(limit, 500)
+    return {
+        "level": level,
+        "career": career,
+        "results": get_analytics().top(level, career, limit, args.get("orderBy", "attempts")),
+    }, 200
+
+
+def career_for(user_id):
+    """Career of a user (feature store first, then the database), cached per process."""
+    user_id = str(user_id)
+    if user_id not in _career_cache:
+        from postgres_data_fuction import career_choice
+        try:
+            career = career_choice(user_id)
+        except Exception as e:
+            print(f"Career lookup failed for user {user_id}: {e}")
+            return None  # not cached, so the next answer tries again
+        if len(_career_cache) >= CAREER_CACHE_SIZE:
+            _career_cache.clear()
+        _career_cache[user_id] = career
+    return _career_cache[user_id]
+
+
+def record_answers(user_id, subtopic_name, records, career=None):
+    """Hook for the answer stores. Analytics never fails the write that triggered it."""
+    try:
+        get_analytics().record(career or career_for(user_id), subtopic_name, records)
+    except Exception as e:
+        print(f"Could not update cohort analytics for user {user_id}: {e}")
+
+
+def record_test_answers(user_id, test, subtopic, records):
+    """
+    record_answers for answers to a stored test. Every answer path names the subtopic by
+    the test's title (its ID only if the test has none), so one subtopic is one row.
+    """
+    record_answers(user_id, (test or {}).get("subtopic_name") or subtopic, records,
+                   career=(test or {}).get("career_title"))
@@ -0,0 +1,303 @@
+"""
+Exports the per-user JSON stores to Parquet datasets for analytics.
+
+    scores/       one row per recorded answer   (users_data/Test_scores_data/*_Scores.json)
+    tests/        one row per generated MCQ     (users_data/Test_data/<user>/, see test_store)
+    adaptations/  one row per adaptation event  (users_data/Adaptations/*_adapt.json)
+
+Each source file becomes one Parquet file, <dataset>/user_bucket=NN/<user_id>.parquet
+(hive partitioning, 64 buckets), so a changed user only rewrites their own file and
+pyarrow.dataset / DuckDB can read a whole dataset directly. Files are converted by a
+process pool one at a time, which bounds memory by the largest single user file times
+the number of workers.
+
+Runs are incremental: _export_state.json in the output directory remembers the mtime
+and size of every exported source file, and unchanged files are skipped. Exports of
+users whose source file disappeared are removed.
+
+    python export_parquet.py --output users_data/Analytics --workers 4 [--full]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import test_store
+from json_store import atomic_write_json, read_json
+from utils import DATA_ROOT
+
+DATA_DIR = DATA_ROOT
+OUTPUT_DIR = os.path.join(DATA_DIR, "Analytics")
+STATE_FILE = "_export_state.json"
+USER_BUCKETS = 64
+STATE_SAVE_EVERY = 500
+
+SCORES_SCHEMA = pa.schema([
+    ("user_id", pa.string()),
+    ("phase", pa.string()),
+    ("milestone_id", pa.string()),
+    ("subtopic_id", pa.string()),
+    ("subtopic_name", pa.string()),
+    ("attempted_at", pa.string()),
+    ("question_number", pa.int32()),
+    ("question", pa.string()),
+    ("user_answer", pa.string()),
+    ("correct_answer", pa.string()),
+    ("is_correct", pa.bool_()),
+    ("topic_label", pa.string()),
+    ("difficulty", pa.string()),
+    ("answered_at", pa.string()),
+])
+
+TESTS_SCHEMA = pa.schema([
+    ("user_id", pa.string()),
+    ("phase", pa.string()),
+    ("milestone_id", pa.string()),
+    ("subtopic_id", pa.string()),
+    ("subtopic_name", pa.string()),
+    ("created_at", pa.string()),
+    ("question_index", pa.int32()),
+    ("question", pa.string()),
+    ("options", pa.string()),  # JSON object of option -> text
+    ("answer", pa.string()),
+    ("topic_label", pa.string()),
+    ("difficulty", pa.string()),
+])
+
+ADAPTATIONS_SCHEMA = pa.schema([
+    ("user_id", pa.string()),
+    ("timestamp", pa.string()),
+    ("adaptation_type", pa.string()),
+    ("affected_section", pa.string()),
+    ("change_description", pa.string()),
+    ("reason", pa.string()),
+])
+
+
+def _str(value):
+    return None if value is None else str(value)
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _nested_subtopics(document):
+    """Yields (phase, milestone_id, subtopic_id, entry) from a {phase: {milestone: {subtopic: entry}}} file."""
+    if not isinstance(document, dict):
+        return
+    for phase, milestones in document.items():
+        if not isinstance(milestones, dict):
+            continue
+        for milestone_id, subtopics in milestones.items():
+            if not isinstance(subtopics, dict):
+                continue
+            for subtopic_id, entry in subtopics.items():
+                if isinstance(entry, dict):
+                    yield phase, milestone_id, subtopic_id, entry
+
+
+def score_rows(user_id, document):
+    for phase, milestone_id, subtopic_id, entry in _nested_subtopics(document):
+        for record in entry.get("answers", []):
+            yield {
+                "user_id": user_id,
+                "phase": phase,
+                "milestone_id": milestone_id,
+                "subtopic_id": subtopic_id,
+                "subtopic_name": _str(entry.get("subtopic_name")),
+                "attempted_at": _str(entry.get("attempted_at")),
+                "question_number": _int(record.get("question_number")),
+                "question": _str(record.get("question")),
+                "user_answer": _str(record.get("user_answer")),
+                "correct_answer": _str(record.get("correct_answer")),
+                "is_correct": bool(record.get("is_correct")),
+                "topic_label": _str(record.get("topic_label")),
+                "difficulty": _str(record.get("difficulty")),
+                "answered_at": _str(record.get("answered_at")),
+            }
+
+
+def test_rows(user_id, document):
+    for phase, milestone_id, subtopic_id, test in _nested_subtopics(document):
+        for i, mcq in enumerate(test.get("mcqs", [])):
+            yield {
+                "user_id": user_id,
+                "phase": phase,
+                "milestone_id": milestone_id,
+                "subtopic_id": subtopic_id,
+                "subtopic_name": _str(test.get("subtopic_name")),
+                "created_at": _str(test.get("created_at")),
+                "question_index": i,
+                "question": _str(mcq.get("question")),
+                "options": json.dumps(mcq.get("options", {}), ensure_ascii=False),
+                "answer": _str(mcq.get("answer")),
+                "topic_label": _str(mcq.get("topic_label")),
+                "difficulty": _str(mcq.get("difficulty")),
+            }
+
+
+def adaptation_rows(user_id, document):
+    if not isinstance(document, dict):
+        return
+    for event in document.get("adaptations", []):
+        yield {"user_id": user_id, **{field: _str(event.get(field)) for field in ADAPTATIONS_SCHEMA.names[1:]}}
+
+
+# dataset name -> (source folder under the data dir, file suffix, row builder, schema);
+# a suffix of None means one directory per user (the test store)
+DATASETS = {
+    "scores": ("Test_scores_data", "_Scores.json", score_rows, SCORES_SCHEMA),
+    "tests": ("Test_data", None, test_rows, TESTS_SCHEMA),
+    "adaptations": ("Adaptations", "_adapt.json", adaptation_rows, ADAPTATIONS_SCHEMA),
+}
+
+
+def user_bucket(user_id) -> int:
+    # crc32 rather than hash(): the bucket must not change between processes and runs
+    return zlib.crc32(str(user_id).encode("utf-8")) % USER_BUCKETS
+
+
+def part_path(output_dir, dataset, user_id):
+    return os.path.join(output_dir, dataset, f"user_bucket={user_bucket(user_id):02d}", f"{user_id}.parquet")
+
+
+def export_file(dataset, source_path, user_id, output_dir) -> int:
+    """Converts one source file into its Parquet part. Returns the number of rows written."""
+    _, _, build_rows, schema = DATASETS[dataset]
+    target = part_path(output_dir, dataset, user_id)
+    document = test_store.load_user_dir(source_path) if os.path.isdir(source_path) else read_json(source_path)
+    rows = list(build_rows(user_id, document)) if document is not None else []
+    if not rows:
+        if os.path.exists(target):
+            os.remove(target)
+        return 0
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix=".", suffix=".parquet.tmp")
+    os.close(fd)
+    try:
+        pq.write_table(pa.Table.from_pylist(rows, schema=schema), tmp_path, compression="zstd")
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return len(rows)
+
+
+def _scan_sources(data_dir, dataset):
+    """Yields (user_id, path, signature) for every source file (or user directory) of a dataset."""
+    folder, suffix, _, _ = DATASETS[dataset]
+    try:
+        entries = os.scandir(os.path.join(data_dir, folder))
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if suffix is None and entry.is_dir():
+                yield entry.name, entry.path, _dir_signature(entry.path)
+            elif suffix is not None and entry.is_file() and entry.name.endswith(suffix):
+                stat = entry.stat()
+                yield entry.name[:-len(suffix)], entry.path, [stat.st_mtime_ns, stat.st_size]
+
+
+def _dir_signature(path):
+    """[newest mtime, file count] of a user's directory: changes when a test is added or replaced."""
+    newest, count = 0, 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if name.endswith(test_store.TEST_SUFFIX) and not name.startswith("."):
+                newest = max(newest, os.stat(os.path.join(root, name)).st_mtime_ns)
+                count += 1
+    return [newest, count]
+
+
+def _remove_orphan_parts(output_dir, dataset, user_ids) -> int:
+    """Deletes parts whose source file is gone (a full export starts without state)."""
+    removed = 0
+    for root, _, files in os.walk(os.path.join(output_dir, dataset)):
+        for name in files:
+            if name.endswith(".parquet") and name[:-len(".parquet")] not in user_ids:
+                os.remove(os.path.join(root, name))
+                removed += 1
+    return removed
+
+
+def export_all(data_dir=DATA_DIR, output_dir=OUTPUT_DIR, workers=None, full=False, datasets=None) -> dict:
+    """Exports every new or changed source file. Returns per-dataset counters."""
+    state_path = os.path.join(output_dir, STATE_FILE)
+    state = {} if full else read_json(state_path, {})
+    summary = {}
+    pending = []
+    for dataset in datasets or DATASETS:
+        exported = state.setdefault(dataset, {})
+        seen = set()
+        counters = summary[dataset] = {"exported": 0, "skipped": 0, "removed": 0, "rows": 0, "failed": 0}
+        for user_id, path, signature in _scan_sources(data_dir, dataset):
+            seen.add(user_id)
+            if exported.get(user_id) == signature:
+                counters["skipped"] += 1
+            else:
+                pending.append((dataset, user_id, path, signature))
+        for user_id in set(exported) - seen:
+            target = part_path(output_dir, dataset, user_id)
+            if os.path.exists(target):
+                os.remove(target)
+            del exported[user_id]
+            counters["removed"] += 1
+        if full:
+            counters["removed"] += _remove_orphan_parts(output_dir, dataset, seen)
+
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(export_file, dataset, path, user_id, output_dir): (dataset, user_id, signature)
+            for dataset, user_id, path, signature in pending
+        }
+        for future in as_completed(futures):
+            dataset, user_id, signature = futures[future]
+            try:
+                summary[dataset]["rows"] += future.result()
+                summary[dataset]["exported"] += 1
+                state[dataset][user_id] = signature
+            except Exception as e:
+                summary[dataset]["failed"] += 1
+                print(f"Failed to export {dataset} for user {user_id}: {e}")
+            done += 1
+            if done % STATE_SAVE_EVERY == 0:
+                atomic_write_json(state_path, state, indent=None)
+
+    os.makedirs(output_dir, exist_ok=True)
+    atomic_write_json(state_path, state, indent=None)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export scores, tests and adaptations to Parquet.")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="Folder holding Test_scores_data, Test_data, Adaptations.")
+    parser.add_argument("--output", default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count).")
+    parser.add_argument("--full", action="store_true", help="Re-export every file, ignoring the last run.")
+    parser.add_argument("--dataset", action="append", choices=list(DATASETS), help="Limit to these datasets.")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    summary = export_all(args.data_dir, args.output, args.workers, args.full, args.dataset)
+    for dataset, counters in summary.items():
+        print(f"{dataset}: {counters['exported']} exported ({counters['rows']} rows), "
+              f"{counters['skipped']} unchanged, {counters['removed']} removed, {counters['failed']} failed")
+    print(f"Done in {time.perf_counter() - start:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Fake LLM and database backends for local load testing.
+
+Enable them with environment variables so the servers and generators can be
+exercised without a Gemini key or a running PostgreSQL instance:
+
+    NEXTPATH_FAKE_LLM=1            answer every prompt with canned JSON
+    NEXTPATH_FAKE_LLM_LATENCY=2.0  seconds each fake LLM call takes
+    NEXTPATH_FAKE_LLM_ERROR_RATE=0.2   share of fake LLM calls failing with 503 UNAVAILABLE
+    NEXTPATH_FAKE_LLM_RETRY_AFTER=1    Retry-After header (seconds) the fake 503s carry
+    NEXTPATH_FAKE_LLM_SLOW_RATE=0.05   share of fake LLM calls that hit the slow tail ...
+    NEXTPATH_FAKE_LLM_SLOW_LATENCY=10  ... and take this many seconds instead
+    NEXTPATH_FAKE_LLM_TOKENS_PER_SECOND=200  also spend len(response)/4 tokens at this output speed
+    NEXTPATH_FAKE_LLM_INVALID_RATE=0.1 share of generated subtopics/MCQs that violate their schema
+    NEXTPATH_FAKE_DB=1             serve psychometry rows from the CSV dataset
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+from datetime import datetime
+
+import httpx
+import pandas as pd
+from google.genai import errors as genai_errors
+
+DATASET_CSV = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "Load_data_into_postgre", "psychometry_dataset.csv",
+)
+
+# Same mapping insert_values_in_postgresDB.py uses, lower-cased the way
+# PostgreSQL folds the unquoted column names.
+COLUMN_MAPPING = {
+    "ID": "id",
+    "Age": "age",
+    "Gender": "gender",
+    "Education Level": "education",
+    "Openness": "openness",
+    "Conscientiousness": "conscientiousness",
+    "Extraversion": "extraversion",
+    "Agreeableness": "agreeableness",
+    "Neuroticism": "neuroticism",
+    "Emotional Intelligence": "emotional",
+    "Risk Tolerance": "risk_tolerance",
+    "Stress Resilience": "stress_resilience",
+    "Decision-Making Style": "decision_making_style",
+    "Motivation Type": "motivation_type",
+    "Logical Reasoning": "logical_reasoning",
+    "Verbal Ability": "verbal_ability",
+    "Numerical Ability": "numerical_ability",
+    "Creativity": "creativity",
+    "Memory/Attention Span": "memory_attention_span",
+    "Learning Style": "learning_style",
+    "Analytical Thinking": "analytical",
+    "Communication": "communication",
+    "Leadership": "leadership",
+    "Problem-Solving": "proble_solving",
+    "Technical/Programming": "technical_programming",
+    "Artistic/Design": "artistic_design",
+    "Empathy & Counseling Ability": "empathy_and_counciling_ability",
+    "Negotiation/Persuasion": "negotiation_persuation",
+    "Entrepreneurial Drive": "entrepreneurial_drive",
+    "Domain-Specific Skill": "domain_specefic_skills",
+    "Interests": "interests",
+    "Preferred Work Environment": "prefered_work_environment",
+    "Values & Motivators": "values_and_motivators",
+    "Career Recommendation": "career_choice",
+}
+
+_dataset = None
+
+
+def _flag(name):
+    return os.getenv(name, "").lower() in ("1", "true", "yes")
+
+
+def fake_llm_enabled() -> bool:
+    return _flag("NEXTPATH_FAKE_LLM")
+
+
+def fake_db_enabled() -> bool:
+    return _flag("NEXTPATH_FAKE_DB")
+
+
+def fake_llm_latency() -> float:
+    return float(os.getenv("NEXTPATH_FAKE_LLM_LATENCY", "1.0"))
+
+
+def fake_llm_call_latency() -> float:
+    """Latency of one fake call, drawing the slow tail at NEXTPATH_FAKE_LLM_SLOW_RATE."""
+    if random.random() < float(os.getenv("NEXTPATH_FAKE_LLM_SLOW_RATE", "0")):
+        return float(os.getenv("NEXTPATH_FAKE_LLM_SLOW_LATENCY", "10"))
+    return fake_llm_latency()
+
+
+def fake_llm_error_rate() -> float:
+    return float(os.getenv("NEXTPATH_FAKE_LLM_ERROR_RATE", "0"))
+
+
+def _invalid() -> bool:
+    return random.random() < float(os.getenv("NEXTPATH_FAKE_LLM_INVALID_RATE", "0"))
+
+
+# --- Fake database ---
+
+def load_dataset() -> pd.DataFrame:
+    global _dataset
+    if _dataset is None:
+        df = pd.read_csv(DATASET_CSV)
+        _dataset = df.rename(columns=COLUMN_MAPPING)
+    return _dataset
+
+
+def fake_psychometry_data(individual_id) -> pd.DataFrame | None:
+    """Returns one dataset row for any numeric ID, wrapping around the CSV."""
+    try:
+        row_idx = int(individual_id) % len(load_dataset())
+    except (TypeError, ValueError):
+        return None
+    return load_dataset().iloc[[row_idx]].reset_index(drop=True)
+
+
+def fake_career_choice(individual_id):
+    data = fake_psychometry_data(individual_id)
+    return None if data is None else data["career_choice"].iloc[0]
+
+
+# --- Fake LLM ---
+
+def _prompt_field(prompt, name, default=""):
+    match = re.search(rf"-\s*{name}:\s*(.+)", prompt)
+    return match.group(1).strip() if match else default
+
+
+def _fake_mcqs(prompt) -> dict:
+    topics = re.findall(r"'([^']+)'", _prompt_field(prompt, "topics", "[]")) or ["General"]
+    difficulties = ["easy", "easy", "medium", "hard"]
+    mcqs = []
+    for i, topic in enumerate(topics):
+        mcqs.append({
+            "question": f"Which statement about {topic} is correct?",
+            "options": {"1": "Option A", "2": "Option B", "3": "Option C", "4": "Option D"},
+            "answer": "7" if _invalid() else str(i % 4 + 1),
+            "topic_label": topic,
+            "difficulty": difficulties[i % len(difficulties)],
+        })
+    phase_number = _prompt_field(prompt, "phase_number", "1")
+    return {
+        "phase_number": int(phase_number) if phase_number.isdigit() else phase_number,
+        "milestone_id": _prompt_field(prompt, "milestone_id"),
+        "subtopic_id": _prompt_field(prompt, "subtopic_id"),
+        "subtopic_name": _prompt_field(prompt, "subtopic_name"),
+        "created_at": datetime.now().isoformat(),
+        "mcqs": mcqs,
+    }
+
+
+def _fake_adaptation() -> dict:
+    return {
+        "summary": {"weak_subtopics": [], "strong_subtopics": [], "total_analyzed": 0},
+        "subtopic_changes": [],
+        "overall_strategy": "Keep working through the roadmap in order",
+    }
+
+
+def _fake_roadmap(prompt, phases=2, milestones=2, subtopics=2) -> dict:
+    match = re.search(r"\*\*Target Career:\*\*\s*(.+)", prompt)
+    career = match.group(1).strip() if match else "Software Engineer"
+    roadmap_phases = []
+    for p in range(1, phases + 1):
+        phase_milestones = []
+        for m in range(1, milestones + 1):
+            phase_milestones.append({
+                "milestone_id": f"M{p}.{m}",
+                "milestone_title": f"{career} milestone {p}.{m}",
+                "duration": "4 weeks",
+                "subtopics": [
+                    {
+                        "subtopic_id": f"ST{p}.{m}.{s}",
+                        "title": f"{career} subtopic {p}.{m}.{s}",
+                        "description": "Generated by the fake LLM backend.",
+                        "duration": "3-5 days",
+                        "topic_list": [] if _invalid() else [f"Topic {p}.{m}.{s}.{t}" for t in range(1, 6)],
+                        "resources": [],
+                    }
+                    for s in range(1, subtopics + 1)
+                ],
+            })
+        roadmap_phases.append({
+            "phase_number": p,
+            "phase_name": f"Phase {p}",
+            "duration": f"Months {3 * p - 2}-{3 * p}",
+            "milestones": phase_milestones,
+        })
+    return {
+        "career_title": career,
+        "created_at": datetime.now().isoformat(),
+        "summary": "Fake roadmap for load testing.",
+        "roadmap": {"career_title": career, "phases": roadmap_phases},
+        "personalized_recommendations": {},
+    }
+
+
+def _fake_roadmap_piece(prompt) -> dict:
+    """Responses to the fan-out prompts of roadmap_fanout."""
+    full = _fake_roadmap(prompt)
+    roadmap = full["roadmap"]
+    if "## ROADMAP OUTLINE ONLY" in prompt:
+        return {**roadmap, "phases": [
+            {**phase, "milestones": [
+                {"milestone_id": m["milestone_id"], "milestone_title": m["milestone_title"]}
+                for m in phase["milestones"]
+            ]}
+            for phase in roadmap["phases"]
+        ]}
+    if "## PHASE DETAIL REQUEST" in prompt:
+        match = re.search(r"\*\*Phase to detail:\*\*\s*(\d+)", prompt)
+        number = int(match.group(1)) if match else 1
+        return roadmap["phases"][(number - 1) % len(roadmap["phases"])]
+    return {"summary": full["summary"], "psychometric_analysis": {},
+            "personalized_recommendations": {}, "success_metrics": {}}
+
+
+def _fake_repair(prompt) -> dict:
+    """Answers a schemas.build_repair_prompt request with the fragment made valid."""
+    match = re.search(r"Invalid (\w+):\n(.*)\n\nOutput valid JSON only", prompt, re.S)
+    unit, fragment = match.group(1), json.loads(match.group(2))
+    if unit == "mcq":
+        options = fragment.get("options") if isinstance(fragment.get("options"), dict) else {}
+        options = options or {"1": "Option A", "2": "Option B", "3": "Option C", "4": "Option D"}
+        answer = str(fragment.get("answer"))
+        return {**fragment, "options": options, "answer": answer if answer in options else min(options)}
+    title = fragment.get("title") or "Repaired subtopic"
+    return {**fragment, "title": title, "topic_list": fragment.get("topic_list") or [f"{title} basics"]}
+
+
+def fake_response_text(prompt: str) -> str:
+    """Builds a canned response shaped like what the prompt asks for."""
+    if prompt.startswith("## REPAIR"):
+        payload = _fake_repair(prompt)
+    elif "MCQ" in prompt:
+        payload = _fake_mcqs(prompt)
+    elif re.search(r"## (ROADMAP OUTLINE ONLY|PHASE DETAIL REQUEST|PERSONALIZATION ONLY)", prompt):
+        payload = _fake_roadmap_piece(prompt)
+    elif "AI learning advisor" in prompt:
+        payload = _fake_adaptation()
+    else:
+        payload = _fake_roadmap(prompt)
+    return "```json\n" + json.dumps(payload, indent=2) + "\n```"
+
+
+def _maybe_overloaded():
+    """Raises the error Gemini returns when it is overloaded, at NEXTPATH_FAKE_LLM_ERROR_RATE."""
+    if random.random() >= fake_llm_error_rate():
+        return
+    headers = {}
+    if os.getenv("NEXTPATH_FAKE_LLM_RETRY_AFTER"):
+        headers["Retry-After"] = os.getenv("NEXTPATH_FAKE_LLM_RETRY_AFTER")
+    body = {"error": {"code": 503, "message": "The model is overloaded. Please try again later.",
+                      "status": "UNAVAILABLE"}}
+    raise genai_errors.ServerError(503, body, httpx.Response(503, headers=headers, json=body))
+
+
+def _output_seconds(text) -> float:
+    """Time a model streaming at NEXTPATH_FAKE_LLM_TOKENS_PER_SECOND needs to write `text`."""
+    tokens_per_second = float(os.getenv("NEXTPATH_FAKE_LLM_TOKENS_PER_SECOND", "0"))
+    return len(text) / 4 / tokens_per_second if tokens_per_second > 0 else 0.0
+
+
+def fake_generate(prompt: str) -> str:
+    time.sleep(fake_llm_call_latency())
+    _maybe_overloaded()
+    text = fake_response_text(prompt)
+    time.sleep(_output_seconds(text))
+    return text
+
+
+async def fake_generate_async(prompt: str) -> str:
+    await asyncio.sleep(fake_llm_call_latency())
+    _maybe_overloaded()
+    text = fake_response_text(prompt)
+    await asyncio.sleep(_output_seconds(text))
+    return text
@@ -0,0 +1,340 @@
+"""
+Columnar snapshot of the psychometry_data table.
+
+The build step copies psychometry_data into one typed, memory-mapped column file per
+column under FEATURE_STORE_DIR (NEXTPATH_FEATURE_STORE):
+
+    id                    int64, rows sorted by id
+    age                   int16
+    scores (1-10)         int8, parsed from the TEXT columns; -1 when missing
+    text columns          int32 codes into a per-column dictionary; -1 when missing
+
+meta.json holds the committed row count, the highest id and the dictionaries. Column
+files are append-only and meta.json is replaced atomically after the data is flushed,
+so readers always map a consistent snapshot. A refresh only fetches rows with
+id > max_id; rows changed in place need a --full rebuild, which writes a new
+generation of column files next to the one readers may still have mapped.
+
+Profile fetches and career lookups read from the snapshot instead of querying
+PostgreSQL; callers fall back to the database on a miss. to_frame() returns whole
+decoded columns for bulk readers.
+
+If a column file of the committed generation is missing or shorter than meta.json says
+(a lost file, or a column added to COLUMNS), the next build rebuilds the snapshot.
+
+Run `python feature_store.py` to build or refresh the snapshot.
+"""
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+import fake_backends
+from json_store import atomic_write_json, document_lock, read_json
+from utils import data_path
+
+FEATURE_STORE_DIR = os.getenv("NEXTPATH_FEATURE_STORE", data_path("Feature_store"))
+CHUNK_SIZE = 50_000
+MISSING = -1
+
+# Column order and names of psychometry_data (see fake_backends.COLUMN_MAPPING)
+COLUMNS = list(fake_backends.COLUMN_MAPPING.values())
+INT_COLUMNS = {"id": np.int64, "age": np.int16}
+SCORE_COLUMNS = [
+    "openness", "conscientiousness", "extraversion", "agreeableness", "neuroticism",
+    "emotional", "risk_tolerance", "stress_resilience", "logical_reasoning", "verbal_ability",
+    "numerical_ability", "creativity", "memory_attention_span", "analytical", "communication",
+    "leadership", "proble_solving", "technical_programming", "artistic_design",
+    "empathy_and_counciling_ability", "negotiation_persuation", "entrepreneurial_drive",
+]
+TEXT_COLUMNS = [c for c in COLUMNS if c not in INT_COLUMNS and c not in SCORE_COLUMNS]
+
+
+def column_dtype(column):
+    if column in INT_COLUMNS:
+        return np.dtype(INT_COLUMNS[column])
+    if column in SCORE_COLUMNS:
+        return np.dtype(np.int8)
+    return np.dtype(np.int32)
+
+
+def _column_path(directory, column, generation):
+    return os.path.join(directory, f"{column}.{generation}.bin")
+
+
+def _meta_path(directory):
+    return os.path.join(directory, "meta.json")
+
+
+def _empty_meta(generation=0):
+    return {
+        "generation": generation,
+        "rows": 0,
+        "max_id": None,
+        "columns": {column: str(column_dtype(column)) for column in COLUMNS},
+        "dictionaries": {column: [] for column in TEXT_COLUMNS},
+    }
+
+
+# --- Build ---
+
+def _fetch_chunks(after_id, chunk_size):
+    """Yields DataFrames of psychometry_data rows with id > after_id, in id order."""
+    if fake_backends.fake_db_enabled():
+        dataset = fake_backends.load_dataset().sort_values("id")
+        if after_id is not None:
+            dataset = dataset[dataset["id"] > after_id]
+        for start in range(0, len(dataset), chunk_size):
+            yield dataset.iloc[start:start + chunk_size]
+        return
+
+    from postgres_data_fuction import engine
+    last_id = after_id if after_id is not None else np.iinfo(np.int64).min
+    while True:
+        # Keyset pagination keeps every chunk an index range scan
+        chunk = pd.read_sql(
+            "SELECT * FROM psychometry_data WHERE ID > %s ORDER BY ID LIMIT %s",
+            engine, params=(int(last_id), chunk_size),
+        )
+        if chunk.empty:
+            return
+        yield chunk
+        last_id = int(chunk["id"].iloc[-1])
+
+
+def _encode_chunk(chunk, meta):
+    """Typed column arrays for a chunk; extends the dictionaries with new values."""
+    encoded = {}
+    for column in COLUMNS:
+        dtype = column_dtype(column)
+        values = chunk[column] if column in chunk else pd.Series([None] * len(chunk))
+        if column in TEXT_COLUMNS:
+            dictionary = meta["dictionaries"][column]
+            lookup = {value: code for code, value in enumerate(dictionary)}
+            codes = np.full(len(chunk), MISSING, dtype=dtype)
+            for i, value in enumerate(values):
+                if value is None or (isinstance(value, float) and np.isnan(value)):
+                    continue
+                value = str(value)
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(dictionary)
+                    dictionary.append(value)
+                codes[i] = code
+            encoded[column] = codes
+        else:
+            numbers = pd.to_numeric(values, errors="coerce")
+            encoded[column] = numbers.fillna(MISSING).to_numpy().astype(dtype)
+    return encoded
+
+
+def _columns_complete(directory, meta) -> bool:
+    """Whether every column file of meta's generation holds at least its committed rows."""
+    for column in COLUMNS:
+        try:
+            size = os.path.getsize(_column_path(directory, column, meta["generation"]))
+        except FileNotFoundError:
+            return False
+        if size < meta["rows"] * column_dtype(column).itemsize:
+            return False
+    return True
+
+
+def build(directory: str = FEATURE_STORE_DIR, full: bool = False, chunk_size: int = CHUNK_SIZE) -> dict:
+    """
+    Appends psychometry_data rows newer than the snapshot (or rebuilds it with full=True).
+
+    Returns {"added": rows appended, "rows": total rows}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    with document_lock(_meta_path(directory)):
+        meta = read_json(_meta_path(directory))
+        if meta is not None and not full and not _columns_complete(directory, meta):
+            print("Feature store column files are missing or incomplete; rebuilding the snapshot.")
+            full = True
+        # A full rebuild publishes its new generation only when it is complete
+        rebuilding = meta is not None and full
+        if meta is None or full:
+            meta = _empty_meta(0 if meta is None else meta["generation"] + 1)
+            for column in COLUMNS:
+                open(_column_path(directory, column, meta["generation"]), "wb").close()
+        else:
+            # Drop bytes of a build that crashed before committing meta.json
+            for column in COLUMNS:
+                with open(_column_path(directory, column, meta["generation"]), "r+b") as f:
+                    f.truncate(meta["rows"] * column_dtype(column).itemsize)
+
+        added = 0
+        for chunk in _fetch_chunks(meta["max_id"], chunk_size):
+            encoded = _encode_chunk(chunk, meta)
+            for column, array in encoded.items():
+                with open(_column_path(directory, column, meta["generation"]), "ab") as f:
+                    f.write(array.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            added += len(chunk)
+            meta["rows"] += len(chunk)
+            meta["max_id"] = int(encoded["id"][-1])
+            if not rebuilding:
+                atomic_write_json(_meta_path(directory), meta, indent=None)
+        if rebuilding or added == 0:
+            atomic_write_json(_meta_path(directory), meta, indent=None)
+        if rebuilding:
+            current = {os.path.basename(_column_path(directory, c, meta["generation"])) for c in COLUMNS}
+            for name in os.listdir(directory):
+                if name.endswith(".bin") and name not in current:
+                    try:
+                        os.remove(os.path.join(directory, name))
+                    except OSError:
+                        pass  # still mapped by a reader on Windows; the next full build retries
+    return {"added": added, "rows": meta["rows"]}
+
+
+# --- Read ---
+
+class _Snapshot:
+    """Column maps and decoders of one committed meta.json."""
+
+    __slots__ = ("meta", "columns", "decoders")
+
+    def __init__(self, directory, meta):
+        self.meta = meta
+        self.columns = {
+            column: np.memmap(_column_path(directory, column, meta["generation"]), dtype=column_dtype(column),
+                              mode="r", shape=(meta["rows"],))
+            if meta["rows"] else np.empty(0, dtype=column_dtype(column))
+            for column in COLUMNS
+        }
+        # Trailing None so that MISSING (-1) decodes to None
+        self.decoders = {
+            column: np.array(meta["dictionaries"][column] + [None], dtype=object) for column in TEXT_COLUMNS
+        }
+
+
+class FeatureStore:
+    """Read-only view of the latest committed snapshot."""
+
+    def __init__(self, directory: str = FEATURE_STORE_DIR):
+        self.directory = directory
+        self._meta_mtime = None
+        self._lock = threading.Lock()
+        self._snapshot = _Snapshot(directory, _empty_meta())
+        self.reload()
+
+    def reload(self) -> bool:
+        """Maps the snapshot again if meta.json changed. Returns True if a snapshot is available."""
+        try:
+            mtime = os.stat(_meta_path(self.directory)).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        with self._lock:
+            if mtime != self._meta_mtime:
+                meta = read_json(_meta_path(self.directory))
+                if meta is None:
+                    return self._meta_mtime is not None
+                try:
+                    snapshot = _Snapshot(self.directory, meta)
+                except (OSError, ValueError) as e:  # column file missing or short
+                    print(f"Feature store snapshot unreadable ({e}); run feature_store.py to rebuild it.")
+                    return self._meta_mtime is not None
+                # Swapped in one assignment, so readers never mix two snapshots
+                self._snapshot = snapshot
+                self._meta_mtime = mtime
+        return True
+
+    @property
+    def meta(self) -> dict:
+        return self._snapshot.meta
+
+    def __len__(self):
+        return self._snapshot.meta["rows"]
+
+    def column(self, name) -> np.ndarray:
+        """Raw typed column (codes for text columns, -1 for missing)."""
+        return self._snapshot.columns[name]
+
+    def dictionary(self, name) -> list:
+        return self._snapshot.meta["dictionaries"][name]
+
+    def decode(self, name, codes) -> np.ndarray:
+        return self._snapshot.decoders[name][np.asarray(codes)]
+
+    @staticmethod
+    def _row_index(snapshot, individual_id) -> int | None:
+        ids = snapshot.columns["id"]
+        try:
+            individual_id = int(individual_id)
+        except (TypeError, ValueError):
+            return None
+        pos = int(np.searchsorted(ids, individual_id))
+        return pos if pos < len(ids) and ids[pos] == individual_id else None
+
+    def to_frame(self, rows=None, columns=None) -> pd.DataFrame:
+        """Decoded rows (all by default) with psychometry_data column names and order."""
+        snapshot = self._snapshot
+        rows = slice(None) if rows is None else rows
+        data = {}
+        for column in columns or COLUMNS:
+            values = np.asarray(snapshot.columns[column][rows])
+            if column in TEXT_COLUMNS:
+                data[column] = snapshot.decoders[column][values]
+            else:
+                data[column] = pd.array(np.where(values == MISSING, None, values), dtype="Int64")
+        return pd.DataFrame(data)
+
+    def get_record(self, individual_id) -> dict | None:
+        """One decoded row as a dict, or None if the id is not in the snapshot."""
+        snapshot = self._snapshot
+        pos = self._row_index(snapshot, individual_id)
+        if pos is None:
+            return None
+        record = {}
+        for column in COLUMNS:
+            value = int(snapshot.columns[column][pos])
+            if column in TEXT_COLUMNS:
+                record[column] = snapshot.decoders[column][value]
+            else:
+                record[column] = None if value == MISSING else value
+        return record
+
+    def get_profile(self, individual_id) -> pd.DataFrame | None:
+        """One-row DataFrame like SELECT * FROM psychometry_data WHERE ID = ..., or None."""
+        record = self.get_record(individual_id)
+        return None if record is None else pd.DataFrame([record], columns=COLUMNS)
+
+    def career_choice(self, individual_id):
+        snapshot = self._snapshot
+        pos = self._row_index(snapshot, individual_id)
+        return None if pos is None else snapshot.decoders["career_choice"][int(snapshot.columns["career_choice"][pos])]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_feature_store() -> FeatureStore | None:
+    """Shared store, or None if no snapshot has been built."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = FeatureStore()
+    return _store if _store.reload() else None
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="Build or refresh the psychometry_data feature store.")
+    parser.add_argument("--full", action="store_true", help="Rebuild from scratch instead of appending new rows.")
+    parser.add_argument("--dir", default=FEATURE_STORE_DIR)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = build(args.dir, full=args.full)
+    print(f"Added {result['added']} row(s), {result['rows']} in snapshot ({time.perf_counter() - start:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
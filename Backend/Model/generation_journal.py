@@ -0,0 +1,124 @@
+"""
+Per-user journal of test generation progress.
+
+store_questionnaire_data used to rewrite the whole <user>_Tests.json after every
+subtopic and scan it with any() to decide what was already done. The journal replaces
+the scan: every finished subtopic is one JSON line appended (and fsynced) to
+<user>_Tests.journal.jsonl, and the completed subtopic IDs are kept in a set. A crashed
+or rate-limited run reopens the journal and carries on with the subtopics not in it;
+nothing completed is generated or written again. The tests themselves live in
+test_store; the journal records their keys and the subtopics left pending.
+
+A crash can tear the last line. Lines that do not parse are skipped, never cut off, so
+no entry after them is lost, and the next append first ends the torn line with a
+newline. A user without a journal is seeded from the tests already in the store.
+Long-lived readers (the backfill worker) call refresh(), which reads only the lines other
+processes appended since the last read.
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+import test_store
+from json_store import document_lock
+
+DONE = "done"
+PENDING = "pending"
+
+
+def journal_path(user_id, root=None) -> str:
+    return os.path.join(root or test_store.TEST_DATA_FOLDER, f"{user_id}_Tests.journal.jsonl")
+
+
+class GenerationJournal:
+    def __init__(self, path: str):
+        self.path = path
+        self.keys = {}  # subtopic_id -> test_store key, in completion order
+        self._pending = set()
+        self._offset = 0  # bytes of the file already applied
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @classmethod
+    def for_user(cls, user_id, root=None) -> "GenerationJournal":
+        journal = cls(journal_path(user_id, root))
+        if not os.path.exists(journal.path):
+            journal.seed(test_store.iter_keys(user_id, root))
+        return journal
+
+    def refresh(self):
+        """Applies the entries appended to the file since the last read."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == self._offset:
+            return
+        with self._lock, document_lock(self.path):
+            self._read_new()
+
+    def _read_new(self):
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            for line in f:
+                self._offset += len(line)
+                try:
+                    entry = json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    print(f"Skipping a torn entry in {self.path}")
+                    continue
+                if isinstance(entry, dict):
+                    self._apply(entry)
+
+    def _apply(self, entry):
+        subtopic_id = entry.get("subtopic_id")
+        if entry.get("event") == DONE:
+            key = entry.get("key") or test_store.key_of(entry.get("questionnaire", {}))
+            self.keys[subtopic_id] = tuple(key)
+            self._pending.discard(subtopic_id)
+        elif entry.get("event") == PENDING and subtopic_id not in self.keys:
+            self._pending.add(subtopic_id)
+
+    def _append(self, entries):
+        lines = "".join(json.dumps(entry) + "\n" for entry in entries)
+        with self._lock, document_lock(self.path):
+            if os.path.exists(self.path):
+                self._read_new()
+            with open(self.path, "ab") as f:
+                if self._offset and not self._ends_with_newline():
+                    lines = "\n" + lines  # ends a torn last line, so the new entries parse
+                f.write(lines.encode())
+                f.flush()
+                os.fsync(f.fileno())
+                self._offset = f.tell()
+            for entry in entries:
+                self._apply(entry)
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def is_done(self, subtopic_id) -> bool:
+        return subtopic_id in self.keys
+
+    @property
+    def done(self) -> set:
+        return set(self.keys)
+
+    @property
+    def pending(self) -> set:
+        return set(self._pending)
+
+    def record_done(self, subtopic_id, key):
+        self._append([{"event": DONE, "subtopic_id": subtopic_id, "key": list(key),
+                       "at": datetime.now().isoformat()}])
+
+    def record_pending(self, subtopic_id):
+        if not self.is_done(subtopic_id):
+            self._append([{"event": PENDING, "subtopic_id": subtopic_id, "at": datetime.now().isoformat()}])
+
+    def seed(self, keys):
+        """Records the tests already in the store as done, in one append."""
+        entries = [{"event": DONE, "subtopic_id": key[2], "key": list(key), "at": None}
+                   for key in keys if not self.is_done(key[2])]
+        if entries:
+            print(f"Seeding {self.path} with {len(entries)} test(s) already in the store")
+            self._append(entries)
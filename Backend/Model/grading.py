@@ -0,0 +1,258 @@
+"""
+Server-side grading of MCQ tests.
+
+A test's answer key is loaded once and kept as NumPy arrays (cached until its file in
+the test store changes), so scoring a submission, or a whole batch of submissions for the same test, is
+a single vectorized comparison instead of a per-question loop.
+"""
+import os
+from collections import OrderedDict
+from datetime import datetime
+
+import numpy as np
+
+from cohort_analytics import record_test_answers
+import test_store
+from json_store import read_json, update_json
+from utils import get_test_scores_path, is_safe_id
+
+PASS_PERCENTAGE = 85  # same mastery bar as cli.run_test
+ANSWER_KEY_CACHE_SIZE = 256
+
+_answer_key_cache = OrderedDict()
+
+
+class SubmissionError(ValueError):
+    """A submission whose answers or timings can't be lined up with the questions."""
+
+
+class AnswerKey:
+    """Correct options and topic labels of one test, as arrays."""
+
+    __slots__ = ("test", "answers", "topic_codes", "topic_labels")
+
+    def __init__(self, test: dict):
+        mcqs = test.get("mcqs", [])
+        self.test = test
+        self.answers = np.array([str(mcq.get("answer", "")) for mcq in mcqs], dtype=object)
+        labels = [mcq.get("topic_label", "") for mcq in mcqs]
+        self.topic_labels, self.topic_codes = np.unique(np.array(labels, dtype=object), return_inverse=True)
+        self.topic_codes = self.topic_codes.reshape(-1)
+
+    def __len__(self):
+        return len(self.answers)
+
+
+def load_answer_key(user_id, phase, milestone, subtopic) -> AnswerKey | None:
+    """Returns the answer key for a test, re-reading the test file only when it changed."""
+    test_file = test_store.stored_test_path(user_id, phase, milestone, subtopic)
+    try:
+        mtime = os.stat(test_file).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cache_key = test_file
+    cached = _answer_key_cache.get(cache_key)
+    if cached is not None and cached[0] == mtime:
+        _answer_key_cache.move_to_end(cache_key)
+        return cached[1]
+
+    test = read_json(test_file, {})
+    if not isinstance(test, dict) or not test.get("mcqs"):
+        return None
+    key = AnswerKey(test)
+    _answer_key_cache[cache_key] = (mtime, key)
+    if len(_answer_key_cache) > ANSWER_KEY_CACHE_SIZE:
+        _answer_key_cache.popitem(last=False)
+    return key
+
+
+def _numbered_items(values, field):
+    """(question index, value) pairs of a submitted list, dict or record list (see normalize_answers)."""
+    if isinstance(values, dict):
+        return [(int(number) - 1, value) for number, value in values.items()]
+    if not isinstance(values, list):
+        raise SubmissionError("expected a list or an object")
+    if values and isinstance(values[0], dict):
+        return [(int(rec["question_number"]) - 1, rec.get(field)) for rec in values]
+    return list(enumerate(values))
+
+
+def normalize_answers(answers, num_questions) -> np.ndarray:
+    """
+    Aligns a submission with the question order.
+
+    Accepts a list of options in question order, a dict of {question number: option},
+    or a list of {"question_number", "user_answer"} records. Question numbers are
+    1-based in both, as store_user_answers writes them. Unanswered questions become "".
+    Raises SubmissionError for anything else.
+    """
+    submitted = np.full(num_questions, "", dtype=object)
+    try:
+        items = _numbered_items(answers, "user_answer")
+    except (KeyError, TypeError, ValueError) as e:
+        raise SubmissionError(f"Malformed answers: {e}") from e
+    for idx, value in items:
+        if 0 <= idx < num_questions and value is not None:
+            submitted[idx] = str(value)
+    return submitted
+
+
+def normalize_timings(timings, num_questions, answers=None) -> np.ndarray:
+    """
+    Seconds spent per question, in question order (NaN where unknown).
+
+    Accepts the same shapes as normalize_answers; without timings, the "time_taken"
+    fields of answer records are used.
+    """
+    seconds = np.full(num_questions, np.nan)
+    if timings is None and answers and isinstance(answers, list) and isinstance(answers[0], dict):
+        timings = [{"question_number": rec.get("question_number"), "time_taken": rec.get("time_taken")}
+                   for rec in answers]
+    if not timings:
+        return seconds
+    try:
+        items = _numbered_items(timings, "time_taken")
+    except (KeyError, TypeError, ValueError) as e:
+        raise SubmissionError(f"Malformed timings: {e}") from e
+    for idx, value in items:
+        try:
+            if 0 <= idx < num_questions and value is not None:
+                seconds[idx] = float(value)
+        except (TypeError, ValueError):
+            continue
+    return seconds
+
+
+def _summarize(key: AnswerKey, correct_row: np.ndarray) -> dict:
+    total = len(key)
+    correct_count = int(correct_row.sum())
+    percentage = correct_count / total * 100 if total else 0.0
+    per_topic_total = np.bincount(key.topic_codes, minlength=len(key.topic_labels))
+    per_topic_correct = np.bincount(key.topic_codes, weights=correct_row, minlength=len(key.topic_labels))
+    accuracy = per_topic_correct / np.maximum(per_topic_total, 1) * 100
+    return {
+        "score": round(percentage, 2),
+        "correct_answers": correct_count,
+        "total_questions": total,
+        "passed": percentage >= PASS_PERCENTAGE,
+        "topic_accuracy": {
+            str(label): round(float(acc), 2) for label, acc in zip(key.topic_labels, accuracy)
+        },
+        # Any missed question marks its topic as weak, as in cli.run_test
+        "weak_topics": [str(label) for label in key.topic_labels[per_topic_correct < per_topic_total]],
+    }
+
+
+def grade(key: AnswerKey, answers) -> tuple[dict, np.ndarray]:
+    """Scores one submission. Returns the result and the submitted options in question order."""
+    submitted = normalize_answers(answers, len(key))
+    correct = submitted == key.answers
+    return _summarize(key, correct), submitted
+
+
+def grade_batch(key: AnswerKey, submissions: list) -> list[tuple[dict, np.ndarray]]:
+    """Scores many submissions of the same test with one matrix comparison."""
+    if not submissions:
+        return []
+    submitted = np.stack([normalize_answers(answers, len(key)) for answers in submissions])
+    correct = submitted == key.answers[np.newaxis, :]
+    return [(_summarize(key, correct[i]), submitted[i]) for i in range(len(submissions))]
+
+
+def store_graded_submission(scores_file, phase, milestone, subtopic, key: AnswerKey, submitted: np.ndarray,
+                            question_indexes=None, user_id=None, time_taken=None):
+    """
+    Appends all answers of a graded submission to the user's scores in one write.
+
+    question_indexes limits the records to the questions that were actually asked
+    (adaptive tests); by default every question is recorded. time_taken (seconds per
+    question, from normalize_timings) is stored where known. The records are also added
+    to the cohort analytics counters.
+    """
+    now = datetime.now().isoformat()
+    mcqs = key.test["mcqs"]
+    if question_indexes is None:
+        question_indexes = range(len(mcqs))
+    records = [
+        {
+            "question_number": i + 1,
+            "question": mcq.get("question", ""),
+            "user_answer": submitted[i],
+            "correct_answer": key.answers[i],
+            "is_correct": bool(submitted[i] == key.answers[i]),
+            "topic_label": mcq.get("topic_label", ""),
+            "difficulty": mcq.get("difficulty", ""),
+            "answered_at": now,
+        }
+        for i, mcq in ((i, mcqs[i]) for i in question_indexes)
+    ]
+    if time_taken is not None:
+        for record in records:
+            seconds = time_taken[record["question_number"] - 1]
+            if not np.isnan(seconds):
+                record["time_taken"] = round(float(seconds), 3)
+
+    def add_answers(scores_data):
+        if not isinstance(scores_data, dict):
+            scores_data = {}  # legacy raw-answers file
+        subtopic_scores = scores_data.setdefault(str(phase), {}).setdefault(milestone, {}).setdefault(
+            subtopic,
+            {"subtopic_name": key.test.get("subtopic_name", ""), "attempted_at": now, "answers": []},
+        )
+        subtopic_scores["answers"].extend(records)
+        return scores_data
+
+    update_json(scores_file, add_answers)
+    record_test_answers(user_id, key.test, subtopic, records)
+
+
+def feedback_for(result) -> str:
+    if result["passed"]:
+        return "Great job!"
+    return "Let's strengthen your understanding in these areas."
+
+
+def grade_submissions(submissions) -> tuple[list, set]:
+    """
+    Grades and stores many users' submissions, each {"userId", "phase", "milestone",
+    "subtopic", "answers", "timeTaken"}. Returns a result (or error) per submission, in
+    order, and the users whose scores changed.
+    """
+    results = [None] * len(submissions)
+    groups = {}
+    graded_users = set()
+    for i, sub in enumerate(submissions):
+        test_ref = (sub.get("userId"), sub.get("phase"), sub.get("milestone"), sub.get("subtopic")) \
+            if isinstance(sub, dict) else (None,) * 4
+        if not all(ref is not None for ref in test_ref) or not sub.get("answers"):
+            results[i] = {"error": "userId, phase, milestone, subtopic and answers are required"}
+            continue
+        if not is_safe_id(test_ref[0]):
+            results[i] = {"userId": test_ref[0], "error": "Invalid userId"}
+            continue
+        groups.setdefault(test_ref, []).append(i)
+
+    # Each test's answer key is loaded once and its submissions are scored together
+    for (user_id, phase, milestone, subtopic), indexes in groups.items():
+        answer_key = load_answer_key(user_id, phase, milestone, subtopic)
+        if answer_key is None:
+            for i in indexes:
+                results[i] = {"userId": user_id, "error": "Test not found for this topic"}
+            continue
+        timings = {}
+        for i in indexes:
+            try:
+                normalize_answers(submissions[i]["answers"], len(answer_key))
+                timings[i] = normalize_timings(submissions[i].get("timeTaken"), len(answer_key), submissions[i]["answers"])
+            except SubmissionError as e:
+                results[i] = {"userId": user_id, "error": str(e)}
+        indexes = list(timings)
+        if not indexes:
+            continue
+        graded_users.add(user_id)
+        graded = grade_batch(answer_key, [submissions[i]["answers"] for i in indexes])
+        for i, (result, submitted) in zip(indexes, graded):
+            store_graded_submission(get_test_scores_path(user_id), phase, milestone, subtopic, answer_key, submitted,
+                                    user_id=user_id, time_taken=timings[i])
+            results[i] = {**result, "userId": user_id, "feedback": feedback_for(result)}
+    return results, graded_users
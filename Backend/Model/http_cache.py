@@ -0,0 +1,190 @@
+"""
+Conditional, compressed responses for JSON documents served straight from disk.
+
+Roadmaps and tests are large pretty-printed files that the frontend polls. Every response
+carries a (weak) ETag and Last-Modified built from the file's mtime and size, so a
+request whose If-None-Match or If-Modified-Since still matches gets a 304 after one
+os.stat, without reading, parsing or serializing the document.
+
+A full response is compact JSON, serialized once per document version and kept in a
+bounded in-memory cache together with its gzip and brotli variants, which are built the
+first time a client asks for them. Brotli needs the optional `brotli` package; without it
+clients get gzip. Bodies under NEXTPATH_COMPRESS_MIN_BYTES are sent uncompressed.
+
+    NEXTPATH_COMPRESS_MIN_BYTES=1024  smallest body worth compressing
+    NEXTPATH_RESPONSE_CACHE_MB=64     memory for serialized and compressed documents
+"""
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("NEXTPATH_COMPRESS_MIN_BYTES", "1024"))
+CACHE_BYTES = int(float(os.getenv("NEXTPATH_RESPONSE_CACHE_MB", "64")) * 1024 * 1024)
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+_cache = OrderedDict()  # (path, tag) -> _Entry
+_cache_bytes = 0
+_lock = threading.Lock()
+_stats = {"not_modified": 0, "full": 0, "serialized": 0, "compressed": 0, "bytes_sent": 0, "bytes_uncompressed": 0}
+
+
+class _Entry:
+    """One version of a served document: its body and the compressed variants built so far."""
+
+    __slots__ = ("signature", "body", "encoded", "accounted")
+
+    def __init__(self, signature, body: bytes):
+        self.signature = signature
+        self.body = body
+        self.encoded = {}  # content coding -> bytes
+        self.accounted = 0  # size counted in _cache_bytes
+
+    @property
+    def size(self) -> int:
+        return len(self.body) + sum(len(data) for data in self.encoded.values())
+
+
+def _signature(stat) -> tuple[int, int]:
+    return stat.st_mtime_ns, stat.st_size
+
+
+def etag(signature, tag="") -> str:
+    mtime_ns, size = signature
+    return f'W/"{mtime_ns:x}-{size:x}{"-" + tag if tag else ""}"'
+
+
+def _not_modified(headers, current_etag, mtime) -> bool:
+    if_none_match = headers.get("If-None-Match")
+    if if_none_match is not None:
+        # Weak comparison: W/ prefixes are ignored on both sides
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or current_etag.removeprefix("W/") in tags
+    if_modified_since = headers.get("If-Modified-Since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _accepted_encodings(headers) -> list:
+    """Content codings the client accepts, in our order of preference."""
+    accepted = set()
+    for part in (headers.get("Accept-Encoding") or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = params.strip().removeprefix("q=")
+        if coding and quality not in ("0", "0.0", "0.00", "0.000"):
+            accepted.add(coding.strip().lower())
+    return [coding for coding in ("br", "gzip") if coding in accepted and (coding != "br" or brotli)]
+
+
+def _compress(body: bytes, coding: str) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, GZIP_LEVEL, mtime=0)
+
+
+def _store(key, entry):
+    global _cache_bytes
+    with _lock:
+        previous = _cache.pop(key, None)
+        if previous is not None:
+            _cache_bytes -= previous.accounted
+        entry.accounted = entry.size
+        _cache[key] = entry
+        _cache_bytes += entry.accounted
+        while _cache_bytes > CACHE_BYTES and len(_cache) > 1:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= evicted.accounted
+
+
+def _load(path, key, transform):
+    """The cached entry for the file's current version, serializing it if needed."""
+    try:
+        with open(path, "rb") as f:
+            signature = _signature(os.fstat(f.fileno()))  # of the version being read
+            with _lock:
+                entry = _cache.get(key)
+                if entry is not None and entry.signature == signature:
+                    _cache.move_to_end(key)
+                    return entry
+            document = json.loads(f.read())
+    except (FileNotFoundError, json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    if transform is not None:
+        document = transform(document)
+    entry = _Entry(signature, (json.dumps(document, separators=(",", ":")) + "\n").encode())
+    _store(key, entry)
+    with _lock:
+        _stats["serialized"] += 1
+    return entry
+
+
+def json_file_response(path, headers, transform=None, tag="") -> tuple[int, dict, bytes] | None:
+    """
+    (status, headers, body) for serving the JSON document at path, or None if there is none.
+
+    headers are the request's; transform maps the document to what is sent, and tag names
+    the transform so its responses get ETags of their own.
+    """
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    response_headers = {
+        "ETag": etag(_signature(stat), tag),
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": "no-cache",  # always revalidate, which is what the 304 makes cheap
+        "Vary": "Accept-Encoding",
+    }
+    if _not_modified(headers, response_headers["ETag"], stat.st_mtime):
+        with _lock:
+            _stats["not_modified"] += 1
+        return 304, response_headers, b""
+
+    key = (path, tag)
+    entry = _load(path, key, transform)
+    if entry is None:
+        return None
+    if entry.signature != _signature(stat):  # changed since the stat above
+        response_headers["ETag"] = etag(entry.signature, tag)
+        response_headers["Last-Modified"] = formatdate(entry.signature[0] / 1e9, usegmt=True)
+
+    body = entry.body
+    for coding in _accepted_encodings(headers) if len(body) >= COMPRESS_MIN_BYTES else []:
+        encoded = entry.encoded.get(coding)
+        if encoded is None:
+            encoded = entry.encoded[coding] = _compress(entry.body, coding)
+            _store(key, entry)  # re-account its size
+            with _lock:
+                _stats["compressed"] += 1
+        if len(encoded) < len(body):
+            response_headers["Content-Encoding"] = coding
+            body = encoded
+        break
+    response_headers["Content-Type"] = "application/json"
+    with _lock:
+        _stats["full"] += 1
+        _stats["bytes_sent"] += len(body)
+        _stats["bytes_uncompressed"] += len(entry.body)
+    return 200, response_headers, body
+
+
+def stats() -> dict:
+    with _lock:
+        return {
+            **_stats,
+            "cached_documents": len(_cache),
+            "cached_bytes": _cache_bytes,
+            "brotli": brotli is not None,
+        }
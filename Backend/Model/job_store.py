@@ -0,0 +1,281 @@
+"""
+Shared job status and lease store.
+
+Generation jobs live in a SQLite database instead of process memory, so every worker
+process (gunicorn workers, or several nodes sharing the users_data volume) sees the same
+status. Any process can submit a job; worker threads claim queued jobs under a lease and
+renew it while they run. If a worker dies, its lease expires and another worker picks
+the job up again.
+
+Job states: queued -> running -> completed | failed
+
+A submission joins a queued job of the same key. One that arrives while the job is running
+joins it too, unless it asks for a rerun: then the job is queued again when the running
+attempt finishes, so it sees whatever changed meanwhile (new scores, for an adaptation).
+
+A job can carry a profiling mode (see profiling.py); its handler runs with that mode
+requested, so a job script it starts profiles itself.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import profiling
+from utils import data_path
+
+DEFAULT_DB_PATH = os.getenv("NEXTPATH_JOB_DB", data_path("jobs.sqlite3"))
+DEFAULT_LEASE_SECONDS = 60
+MAX_ATTEMPTS = 3
+
+ACTIVE_STATES = ("queued", "running")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    user_id TEXT NOT NULL,
+    job_type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    owner TEXT,
+    lease_expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    deduplicated INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    profile TEXT,
+    rerun INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (user_id, job_type)
+);
+CREATE INDEX IF NOT EXISTS jobs_claimable ON jobs (status, lease_expires_at, created_at);
+"""
+
+
+class JobStore:
+    def __init__(self, db_path: str = DEFAULT_DB_PATH):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "profile" not in columns:  # databases created before jobs could be profiled
+                conn.execute("ALTER TABLE jobs ADD COLUMN profile TEXT")
+            if "rerun" not in columns:  # databases created before running jobs could be rerun
+                conn.execute("ALTER TABLE jobs ADD COLUMN rerun INTEGER NOT NULL DEFAULT 0")
+
+    @contextmanager
+    def _connect(self):
+        # One short-lived connection per call keeps the store safe to use from any thread.
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def submit(self, user_id: str, job_type: str, profile: str | None = None, rerun: bool = False) -> bool:
+        """
+        Queues a job unless one for the same key is already queued or running.
+
+        profile is the profiling mode to run the job with, if any. With rerun, a running
+        job is not joined but queued again once it finishes.
+        Returns True if the job will run for this call, False if the call joined an active one.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT status FROM jobs WHERE user_id = ? AND job_type = ?", (user_id, job_type)
+            ).fetchone()
+            if rerun and row is not None and row["status"] == "running":
+                conn.execute(
+                    "UPDATE jobs SET rerun = 1, profile = COALESCE(?, profile) WHERE user_id = ? AND job_type = ?",
+                    (profile, user_id, job_type),
+                )
+                conn.execute("COMMIT")
+                return True
+            if row is not None and row["status"] in ACTIVE_STATES:
+                conn.execute(
+                    "UPDATE jobs SET deduplicated = deduplicated + 1, profile = COALESCE(?, profile)"
+                    " WHERE user_id = ? AND job_type = ?",
+                    (profile, user_id, job_type),
+                )
+                conn.execute("COMMIT")
+                return False
+            conn.execute(
+                """
+                INSERT INTO jobs (user_id, job_type, status, attempts, profile, created_at, updated_at)
+                VALUES (?, ?, 'queued', 0, ?, ?, ?)
+                ON CONFLICT (user_id, job_type) DO UPDATE SET
+                    status = 'queued', owner = NULL, lease_expires_at = NULL, attempts = 0,
+                    error = NULL, profile = excluded.profile, rerun = 0,
+                    created_at = excluded.created_at, updated_at = excluded.updated_at
+                """,
+                (user_id, job_type, profile, now, now),
+            )
+            conn.execute("COMMIT")
+            return True
+
+    def claim(self, worker_id: str, job_types=None, lease_seconds: float = DEFAULT_LEASE_SECONDS) -> dict | None:
+        """Leases the oldest queued job, or a running job whose lease has expired."""
+        now = time.time()
+        type_filter = ""
+        params = [now]
+        if job_types:
+            type_filter = f" AND job_type IN ({', '.join('?' for _ in job_types)})"
+            params.extend(job_types)
+        with self._connect() as conn:
+            while True:
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT user_id, job_type, attempts, profile FROM jobs"
+                    " WHERE (status = 'queued' OR (status = 'running' AND lease_expires_at < ?))"
+                    + type_filter + " ORDER BY created_at LIMIT 1",
+                    params,
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["attempts"] < MAX_ATTEMPTS:
+                    break
+                # Crashed or failed too often: stop handing it out and look for the next job.
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', owner = NULL, error = ?, updated_at = ?"
+                    " WHERE user_id = ? AND job_type = ?",
+                    (f"gave up after {row['attempts']} attempts", now, row["user_id"], row["job_type"]),
+                )
+                conn.execute("COMMIT")
+            conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, lease_expires_at = ?,"
+                " attempts = attempts + 1, updated_at = ? WHERE user_id = ? AND job_type = ?",
+                (worker_id, now + lease_seconds, now, row["user_id"], row["job_type"]),
+            )
+            conn.execute("COMMIT")
+            return {"user_id": row["user_id"], "job_type": row["job_type"], "attempt": row["attempts"] + 1,
+                    "profile": row["profile"]}
+
+    def renew(self, user_id: str, job_type: str, worker_id: str,
+              lease_seconds: float = DEFAULT_LEASE_SECONDS) -> bool:
+        """Extends a lease; returns False if the job is no longer owned by worker_id."""
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires_at = ?, updated_at = ?"
+                " WHERE user_id = ? AND job_type = ? AND owner = ? AND status = 'running'",
+                (now + lease_seconds, now, user_id, job_type, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def _finish(self, user_id, job_type, worker_id, status, error=None) -> bool:
+        # A job asked to rerun while it was running goes back to the queue instead
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET"
+                " status = CASE WHEN rerun THEN 'queued' ELSE ? END,"
+                " error = CASE WHEN rerun THEN NULL ELSE ? END,"
+                " attempts = CASE WHEN rerun THEN 0 ELSE attempts END,"
+                " created_at = CASE WHEN rerun THEN ? ELSE created_at END,"
+                " rerun = 0, owner = NULL, lease_expires_at = NULL, updated_at = ?"
+                " WHERE user_id = ? AND job_type = ? AND owner = ?",
+                (status, error, now, now, user_id, job_type, worker_id),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, user_id: str, job_type: str, worker_id: str) -> bool:
+        return self._finish(user_id, job_type, worker_id, "completed")
+
+    def fail(self, user_id: str, job_type: str, worker_id: str, error: str) -> bool:
+        return self._finish(user_id, job_type, worker_id, "failed", error)
+
+    def get(self, user_id: str, job_type: str) -> dict | None:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE user_id = ? AND job_type = ?", (user_id, job_type)
+            ).fetchone()
+            return dict(row) if row else None
+
+    def status(self, user_id: str, job_type: str) -> str:
+        """The job's status as the API reports it: not_found, generating, completed or "error: <reason>"."""
+        job = self.get(user_id, job_type)
+        if job is None:
+            return "not_found"
+        if job["status"] in ACTIVE_STATES:
+            return "generating"
+        if job["status"] == "failed":
+            return f"error: {job['error']}"
+        return job["status"]
+
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            by_status = {
+                row["status"]: row["n"]
+                for row in conn.execute("SELECT status, COUNT(*) AS n FROM jobs GROUP BY status")
+            }
+            deduplicated = conn.execute("SELECT COALESCE(SUM(deduplicated), 0) FROM jobs").fetchone()[0]
+        return {"by_status": by_status, "deduplicated": deduplicated}
+
+
+class JobWorker:
+    """
+    Claims jobs from a JobStore and runs them with the matching handler.
+
+    handlers maps job_type -> callable(user_id); a handler signals failure by raising.
+    The lease is renewed in the background while a handler runs, and the job's profiling
+    mode is requested for its duration.
+    """
+
+    def __init__(self, store: JobStore, handlers: dict, lease_seconds: float = DEFAULT_LEASE_SECONDS,
+                 poll_interval: float = 1.0):
+        self.store = store
+        self.handlers = handlers
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._stop = threading.Event()
+
+    def run_once(self) -> bool:
+        """Claims and runs at most one job. Returns True if a job was run."""
+        job = self.store.claim(self.worker_id, list(self.handlers), self.lease_seconds)
+        if job is None:
+            return False
+        user_id, job_type = job["user_id"], job["job_type"]
+        done = threading.Event()
+
+        def heartbeat():
+            while not done.wait(self.lease_seconds / 3):
+                if not self.store.renew(user_id, job_type, self.worker_id, self.lease_seconds):
+                    return
+
+        threading.Thread(target=heartbeat, daemon=True).start()
+        try:
+            with profiling.requested(job.get("profile")):
+                self.handlers[job_type](user_id)
+            self.store.complete(user_id, job_type, self.worker_id)
+        except Exception as e:
+            self.store.fail(user_id, job_type, self.worker_id, str(e))
+        finally:
+            done.set()
+        return True
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            if not self.run_once():
+                self._stop.wait(self.poll_interval)
+
+    def start(self) -> threading.Thread:
+        thread = threading.Thread(target=self.run_forever, name=f"job-worker-{self.worker_id}", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,186 @@
+"""
+Atomic, lock-protected JSON document writes.
+
+Every write goes to a temporary file in the same directory which is fsynced and then
+renamed over the target with os.replace, so readers always see either the old or the
+new document, never a half-written one. Read-modify-write cycles (update_json) hold a
+per-document advisory lock on "<path>.lock", which serialises writers across threads
+and processes so concurrent updates are not lost. Lock files are never deleted: a
+process waiting on the old file would otherwise lock a different file than the next
+writer.
+
+Run `python json_store.py --writers 16 --updates 200` for a concurrency stress test;
+tests/test_json_store.py runs a smaller one with pytest.
+"""
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+_thread_locks = {}  # path -> [lock, holders and waiters]; dropped when nobody uses it
+_thread_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _thread_lock(path):
+    key = os.path.abspath(path)
+    with _thread_locks_guard:
+        entry = _thread_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _thread_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _thread_locks[key]
+
+
+@contextmanager
+def document_lock(path):
+    """Holds an exclusive advisory lock for the document at path."""
+    with _thread_lock(path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(f"{path}.lock", "a+b") as lock_file:
+            if os.name == "nt":
+                lock_file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue  # LK_LOCK gives up after ~10s; keep waiting
+                try:
+                    yield
+                finally:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def atomic_write_json(path, data, indent=4):
+    """Replaces the document at path in one step (temp file + fsync + rename)."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_json(path, default=None):
+    """Loads a document, returning default if it is missing or not valid JSON."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def update_json(path, mutate, default_factory=dict):
+    """
+    Read-modify-write under the document lock.
+
+    mutate receives the current document (or default_factory() if there is none) and
+    either changes it in place and returns None, or returns a replacement document.
+    Returns the document that was written.
+    """
+    with document_lock(path):
+        data = read_json(path)
+        if data is None:
+            data = default_factory()
+        result = mutate(data)
+        if result is not None:
+            data = result
+        atomic_write_json(path, data)
+        return data
+
+
+def remove_json(path):
+    """Deletes a document (not its lock file); call it while holding the document's lock."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _stress_writer(path, writer_id, updates):
+    def append(doc):
+        doc["count"] = doc.get("count", 0) + 1
+        doc.setdefault("entries", []).append(f"{writer_id}:{len(doc['entries'])}")
+    for _ in range(updates):
+        update_json(path, append)
+
+
+def _stress_reader(path, stop, failures):
+    while not stop.is_set():
+        try:
+            with open(path, "r") as f:
+                json.load(f)
+        except FileNotFoundError:
+            pass
+        except json.JSONDecodeError:
+            failures.append(1)
+
+
+def main():
+    import argparse
+    import multiprocessing
+    import time
+
+    parser = argparse.ArgumentParser(description="Concurrency stress test for update_json.")
+    parser.add_argument("--writers", type=int, default=8, help="Parallel writer processes.")
+    parser.add_argument("--updates", type=int, default=100, help="Updates per writer.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stress.json")
+        stop, torn_reads = threading.Event(), []
+        reader = threading.Thread(target=_stress_reader, args=(path, stop, torn_reads))
+        reader.start()
+        start = time.perf_counter()
+        writers = [
+            multiprocessing.Process(target=_stress_writer, args=(path, i, args.updates))
+            for i in range(args.writers)
+        ]
+        for p in writers:
+            p.start()
+        for p in writers:
+            p.join()
+        elapsed = time.perf_counter() - start
+        stop.set()
+        reader.join()
+
+        doc = read_json(path)
+        expected = args.writers * args.updates
+        lost = expected - doc["count"]
+        print(f"{args.writers} writers x {args.updates} updates in {elapsed:.2f}s")
+        print(f"count={doc['count']} entries={len(doc['entries'])} expected={expected}")
+        print(f"lost updates: {lost}, torn reads: {len(torn_reads)}")
+        if lost or len(doc["entries"]) != expected or torn_reads:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Shared Gemini access for the generators and both servers.
+
+generate_json / generate_json_async can hedge (NEXTPATH_LLM_HEDGE=1): when a request
+has not answered within the recent p95 latency of its kind of prompt, a duplicate is
+sent (on NEXTPATH_LLM_HEDGE_MODEL if set, e.g. a faster tier) and the first response
+that parses wins; the other is cancelled. Hedges are capped at NEXTPATH_LLM_HEDGE_BUDGET
+of the recent calls, so the extra cost stays bounded even when every call is slow.
+hedge_stats() reports how much p99 the hedges save.
+
+charging(charge) makes every LLM request sent in its context (retries, router fallbacks,
+repairs and hedges included) call charge() first, so a rate limit such as the backfill
+worker's budget counts requests rather than the calls that cause them.
+
+    NEXTPATH_LLM_HEDGE=1                 enable hedging
+    NEXTPATH_LLM_HEDGE_PERCENTILE=95     hedge after this latency percentile
+    NEXTPATH_LLM_HEDGE_MODEL=...         model for the duplicate (default: same model)
+    NEXTPATH_LLM_HEDGE_BUDGET=0.1        max share of calls that may be hedged
+"""
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import numpy as np
+from google import genai
+from google.genai import types
+
+import fake_backends
+import resilience
+
+DEFAULT_MODEL = "gemini-2.5-flash-lite"
+LATENCY_WINDOW = 500
+HEDGE_MIN_SAMPLES = 20
+HEDGE_BUDGET_WINDOW = 1000
+
+_client = None
+_hedge_executor = None
+_charge = contextvars.ContextVar("llm_charge", default=None)
+
+
+def get_client() -> genai.Client:
+    """Returns a process-wide Gemini client (it keeps its HTTP connections alive)."""
+    global _client
+    if _client is None:
+        _client = genai.Client(api_key=os.getenv("GOOGLE_GENAI_API_KEY"))
+    return _client
+
+
+def model_breaker(model: str) -> resilience.CircuitBreaker:
+    """
+    Trips after repeated overload/timeout errors of one model so callers fail fast
+    (CircuitOpenError) and the router falls back to another tier.
+    """
+    return resilience.get_breaker(f"gemini:{model}")
+
+
+@contextmanager
+def charging(charge):
+    """Calls charge() before each LLM request made in this context; it may block or raise."""
+    token = _charge.set(charge)
+    try:
+        yield
+    finally:
+        _charge.reset(token)
+
+
+def _before_request():
+    charge = _charge.get()
+    if charge is not None:
+        charge()
+
+
+def _config(response_schema) -> types.GenerateContentConfig | None:
+    if response_schema is None:
+        return None
+    return types.GenerateContentConfig(response_mime_type="application/json", response_schema=response_schema)
+
+
+def generate_text(prompt: str, model: str = DEFAULT_MODEL, response_schema: dict | None = None) -> str:
+    """
+    Sends a prompt to Gemini and returns the raw response text.
+
+    response_schema (see schemas.response_schema) constrains the output to that structure.
+    A single attempt: wrap it in resilience.call_with_retry to retry transient errors.
+    """
+    _before_request()
+    with model_breaker(model).guard():
+        if fake_backends.fake_llm_enabled():
+            return fake_backends.fake_generate(prompt)
+        response = get_client().models.generate_content(model=model, contents=prompt,
+                                                        config=_config(response_schema))
+        return response.text
+
+
+async def generate_text_async(prompt: str, model: str = DEFAULT_MODEL, response_schema: dict | None = None) -> str:
+    """Non-blocking variant of generate_text for the ASGI server."""
+    _before_request()
+    with model_breaker(model).guard():
+        if fake_backends.fake_llm_enabled():
+            return await fake_backends.fake_generate_async(prompt)
+        response = await get_client().aio.models.generate_content(model=model, contents=prompt,
+                                                                  config=_config(response_schema))
+        return response.text
+
+
+def parse_json_response(raw_text: str) -> dict:
+    """Strips markdown fences from a model response and parses the JSON inside."""
+    # To-Do: The model is not giving the output in the desired format, so this temporary fix is applied.
+    raw_json_output = raw_text.replace("```json", "").replace("```", "")
+    try:
+        return json.loads(raw_json_output)
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON from Gemini response: {e}")
+        # Print a snippet of the response around the error
+        context = 20
+        start = max(0, e.pos - context)
+        snippet = raw_json_output[start:e.pos + context]
+        print(f"...context around error...\n{snippet}\n...context around error...")
+        return {"error": "Failed to parse Gemini response JSON."}
+
+
+# --- Hedging ---
+
+def _percentile(samples, q):
+    return float(np.percentile(np.fromiter(samples, dtype=float), q)) if samples else None
+
+
+class _Hedging:
+    """Latency samples per kind of prompt, the hedge budget and the hedge metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = {}  # kind -> deque of successful attempt latencies
+        self._window = deque(maxlen=HEDGE_BUDGET_WINDOW)  # hedges sent per recent call
+        self._hedged_in_window = 0
+        self.counters = {"calls": 0, "hedged": 0, "hedge_wins": 0, "budget_denied": 0}
+        self._delivered = deque(maxlen=LATENCY_WINDOW)  # latency the caller saw
+        self._primary = deque(maxlen=LATENCY_WINDOW)  # latency of the first request alone
+
+    @staticmethod
+    def enabled() -> bool:
+        return os.getenv("NEXTPATH_LLM_HEDGE", "").lower() in ("1", "true", "yes")
+
+    @staticmethod
+    def hedge_model(model) -> str:
+        return os.getenv("NEXTPATH_LLM_HEDGE_MODEL") or model
+
+    def record_attempt(self, kind, seconds):
+        with self._lock:
+            self._latencies.setdefault(kind, deque(maxlen=LATENCY_WINDOW)).append(seconds)
+
+    def delay(self, kind) -> float | None:
+        """Seconds to wait before hedging, or None if hedging is off or there is no history yet."""
+        if not self.enabled():
+            return None
+        with self._lock:
+            samples = self._latencies.get(kind)
+            if samples is None or len(samples) < HEDGE_MIN_SAMPLES:
+                return None
+            samples = list(samples)
+        return _percentile(samples, float(os.getenv("NEXTPATH_LLM_HEDGE_PERCENTILE", "95")))
+
+    def start_call(self):
+        with self._lock:
+            self.counters["calls"] += 1
+            if len(self._window) == self._window.maxlen:
+                self._hedged_in_window -= self._window[0]
+            self._window.append(0)
+
+    def try_hedge(self) -> bool:
+        """Takes a hedge from the budget (a share of the last HEDGE_BUDGET_WINDOW calls)."""
+        budget = float(os.getenv("NEXTPATH_LLM_HEDGE_BUDGET", "0.1"))
+        with self._lock:
+            if self._hedged_in_window + 1 > budget * len(self._window):
+                self.counters["budget_denied"] += 1
+                return False
+            self._window[-1] += 1  # charged to the latest call; only the window total matters
+            self._hedged_in_window += 1
+            self.counters["hedged"] += 1
+            return True
+
+    def record_primary(self, seconds):
+        with self._lock:
+            self._primary.append(seconds)
+
+    def finish_call(self, delivered, hedge_won):
+        with self._lock:
+            self._delivered.append(delivered)
+            self.counters["hedge_wins"] += int(hedge_won)
+
+    def stats(self) -> dict:
+        with self._lock:
+            delivered, primary = list(self._delivered), list(self._primary)
+            counters = dict(self.counters)
+            kinds = {kind: len(samples) for kind, samples in self._latencies.items()}
+        p99, primary_p99 = _percentile(delivered, 99), _percentile(primary, 99)
+        return {
+            "enabled": self.enabled(),
+            **counters,
+            "hedge_rate": round(counters["hedged"] / counters["calls"], 4) if counters["calls"] else 0.0,
+            "latency_samples": kinds,
+            "p50": _percentile(delivered, 50),
+            "p99": p99,
+            # Primaries that lost are timed until they finish (threads) or are cancelled (asyncio),
+            # so this is a lower bound of the p99 without hedging
+            "p99_without_hedging": primary_p99,
+            "p99_saved": None if p99 is None or primary_p99 is None else round(primary_p99 - p99, 4),
+        }
+
+
+_hedging = _Hedging()
+
+
+def hedge_stats() -> dict:
+    return _hedging.stats()
+
+
+def _get_hedge_executor():
+    global _hedge_executor
+    if _hedge_executor is None:
+        _hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+    return _hedge_executor
+
+
+def _is_valid(parsed) -> bool:
+    return not (isinstance(parsed, dict) and "error" in parsed)
+
+
+def _attempt(prompt, model, kind, response_schema=None):
+    start = time.perf_counter()
+    parsed = parse_json_response(generate_text(prompt, model, response_schema))
+    if _is_valid(parsed):
+        _hedging.record_attempt(kind, time.perf_counter() - start)
+    return parsed
+
+
+def generate_json(prompt: str, model: str = DEFAULT_MODEL, kind: str = "default",
+                  response_schema: dict | None = None) -> dict:
+    """
+    Sends a prompt and returns the parsed JSON response ({"error": ...} if unparseable).
+
+    kind groups prompts of similar size ("roadmap", "mcqs") for the hedge delay. Raises
+    the first request's exception only if no request produced a response.
+    """
+    delay = _hedging.delay(kind)
+    if delay is None:
+        return _attempt(prompt, model, kind, response_schema)
+
+    _hedging.start_call()
+    start = time.perf_counter()
+    # Each request runs in a copy of the caller's context, so it is charged like the caller's
+    primary = _get_hedge_executor().submit(contextvars.copy_context().run, _attempt, prompt, model, kind,
+                                           response_schema)
+    primary.add_done_callback(lambda _: _hedging.record_primary(time.perf_counter() - start))
+    futures = [primary]
+    done, _ = wait(futures, timeout=delay)
+    if not done and _hedging.try_hedge():
+        futures.append(_get_hedge_executor().submit(contextvars.copy_context().run, _attempt, prompt,
+                                                     _hedging.hedge_model(model), kind, response_schema))
+
+    result, error, winner = None, None, None
+    pending = set(futures)
+    while pending and winner is None:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in futures:
+            if future not in done:
+                continue
+            if future.exception() is not None:
+                error = error or future.exception()
+            elif _is_valid(future.result()):
+                winner = future
+                break
+            else:
+                result = result or future.result()
+    for future in pending:
+        future.cancel()  # a running thread cannot be stopped; its answer is simply dropped
+
+    _hedging.finish_call(time.perf_counter() - start, winner is not None and winner is not primary)
+    if winner is not None:
+        return winner.result()
+    if result is not None:
+        return result
+    raise error
+
+
+async def generate_json_async(prompt: str, model: str = DEFAULT_MODEL, kind: str = "default",
+                              executor=None, response_schema: dict | None = None) -> dict:
+    """Non-blocking generate_json; JSON is parsed on `executor` to keep the event loop free."""
+    loop = asyncio.get_running_loop()
+
+    async def attempt(attempt_model, is_primary=False):
+        attempt_start = time.perf_counter()
+        try:
+            raw_text = await generate_text_async(prompt, attempt_model, response_schema)
+            parsed = await loop.run_in_executor(executor, parse_json_response, raw_text)
+        finally:
+            if is_primary and hedging:
+                _hedging.record_primary(time.perf_counter() - attempt_start)
+        if _is_valid(parsed):
+            _hedging.record_attempt(kind, time.perf_counter() - attempt_start)
+        return parsed
+
+    delay = _hedging.delay(kind)
+    hedging = delay is not None
+    if not hedging:
+        return await attempt(model)
+
+    _hedging.start_call()
+    start = time.perf_counter()
+    primary = asyncio.ensure_future(attempt(model, is_primary=True))
+    tasks = [primary]
+    done, _ = await asyncio.wait(tasks, timeout=delay)
+    if not done and _hedging.try_hedge():
+        tasks.append(asyncio.ensure_future(attempt(_hedging.hedge_model(model))))
+
+    result, error, winner = None, None, None
+    pending = set(tasks)
+    try:
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in tasks:
+                if task not in done:
+                    continue
+                if task.exception() is not None:
+                    error = error or task.exception()
+                elif _is_valid(task.result()):
+                    winner = task
+                    break
+                else:
+                    result = result or task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+    _hedging.finish_call(time.perf_counter() - start, winner is not None and winner is not primary)
+    if winner is not None:
+        return winner.result()
+    if result is not None:
+        return result
+    raise error
+
+
+async def _benchmark(calls, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await generate_json_async(f"benchmark {i}", kind="benchmark")
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return np.array(latencies)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare LLM tail latency with and without hedging (fake LLM).")
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.2, help="Usual fake LLM latency in seconds.")
+    parser.add_argument("--slow-rate", type=float, default=0.03, help="Share of fake calls that are slow.")
+    parser.add_argument("--slow-latency", type=float, default=3.0)
+    parser.add_argument("--budget", type=float, default=0.1)
+    args = parser.parse_args()
+
+    os.environ.update({
+        "NEXTPATH_FAKE_LLM": "1",
+        "NEXTPATH_FAKE_LLM_LATENCY": str(args.latency),
+        "NEXTPATH_FAKE_LLM_SLOW_RATE": str(args.slow_rate),
+        "NEXTPATH_FAKE_LLM_SLOW_LATENCY": str(args.slow_latency),
+        "NEXTPATH_LLM_HEDGE_BUDGET": str(args.budget),
+    })
+    for hedge in ("0", "1"):
+        os.environ["NEXTPATH_LLM_HEDGE"] = hedge
+        latencies = asyncio.run(_benchmark(args.calls, args.concurrency))
+        label = "hedged  " if hedge == "1" else "baseline"
+        print(f"{label}: p50={np.percentile(latencies, 50):.3f}s p95={np.percentile(latencies, 95):.3f}s "
+              f"p99={np.percentile(latencies, 99):.3f}s max={latencies.max():.3f}s")
+    stats = hedge_stats()
+    print(f"hedged {stats['hedged']} of {stats['calls']} calls ({stats['hedge_rate']:.1%}), "
+          f"{stats['hedge_wins']} hedge wins, {stats['budget_denied']} denied by budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,466 @@
+"""
+Load tests for the API servers.
+
+--mode generate (default): concurrent roadmap generation. Start the server under test
+with the fake backends so every generation costs a fixed LLM latency and no database, and
+on a scratch data root so the generated users stay out of users_data, e.g.
+
+    export NEXTPATH_FAKE_LLM=1 NEXTPATH_FAKE_DB=1 NEXTPATH_DATA_ROOT=$(mktemp -d)
+    gunicorn -w 1 --threads 8 -b :5000 server:app
+    hypercorn -w 1 -b :5001 async_server:app
+
+then point this script at each one:
+
+    python load_test.py --url http://localhost:5000 --levels 1 8 32 128
+    python load_test.py --url http://localhost:5001 --levels 1 8 32 128
+
+For every concurrency level it fires that many /generate_roadmap requests at once, each
+for a user without a roadmap, and reports throughput and latency. A level counts as
+sustained when nothing failed and p95 latency stayed within --slo-factor times the
+fake LLM latency. Both servers answer once the roadmap is saved and generate its tests
+in the background, so the two are timed on the same work.
+
+--mode sessions: realistic learner traffic against main_controller's /api routes.
+Sessions arrive as a Poisson process at --rate per second for --duration seconds, and
+each one is drawn from --mix:
+
+    browser            checks for the roadmap and fetches it
+    returning_learner  checks and fetches the roadmap, then checks, fetches and submits a test
+    new_learner        requests a roadmap and polls its status
+
+--seed-users learners with a fake roadmap and tests are written first, to --data-root.
+With --serve the script starts main_controller as a subprocess on the fake LLM and DB
+backends and on a temporary data root (removed afterwards), so no setup is needed:
+
+    python load_test.py --mode sessions --serve --rate 20 --duration 60
+
+Against a server started separately, pass the NEXTPATH_DATA_ROOT it runs with; seeding
+never writes to the real users_data:
+
+    python load_test.py --mode sessions --url http://localhost:5000 --data-root /tmp/nextpath-load
+
+p50/p95/p99 latency, error rate and throughput are reported per endpoint and saved to
+--output (default load_results/sessions-<time>.json); --compare prints the change
+against an earlier result file, so a caching, storage or worker change can be measured
+before it ships.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def post_json(url, payload, timeout):
+    body = json.dumps(payload).encode()
+    req = urllib.request.Request(url, data=body, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            ok = resp.status == 200
+    except (urllib.error.URLError, TimeoutError, ConnectionError):
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+def run_level(base_url, concurrency, timeout):
+    # Numeric IDs so the fake DB resolves them; a run-specific offset keeps them unique.
+    offset = uuid.uuid4().int % 10**9 * 1000
+    user_ids = [str(offset + i) for i in range(concurrency)]
+    url = f"{base_url.rstrip('/')}/generate_roadmap"
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda uid: post_json(url, {"user_id": uid}, timeout), user_ids))
+    wall = time.perf_counter() - start
+    latencies = [lat for ok, lat in results if ok]
+    return {
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "errors": len(results) - len(latencies),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "p50": round(percentile(latencies, 50), 3),
+        "p95": round(percentile(latencies, 95), 3),
+        "max": round(max(latencies, default=0.0), 3),
+    }
+
+
+def run_generation_levels(args):
+    slo = args.llm_latency * args.slo_factor
+    results = []
+    sustained = 0
+    print(f"{'conc':>6} {'ok':>6} {'err':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'max':>8}")
+    for level in args.levels:
+        result = run_level(args.url, level, args.timeout)
+        results.append(result)
+        print(f"{result['concurrency']:>6} {result['ok']:>6} {result['errors']:>6} {result['throughput_rps']:>8} "
+              f"{result['p50']:>8} {result['p95']:>8} {result['max']:>8}")
+        if result["errors"] == 0 and result["p95"] <= slo:
+            sustained = level
+
+    print(f"\nHighest sustained concurrency (p95 <= {slo:.1f}s, no errors): {sustained}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"url": args.url, "slo_seconds": slo, "sustained": sustained, "levels": results}, f, indent=4)
+
+
+# --- Session mixes ---
+
+DEFAULT_MIX = {"browser": 0.3, "returning_learner": 0.6, "new_learner": 0.1}
+SEED_USER_OFFSET = 900_000  # numeric, so the fake DB resolves the seeded learners
+
+
+def request(method, url, payload=None, timeout=30.0):
+    """Returns (status or None, latency, parsed JSON body or None)."""
+    data = json.dumps(payload).encode() if payload is not None else None
+    req = urllib.request.Request(url, data=data, method=method, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            body = resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        body, status = e.read(), e.code
+    except (urllib.error.URLError, TimeoutError, ConnectionError):
+        return None, time.perf_counter() - start, None
+    latency = time.perf_counter() - start
+    try:
+        return status, latency, json.loads(body)
+    except ValueError:
+        return status, latency, None
+
+
+class Recorder:
+    """Latency and outcome of every request, per endpoint."""
+
+    def __init__(self):
+        self.calls = defaultdict(list)  # endpoint -> [(latency, ok, status)]
+        self.sessions = defaultdict(int)
+        self.start_delays = []
+        self._lock = threading.Lock()
+
+    def add(self, endpoint, status, latency):
+        with self._lock:
+            self.calls[endpoint].append((latency, status is not None and status < 400, status))
+
+    def session(self, kind, start_delay):
+        with self._lock:
+            self.sessions[kind] += 1
+            self.start_delays.append(start_delay)
+
+    def summary(self, wall_seconds) -> dict:
+        endpoints = {}
+        for endpoint, calls in sorted(self.calls.items()):
+            latencies = [latency for latency, ok, _ in calls if ok]
+            statuses = defaultdict(int)
+            for _, _, status in calls:
+                statuses[str(status) if status is not None else "connection_error"] += 1
+            endpoints[endpoint] = {
+                "requests": len(calls),
+                "errors": len(calls) - len(latencies),
+                "error_rate": round((len(calls) - len(latencies)) / len(calls), 4),
+                "throughput_rps": round(len(calls) / wall_seconds, 2),
+                "p50": round(percentile(latencies, 50), 4),
+                "p95": round(percentile(latencies, 95), 4),
+                "p99": round(percentile(latencies, 99), 4),
+                "max": round(max(latencies, default=0.0), 4),
+                "statuses": dict(statuses),
+            }
+        return {
+            "sessions": dict(self.sessions),
+            "session_start_delay_p95": round(percentile(self.start_delays, 95), 4),
+            "endpoints": endpoints,
+        }
+
+
+class SessionRunner:
+    def __init__(self, base_url, recorder, users, think_time, poll_interval, max_polls, timeout):
+        self.api = base_url.rstrip("/") + "/api"
+        self.recorder = recorder
+        self.users = users  # {user_id: [(phase, milestone_id, subtopic_id, question count)]}
+        self.think_time = think_time
+        self.poll_interval = poll_interval
+        self.max_polls = max_polls
+        self.timeout = timeout
+
+    def _call(self, endpoint, method, path, payload=None):
+        status, latency, body = request(method, self.api + path, payload, self.timeout)
+        self.recorder.add(endpoint, status, latency)
+        return status, body
+
+    def _think(self):
+        if self.think_time > 0:
+            time.sleep(random.expovariate(1 / self.think_time))
+
+    def browser(self, user_id):
+        self._call("roadmap_check", "GET", f"/roadmap/check/{user_id}")
+        self._think()
+        self._call("roadmap_fetch", "GET", f"/roadmap/adaptive/{user_id}")
+
+    def returning_learner(self, user_id):
+        self.browser(user_id)
+        phase, milestone_id, subtopic_id, questions = random.choice(self.users[user_id])
+        self._think()
+        self._call("test_check", "GET", f"/test/check/{user_id}/{subtopic_id}")
+        self._call("test_fetch", "GET", f"/test/{user_id}/{phase}/{milestone_id}/{subtopic_id}")
+        self._think()
+        answers = [random.choice("1234") for _ in range(questions)]
+        self._call("test_submit", "POST", "/test/submit", {
+            "userId": user_id, "phase": phase, "milestone": milestone_id, "subtopic": subtopic_id,
+            "answers": answers, "timeTaken": [round(random.uniform(5, 40), 1) for _ in answers],
+        })
+
+    def new_learner(self, _):
+        user_id = str(SEED_USER_OFFSET + 500_000 + uuid.uuid4().int % 400_000)
+        self._call("roadmap_generate", "POST", "/roadmap/generate", {"userId": user_id})
+        for _ in range(self.max_polls):
+            time.sleep(self.poll_interval)
+            status, body = self._call("roadmap_check", "GET", f"/roadmap/check/{user_id}")
+            if status != 200 or (body or {}).get("exists") or str((body or {}).get("status", "")).startswith("error"):
+                break
+
+    def run(self, kind, arrived_at):
+        self.recorder.session(kind, time.perf_counter() - arrived_at)
+        user_id = random.choice(list(self.users))
+        getattr(self, kind)(user_id)
+
+
+def _fake_test(phase, milestone_id, subtopic_id, questions=5) -> dict:
+    return {
+        "phase_number": phase,
+        "milestone_id": milestone_id,
+        "subtopic_id": subtopic_id,
+        "subtopic_name": f"Subtopic {subtopic_id}",
+        "created_at": datetime.now().isoformat(),
+        "mcqs": [
+            {"question": f"Question {i} on {subtopic_id}?",
+             "options": {"1": "A", "2": "B", "3": "C", "4": "D"},
+             "answer": str(i % 4 + 1), "topic_label": f"Topic {i}", "difficulty": "medium"}
+            for i in range(questions)
+        ],
+    }
+
+
+def seed_users(count, data_root) -> dict:
+    """Writes a fake roadmap and a test for every subtopic of `count` learners under data_root."""
+    os.environ["NEXTPATH_DATA_ROOT"] = data_root  # read by utils when first imported, below
+    import fake_backends
+    import test_store
+    from json_store import atomic_write_json
+    from utils import DATA_ROOT, get_roadmap_path
+
+    if os.path.abspath(DATA_ROOT) != os.path.abspath(data_root):
+        raise RuntimeError(f"utils was imported with data root {DATA_ROOT} before seeding")
+    users = {}
+    for i in range(count):
+        user_id = str(SEED_USER_OFFSET + i)
+        roadmap = fake_backends._fake_roadmap("**Target Career:** Data Scientist", phases=3, milestones=3, subtopics=3)
+        atomic_write_json(get_roadmap_path(user_id), roadmap)
+        subtopics = users[user_id] = []
+        for phase in roadmap["roadmap"]["phases"]:
+            for milestone in phase["milestones"]:
+                for subtopic in milestone["subtopics"]:
+                    test = _fake_test(phase["phase_number"], milestone["milestone_id"], subtopic["subtopic_id"])
+                    key = test_store.put_test(user_id, test)
+                    subtopics.append((*key, len(test["mcqs"])))
+    return users
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(data_root, timeout=60.0) -> tuple[str, subprocess.Popen]:
+    """Starts main_controller in a subprocess on the fake backends and data_root; returns (url, process)."""
+    port = _free_port()
+    env = {**os.environ, "NEXTPATH_DATA_ROOT": data_root}
+    env.setdefault("NEXTPATH_FAKE_LLM", "1")
+    env.setdefault("NEXTPATH_FAKE_DB", "1")
+    log = open(os.path.join(data_root, "server.log"), "w")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "flask", "--app", "main_controller", "run", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    log.close()
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"main_controller exited with {process.returncode}, see {data_root}/server.log")
+        if request("GET", f"{url}/api/roadmap/check/{SEED_USER_OFFSET}", timeout=1.0)[0] is not None:
+            return url, process
+        time.sleep(0.2)
+    stop_server(process)
+    raise RuntimeError(f"main_controller did not answer within {timeout:.0f}s, see {data_root}/server.log")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def parse_mix(text) -> dict:
+    mix = dict(DEFAULT_MIX) if not text else {}
+    for part in (text or "").split(","):
+        if part.strip():
+            kind, weight = part.split("=")
+            if kind.strip() not in DEFAULT_MIX:
+                raise ValueError(f"Unknown session kind: {kind}")
+            mix[kind.strip()] = float(weight)
+    return mix
+
+
+def run_sessions(args):
+    if args.serve:
+        data_root = args.data_root or tempfile.mkdtemp(prefix="nextpath-load-")
+    elif args.data_root:
+        data_root = args.data_root
+    else:
+        raise SystemExit("--data-root is required without --serve: pass the NEXTPATH_DATA_ROOT of the server "
+                         "under test, so seeded learners stay out of users_data")
+    os.makedirs(data_root, exist_ok=True)
+    process = None
+    try:
+        users = seed_users(args.seed_users, data_root)
+        url = args.url
+        if args.serve:
+            url, process = start_server(data_root)
+        return _replay(args, url, users)
+    finally:
+        if process is not None:
+            stop_server(process)
+        if args.serve and not args.data_root:
+            shutil.rmtree(data_root, ignore_errors=True)
+
+
+def _replay(args, url, users):
+    mix = parse_mix(args.mix)
+    kinds, weights = list(mix), list(mix.values())
+    recorder = Recorder()
+    runner = SessionRunner(url, recorder, users, args.think_time, args.poll_interval, args.max_polls, args.timeout)
+    print(f"Replaying {args.rate} sessions/s for {args.duration}s against {url} (mix {mix})...")
+
+    start = time.perf_counter()
+    arrivals = 0
+    with ThreadPoolExecutor(max_workers=args.max_sessions) as pool:
+        next_arrival = start
+        while next_arrival - start < args.duration:
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(runner.run, random.choices(kinds, weights)[0], next_arrival)
+            arrivals += 1
+            next_arrival += random.expovariate(args.rate)  # Poisson arrivals
+    wall = time.perf_counter() - start
+
+    result = {
+        "url": url,
+        "started_at": datetime.now().isoformat(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("compare", "output")},
+        "mix": mix,
+        "arrivals": arrivals,
+        "wall_seconds": round(wall, 3),
+        **recorder.summary(wall),
+    }
+    print_sessions(result)
+    if args.compare:
+        print_comparison(result, load_json(args.compare))
+    output = args.output or os.path.join("load_results", f"sessions-{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=4)
+    print(f"\nSaved results to {output}")
+    return result
+
+
+def load_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_sessions(result):
+    print(f"\n{result['arrivals']} sessions in {result['wall_seconds']}s {result['sessions']}, "
+          f"p95 start delay {result['session_start_delay_p95']}s")
+    print(f"{'endpoint':<18} {'reqs':>6} {'err%':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for endpoint, stats in result["endpoints"].items():
+        print(f"{endpoint:<18} {stats['requests']:>6} {stats['error_rate'] * 100:>6.1f} {stats['throughput_rps']:>7} "
+              f"{stats['p50']:>8} {stats['p95']:>8} {stats['p99']:>8} {stats['max']:>8}")
+
+
+def print_comparison(result, baseline):
+    """Change of each endpoint's latency percentiles and throughput against a saved run."""
+    print(f"\nChange against {baseline.get('started_at', 'baseline')}:")
+    print(f"{'endpoint':<18} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>9} {'err%':>7}")
+    for endpoint, stats in result["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if not before:
+            continue
+
+        def change(field):
+            return f"{(stats[field] - before[field]) / before[field] * 100:+.0f}%" if before[field] else "n/a"
+
+        print(f"{endpoint:<18} {change('p50'):>9} {change('p95'):>9} {change('p99'):>9} {change('throughput_rps'):>9} "
+              f"{(stats['error_rate'] - before['error_rate']) * 100:>+7.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load tests for the API servers.")
+    parser.add_argument("--mode", choices=["generate", "sessions"], default="generate")
+    parser.add_argument("--url", default="http://localhost:5000", help="Base URL of the server under test.")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds.")
+    parser.add_argument("--output", help="Path to save the results as JSON.")
+    generate = parser.add_argument_group("generate mode")
+    generate.add_argument("--levels", type=int, nargs="+", default=[1, 4, 16, 64], help="Concurrency levels to try.")
+    generate.add_argument("--llm-latency", type=float, default=1.0, help="NEXTPATH_FAKE_LLM_LATENCY the server runs with.")
+    generate.add_argument("--slo-factor", type=float, default=2.0, help="Allowed p95 as a multiple of the LLM latency.")
+    sessions = parser.add_argument_group("sessions mode")
+    sessions.add_argument("--serve", action="store_true",
+                          help="Start main_controller as a subprocess on the fake backends and a temporary data root.")
+    sessions.add_argument("--data-root", help="Data root to seed learners into: the server's NEXTPATH_DATA_ROOT. "
+                                              "With --serve, kept after the run instead of a temporary one.")
+    sessions.add_argument("--rate", type=float, default=10.0, help="Session arrivals per second (Poisson).")
+    sessions.add_argument("--duration", type=float, default=30.0, help="Seconds to keep sessions arriving.")
+    sessions.add_argument("--mix", help="Session weights, e.g. browser=0.3,returning_learner=0.6,new_learner=0.1.")
+    sessions.add_argument("--seed-users", type=int, default=50, help="Learners to create with a roadmap and tests.")
+    sessions.add_argument("--think-time", type=float, default=0.5, help="Mean seconds between a session's steps.")
+    sessions.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between roadmap status polls.")
+    sessions.add_argument("--max-polls", type=int, default=5, help="Status polls per new learner.")
+    sessions.add_argument("--max-sessions", type=int, default=256, help="Sessions running at the same time.")
+    sessions.add_argument("--compare", help="Earlier sessions result file to compare against.")
+    args = parser.parse_args()
+
+    if args.mode == "sessions":
+        run_sessions(args)
+    else:
+        run_generation_levels(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,37 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
-import json
 import subprocess
-import threading
+import sys
+import adaptive_sessions
+from cohort_analytics import query as analytics_query
+from grading import (load_answer_key, grade, grade_submissions, store_graded_submission, normalize_timings,
+                     feedback_for, SubmissionError)
+import http_cache
+from batch_reads import BatchError, read_roadmaps, read_tests, summarize
+from job_store import JobStore, JobWorker
+from backfill_worker import backfill_stats, start_backfill_worker
+from llm_client import hedge_stats
+from model_router import get_router
+import profiling
+from resilience import breaker_stats
+from roadmap_model import load_roadmap, outline_of, view_from_query
+import test_store
+from utils import get_roadmap_path, get_adaptive_roadmap_path, get_test_scores_path, is_safe_id
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
+profiling.init_app(app)  # X-NextPath-Profile header (admin only) or NEXTPATH_PROFILE
 
-roadmap_generation_status = {}
+# Job status lives in a shared store so any worker process can answer status checks
+job_store = JobStore()
 
-# --- Helper Functions ---
-
-def get_roadmap_path(user_id):
-    return f"users_data/Roadmap_data/{user_id}.json"
-
-def get_adaptive_roadmap_path(user_id):
-    return f"users_data/Adaptive_Roadmaps_data/{user_id}_Adaptive.json"
-
-def get_test_data_path(user_id):
-    return f"users_data/Test_data/{user_id}_Tests.json"
-
-def get_test_scores_path(user_id):
-    return f"users_data/Test_scores_data/{user_id}_Scores.json"
+@app.before_request
+def reject_unsafe_user_id():
+    """User IDs in the URL name files, so one that could leave the data folder is refused"""
+    user_id = (request.view_args or {}).get("user_id")
+    if user_id is not None and not is_safe_id(user_id):
+        return jsonify({"error": "Invalid userId"}), 400
 
 # --- Roadmap Endpoints ---
 
@@ -32,15 +41,12 @@ def check_roadmap(user_id):
     if os.path.exists(get_adaptive_roadmap_path(user_id)) or os.path.exists(get_roadmap_path(user_id)):
         return jsonify({"exists": True, "status": "completed"})
     
-    status = roadmap_generation_status.get(user_id, "not_found")
+    status = job_store.status(user_id, "roadmap")
     return jsonify({"exists": False, "status": status})
 
 def run_roadmap_generation(user_id):
-    try:
-        subprocess.run(["python", "Roadmap_generator.py", user_id], check=True)
-        roadmap_generation_status[user_id] = "completed"
-    except subprocess.CalledProcessError as e:
-        roadmap_generation_status[user_id] = f"error: {e}"
+    # Raising marks the job as failed in the store
+    subprocess.run([sys.executable, "Roadmap_generator.py", user_id, *profiling.subprocess_args()], check=True)
 
 @app.route('/api/roadmap/generate', methods=['POST'])
 def generate_roadmap():
@@ -49,124 +55,249 @@ def generate_roadmap():
     user_id = data.get("userId")
     if not user_id:
         return jsonify({"error": "userId is required"}), 400
+    if not is_safe_id(user_id):
+        return jsonify({"error": "Invalid userId"}), 400
+
+    # A double-click or a retrying frontend attaches to the job already queued or running,
+    # whichever worker process accepted it
+    queued = job_store.submit(user_id, "roadmap", profiling.requested_mode())
 
-    roadmap_generation_status[user_id] = "generating"
-    thread = threading.Thread(target=run_roadmap_generation, args=(user_id,))
-    thread.start()
+    return jsonify({"status": "generating", "userId": user_id, "deduplicated": not queued})
 
-    return jsonify({"status": "generating", "userId": user_id})
+def json_file(path, transform=None, tag=""):
+    """Serves a JSON file with ETag/Last-Modified (304 when unchanged) and compression, or None if missing"""
+    result = http_cache.json_file_response(path, request.headers, transform, tag)
+    if result is None:
+        return None
+    status, headers, body = result
+    return Response(body, status=status, headers=headers)
 
 @app.route('/api/roadmap/<user_id>', methods=['GET'])
 def get_roadmap(user_id):
-    """Get original roadmap JSON"""
-    roadmap_path = get_roadmap_path(user_id)
-    if not os.path.exists(roadmap_path):
+    """Get original roadmap JSON; ?fields=, ?phase= and ?milestone= narrow it down"""
+    response = json_file(get_roadmap_path(user_id), *view_from_query(request.args))
+    if response is None:
         return jsonify({"error": "Roadmap not found"}), 404
-    
-    with open(roadmap_path, "r") as f:
-        roadmap_data = json.load(f)
-    
-    return jsonify(roadmap_data)
+    return response
 
 @app.route('/api/roadmap/adaptive/<user_id>', methods=['GET'])
 def get_adaptive_roadmap(user_id):
     """Get adaptive roadmap if exists, otherwise original"""
-    adaptive_path = get_adaptive_roadmap_path(user_id)
-    if os.path.exists(adaptive_path):
-        with open(adaptive_path, "r") as f:
-            return jsonify(json.load(f))
+    response = json_file(get_adaptive_roadmap_path(user_id), *view_from_query(request.args))
+    if response is not None:
+        return response
     
     return get_roadmap(user_id)
 
+@app.route('/api/roadmap/batch', methods=['POST'])
+def get_roadmaps_batch():
+    """Roadmaps (outline, or narrowed like ?fields=&phase=&milestone=) of many users in one call"""
+    data = request.get_json(silent=True) or {}
+    try:
+        results = read_roadmaps(data.get("userIds"), data.get("view", "summary"),
+                                data.get("fields"), data.get("phase"), data.get("milestone"))
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(summarize(results))
+
+@app.route('/api/roadmap/summary/<user_id>', methods=['GET'])
+def get_roadmap_summary(user_id):
+    """Outline of the (adaptive) roadmap: IDs, titles, durations and statuses only"""
+    response = json_file(get_adaptive_roadmap_path(user_id), outline_of, "outline")
+    if response is None:
+        response = json_file(get_roadmap_path(user_id), outline_of, "outline")
+    if response is None:
+        return jsonify({"error": "Roadmap not found"}), 404
+    return response
+
 # --- Test Endpoints ---
 
 @app.route('/api/test/check/<user_id>/<topic_id>', methods=['GET'])
 def check_test(user_id, topic_id):
     """Check if test exists for topic"""
-    test_file = get_test_data_path(user_id)
-    if not os.path.exists(test_file):
-        return jsonify({"exists": False})
-    
-    with open(test_file, "r") as f:
-        tests_data = json.load(f)
-    
-    # This logic needs to be adapted based on the actual structure of Test_data files
-    # For now, we assume a simple check if the topic_id is a key somewhere
-    def find_topic(data, topic_id):
-        if isinstance(data, dict):
-            for key, value in data.items():
-                if key == topic_id:
-                    return True
-                if find_topic(value, topic_id):
-                    return True
-        elif isinstance(data, list):
-            for item in data:
-                if find_topic(item, topic_id):
-                    return True
-        return False
-
-    if find_topic(tests_data, topic_id):
+    if test_store.find_test(user_id, topic_id) is not None:
         return jsonify({"exists": True, "testId": topic_id})
     else:
         return jsonify({"exists": False})
 
+@app.route('/api/test/batch', methods=['POST'])
+def get_tests_batch():
+    """Questions of many tests in one call; tests that cannot be read get their own error"""
+    data = request.get_json(silent=True) or {}
+    try:
+        results = read_tests(data.get("tests"))
+    except BatchError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(summarize(results))
+
 @app.route('/api/test/<user_id>/<phase>/<milestone>/<subtopic>', methods=['GET'])
 def get_test(user_id, phase, milestone, subtopic):
     """Get test questions"""
-    test_file = get_test_data_path(user_id)
-    if not os.path.exists(test_file):
-        return jsonify({"error": "Tests not found for this user"}), 404
-    
-    with open(test_file, "r") as f:
-        tests_data = json.load(f)
-        
-    try:
-        questions = tests_data[phase][milestone][subtopic]
-        return jsonify({"questions": questions.get("mcqs", [])})
-    except KeyError:
+    response = json_file(test_store.stored_test_path(user_id, phase, milestone, subtopic), test_questions, "questions")
+    if response is None:
         return jsonify({"error": "Test not found for this topic"}), 404
+    return response
+
+def test_questions(test):
+    return {"questions": test.get("mcqs", [])}
+
+def run_adaptive_model(user_id):
+    subprocess.run([sys.executable, "Adaptive_Model.py", user_id, *profiling.subprocess_args()], check=True)
 
 @app.route('/api/test/submit', methods=['POST'])
 def submit_test():
-    """Submit test answers and trigger adaptive model"""
+    """Grade submitted test answers and trigger adaptive model"""
     data = request.get_json()
     user_id = data.get("userId")
     answers = data.get("answers")
+    phase, milestone, subtopic = data.get("phase"), data.get("milestone"), data.get("subtopic")
 
     if not user_id or not answers:
         return jsonify({"error": "userId and answers are required"}), 400
+    if not is_safe_id(user_id):
+        return jsonify({"error": "Invalid userId"}), 400
+    if phase is None or not milestone or not subtopic:
+        return jsonify({"error": "phase, milestone and subtopic are required"}), 400
 
-    scores_file = get_test_scores_path(user_id)
-    
-    with open(scores_file, "w") as f:
-        json.dump(answers, f, indent=4)
+    answer_key = load_answer_key(user_id, phase, milestone, subtopic)
+    if answer_key is None:
+        return jsonify({"error": "Test not found for this topic"}), 404
+
+    try:
+        result, submitted = grade(answer_key, answers)
+        time_taken = normalize_timings(data.get("timeTaken"), len(answer_key), answers)
+    except SubmissionError as e:
+        return jsonify({"error": str(e)}), 400
+    store_graded_submission(get_test_scores_path(user_id), phase, milestone, subtopic, answer_key, submitted,
+                            user_id=user_id, time_taken=time_taken)
     
     # Trigger the adaptive model
     try:
-        subprocess.run(["python", "Adaptive_Model.py", user_id], check=True)
-        # This is a simplified response. A real implementation would calculate score and passed status.
-        return jsonify({"score": 80, "passed": True, "feedback": "Great job!"})
+        run_adaptive_model(user_id)
+        return jsonify({**result, "feedback": feedback_for(result)})
     except subprocess.CalledProcessError as e:
         return jsonify({"error": f"Failed to update adaptive model: {e}"}), 500
 
+@app.route('/api/test/submit/batch', methods=['POST'])
+def submit_test_batch():
+    """Grade many users' submissions in one call; adaptive updates are queued as jobs"""
+    submissions = (request.get_json() or {}).get("submissions", [])
+    if not submissions:
+        return jsonify({"error": "submissions are required"}), 400
+
+    results, graded_users = grade_submissions(submissions)
+    for user_id in graded_users:
+        job_store.submit(user_id, "adaptation", profiling.requested_mode(), rerun=True)
+
+    return jsonify({"results": results})
+
+# --- Adaptive Test Endpoints ---
+
+@app.route('/api/test/adaptive/start', methods=['POST'])
+def start_adaptive_test():
+    """Start an adaptive test that only asks the most informative questions"""
+    body, status = adaptive_sessions.start(request.get_json() or {})
+    return jsonify(body), status
+
+@app.route('/api/test/adaptive/answer', methods=['POST'])
+def answer_adaptive_test():
+    """Record one answer; returns the next question or the final result"""
+    body, status, graded_user = adaptive_sessions.answer(request.get_json() or {})
+    if graded_user is not None:
+        job_store.submit(graded_user, "adaptation", profiling.requested_mode(), rerun=True)
+    return jsonify(body), status
+
+# --- Analytics Endpoints ---
+
+@app.route('/api/analytics/<level>', methods=['GET'])
+def get_cohort_analytics(level):
+    """
+    Cohort accuracy, attempts and time per question.
+
+    level is career, subtopic or topic. With ?name= (and optionally ?career=) a single
+    aggregate is returned; without a name, the top rows of that level (?limit=,
+    ?orderBy=attempts|accuracy).
+    """
+    body, status = analytics_query(level, request.args)
+    return jsonify(body), status
+
+# --- Job Endpoints ---
+
+@app.route('/api/jobs/stats', methods=['GET'])
+def get_job_stats():
+    """Jobs per status and how many duplicate requests were coalesced"""
+    return jsonify(job_store.stats())
+
+@app.route('/api/health/dependencies', methods=['GET'])
+def get_dependency_health():
+    """Circuit breaker state of Gemini and PostgreSQL"""
+    return jsonify(breaker_stats())
+
+@app.route('/api/backfill/stats', methods=['GET'])
+def get_backfill_stats():
+    """Missing-test backlog, its drain rate and the backfill's LLM budget"""
+    return jsonify(backfill_stats())
+
+@app.route('/api/llm/stats', methods=['GET'])
+def get_llm_stats():
+    """Hedged LLM requests: hedge rate, budget denials and the p99 they save"""
+    return jsonify(hedge_stats())
+
+@app.route('/api/llm/routes', methods=['GET'])
+def get_llm_routes():
+    """Model routing config and recent latency/error rate of every route and tier"""
+    return jsonify(get_router().stats())
+
+@app.route('/api/http/stats', methods=['GET'])
+def get_http_cache_stats():
+    """304s served, compression savings and the serialized-document cache"""
+    return jsonify(http_cache.stats())
+
+@app.route('/api/admin/profiles', methods=['GET'])
+@profiling.admin_required
+def get_profiles():
+    """Saved profiling captures of requests and jobs, newest first"""
+    return jsonify(profiling.stats())
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+@profiling.admin_required
+def get_profile(name):
+    """Download one capture (folded stacks or a .prof file)"""
+    if name not in {capture["name"] for capture in profiling.list_captures()}:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_from_directory(os.path.abspath(profiling.PROFILE_DIR), name, as_attachment=True)
+
 # --- Recommendations Endpoint ---
 
 @app.route('/api/recommendations/<user_id>', methods=['GET'])
 def get_recommendations(user_id):
     """Get personalized recommendations"""
-    roadmap_path = get_roadmap_path(user_id)
-    if not os.path.exists(roadmap_path):
+    roadmap = load_roadmap(get_roadmap_path(user_id))
+    if roadmap is None:
         return jsonify({"error": "Roadmap not found"}), 404
     
-    with open(roadmap_path, "r") as f:
-        roadmap_data = json.load(f)
-    
     try:
-        # This assumes a specific structure of the roadmap JSON
-        recommendations = roadmap_data["roadmap"]["phases"][0]["personalized_recommendations"]
+        recommendations = roadmap.phases[0]["personalized_recommendations"]
         return jsonify({"recommendations": recommendations})
     except (KeyError, IndexError):
         return jsonify({"error": "Recommendations not found"}), 404
 
+# --- Job Workers ---
+
+job_handlers = {"roadmap": run_roadmap_generation, "adaptation": run_adaptive_model}
+
+def start_job_workers(count):
+    """Starts worker threads that claim jobs from the shared store"""
+    workers = [JobWorker(job_store, job_handlers) for _ in range(count)]
+    for worker in workers:
+        worker.start()
+    return workers
+
+# Set NEXTPATH_JOB_WORKERS=0 on processes that should only accept requests
+job_workers = start_job_workers(int(os.getenv("NEXTPATH_JOB_WORKERS", "1")))
+
+# Set NEXTPATH_BACKFILL=1 to fill missing tests in the background
+backfill_worker = start_backfill_worker()
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
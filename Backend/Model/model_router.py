@@ -0,0 +1,252 @@
+"""
+Picks the Gemini model for each kind of request (route) and falls back across tiers.
+
+Every route lists its candidate models, cheapest first, and an optional latency SLO:
+
+    roadmap      interactive, the learner waits for it (roadmap_outline, roadmap_phase and
+                 roadmap_profile are the pieces of a fan-out generation)
+    adaptation   interactive, runs right after a test is submitted
+    mcqs         bulk pre-generation in the background: cheapest healthy tier
+
+For each (route, model) the router keeps the recent calls. Latency is fitted against
+prompt size (latency ~ a + b * chars) so a long prompt predicts a longer call, and the
+p90 residual is added as headroom. An interactive route takes the cheapest model whose
+predicted latency meets the SLO; a bulk route takes the cheapest model. Models whose
+recent error rate exceeds the route's max_error_rate, whose circuit breaker is open or
+whose context is too small for the prompt are skipped. Models without enough history
+are assumed to be fine, so a recovered tier is tried again.
+
+A call can name a schema (see schemas.py); it is sent as a structured-output constraint
+to models that support it. A failing call moves on to the next candidate, so an overloaded tier does not fail the
+request. Routes can be overridden with a JSON file named by NEXTPATH_MODEL_ROUTES,
+e.g. {"mcqs": {"models": ["gemini-2.0-flash-lite"]}, "roadmap": {"slo_seconds": 30}}.
+"""
+import os
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+import numpy as np
+
+import llm_client
+import resilience
+import schemas
+from json_store import read_json
+
+# Cheapest first. max_prompt_chars keeps a model out of routes whose prompts it cannot take;
+# structured_output says whether it accepts a response_schema.
+MODELS = {
+    "gemini-2.5-flash-lite": {"max_prompt_chars": 3_000_000, "structured_output": True},
+    "gemini-2.5-flash": {"max_prompt_chars": 3_000_000, "structured_output": True},
+    "gemini-2.5-pro": {"max_prompt_chars": 3_000_000, "structured_output": True},
+}
+
+DEFAULT_ROUTES = {
+    "roadmap": {"models": ["gemini-2.5-flash-lite", "gemini-2.5-flash"], "slo_seconds": 60, "max_error_rate": 0.3},
+    "roadmap_outline": {"models": ["gemini-2.5-flash-lite", "gemini-2.5-flash"], "slo_seconds": 15, "max_error_rate": 0.3},
+    "roadmap_phase": {"models": ["gemini-2.5-flash-lite", "gemini-2.5-flash"], "slo_seconds": 40, "max_error_rate": 0.3},
+    "roadmap_profile": {"models": ["gemini-2.5-flash-lite", "gemini-2.5-flash"], "slo_seconds": 40, "max_error_rate": 0.3},
+    "adaptation": {"models": ["gemini-2.5-flash-lite", "gemini-2.5-flash"], "slo_seconds": 20, "max_error_rate": 0.3},
+    "mcqs": {"models": ["gemini-2.5-flash-lite", "gemini-2.5-flash"], "slo_seconds": None, "max_error_rate": 0.5},
+}
+
+STATS_WINDOW = 200
+STATS_MAX_AGE = 600  # seconds; older calls say little about a tier that may have recovered
+MIN_SAMPLES = 10
+FIT_MIN_SAMPLES = 20
+
+
+@lru_cache(maxsize=None)
+def _response_schema(name) -> dict:
+    return schemas.response_schema(name)
+
+
+def _schema_for(model, schema) -> dict | None:
+    if schema is None or not MODELS.get(model, {}).get("structured_output"):
+        return None
+    return _response_schema(schema)
+
+
+def load_routes() -> dict:
+    routes = {name: dict(config) for name, config in DEFAULT_ROUTES.items()}
+    path = os.getenv("NEXTPATH_MODEL_ROUTES")
+    if path:
+        for name, overrides in (read_json(path) or {}).items():
+            routes.setdefault(name, dict(DEFAULT_ROUTES["mcqs"])).update(overrides)
+    return routes
+
+
+class _CallStats:
+    """Recent (time, prompt chars, latency, ok) of one route on one model."""
+
+    def __init__(self):
+        self.calls = deque(maxlen=STATS_WINDOW)
+
+    def add(self, chars, seconds, ok):
+        self.calls.append((time.monotonic(), chars, seconds, ok))
+
+    def recent(self) -> list[tuple]:
+        cutoff = time.monotonic() - STATS_MAX_AGE
+        return [(chars, seconds, ok) for at, chars, seconds, ok in list(self.calls) if at >= cutoff]
+
+    def error_rate(self) -> float | None:
+        calls = self.recent()
+        if len(calls) < MIN_SAMPLES:
+            return None
+        return sum(1 for _, _, ok in calls if not ok) / len(calls)
+
+    def predict(self, chars) -> float | None:
+        """Predicted p90 latency for a prompt of `chars` characters, or None without history."""
+        samples = np.array([(c, s) for c, s, ok in self.recent() if ok], dtype=float)
+        if len(samples) < MIN_SAMPLES:
+            return None
+        sizes, latencies = samples[:, 0], samples[:, 1]
+        if len(samples) < FIT_MIN_SAMPLES or np.ptp(sizes) == 0:
+            return float(np.percentile(latencies, 90))
+        slope, intercept = np.polyfit(sizes, latencies, 1)
+        slope = max(slope, 0.0)  # noise must not make long prompts look faster
+        residuals = latencies - (intercept + slope * sizes)
+        return float(intercept + slope * chars + np.percentile(residuals, 90))
+
+
+class ModelRouter:
+    def __init__(self, routes: dict | None = None):
+        self.routes = routes or load_routes()
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _route(self, route) -> dict:
+        if route not in self.routes:
+            raise ValueError(f"Unknown model route: {route}")
+        return self.routes[route]
+
+    def _call_stats(self, route, model) -> _CallStats:
+        with self._lock:
+            return self._stats.setdefault((route, model), _CallStats())
+
+    def record(self, route, model, chars, seconds, ok):
+        with self._lock:
+            self._stats.setdefault((route, model), _CallStats()).add(chars, seconds, ok)
+
+    def candidates(self, route, prompt) -> list[str]:
+        """Models to try for a prompt, best first; unhealthy ones are only kept as a last resort."""
+        config = self._route(route)
+        chars = len(prompt)
+        slo = config.get("slo_seconds")
+        max_error_rate = config.get("max_error_rate", 1.0)
+        viable, slow, unhealthy = [], [], []
+        for model in config["models"]:
+            if chars > MODELS.get(model, {}).get("max_prompt_chars", float("inf")):
+                continue
+            stats = self._call_stats(route, model)
+            error_rate = stats.error_rate()
+            if llm_client.model_breaker(model).state == "open" or (error_rate is not None and error_rate > max_error_rate):
+                unhealthy.append(model)
+                continue
+            predicted = stats.predict(chars) if slo is not None else None
+            if predicted is not None and predicted > slo:
+                slow.append((predicted, model))
+            else:
+                viable.append(model)
+        # Nothing meets the SLO: the fastest of the slow ones is the best we can do
+        return viable + [model for _, model in sorted(slow)] + unhealthy
+
+    def _failed(self, route, model, prompt, start, error, first_error):
+        """Records a failed tier; returns the error to raise if every tier fails."""
+        if not isinstance(error, resilience.CircuitOpenError):  # rejected without a call
+            self.record(route, model, len(prompt), time.perf_counter() - start, False)
+        print(f"{model} failed for {route} ({error}); trying the next tier")
+        # Prefer a transient error so the caller's retry loop tries again later
+        if first_error is None or (resilience.is_retryable(error) and not resilience.is_retryable(first_error)):
+            return error
+        return first_error
+
+    def _call(self, route, prompt, call, is_ok):
+        error = None
+        for model in self.candidates(route, prompt):
+            start = time.perf_counter()
+            try:
+                result = call(model)
+            except Exception as e:
+                error = self._failed(route, model, prompt, start, e, error)
+                continue
+            self.record(route, model, len(prompt), time.perf_counter() - start, is_ok(result))
+            return result
+        raise error or RuntimeError(f"No model available for route {route}")
+
+    def generate_json(self, route, prompt, schema=None) -> dict:
+        """
+        Sends the prompt to the best model for the route, falling back to the next on errors.
+
+        schema names an entry of schemas.SCHEMAS / REPAIRABLE_UNITS to constrain the output to.
+        """
+        return self._call(
+            route, prompt,
+            lambda model: llm_client.generate_json(prompt, model=model, kind=f"{route}/{model}",
+                                                   response_schema=_schema_for(model, schema)),
+            lambda parsed: "error" not in parsed,
+        )
+
+    def generate_text(self, route, prompt, schema=None) -> str:
+        """Like generate_json, for callers that parse the response themselves."""
+        return self._call(
+            route, prompt,
+            lambda model: llm_client.generate_text(prompt, model=model, response_schema=_schema_for(model, schema)),
+            lambda _: True,
+        )
+
+    async def generate_json_async(self, route, prompt, executor=None, schema=None) -> dict:
+        error = None
+        for model in self.candidates(route, prompt):
+            start = time.perf_counter()
+            try:
+                parsed = await llm_client.generate_json_async(prompt, model=model, kind=f"{route}/{model}",
+                                                              executor=executor,
+                                                              response_schema=_schema_for(model, schema))
+            except Exception as e:
+                error = self._failed(route, model, prompt, start, e, error)
+                continue
+            self.record(route, model, len(prompt), time.perf_counter() - start, "error" not in parsed)
+            return parsed
+        raise error or RuntimeError(f"No model available for route {route}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            items = list(self._stats.items())
+        result = {}
+        for (route, model), stats in items:
+            calls = stats.recent()
+            latencies = [s for _, s, ok in calls if ok]
+            result.setdefault(route, {})[model] = {
+                "calls": len(calls),
+                "error_rate": stats.error_rate(),
+                "p50": float(np.percentile(latencies, 50)) if latencies else None,
+                "p90": float(np.percentile(latencies, 90)) if latencies else None,
+                "breaker": llm_client.model_breaker(model).state,
+            }
+        return {name: {"config": config, "models": result.get(name, {})} for name, config in self.routes.items()}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
+
+
+def generate_json(route, prompt, schema=None) -> dict:
+    return get_router().generate_json(route, prompt, schema)
+
+
+async def generate_json_async(route, prompt, executor=None, schema=None) -> dict:
+    return await get_router().generate_json_async(route, prompt, executor, schema)
+
+
+def generate_text(route, prompt, schema=None) -> str:
+    return get_router().generate_text(route, prompt, schema)
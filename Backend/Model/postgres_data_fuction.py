@@ -4,6 +4,9 @@ from sqlalchemy import create_engine
 import urllib.parse
 import os
 from dotenv import load_dotenv
+import fake_backends
+from feature_store import get_feature_store
+import resilience
 
 load_dotenv()
 
@@ -33,9 +36,18 @@ def fetch_data(individual_id):
     return psychometry_json
 
 def career_choice(id):
+    store = get_feature_store()
+    if store is not None:
+        career = store.career_choice(id)
+        if career:
+            return career
+
+    if fake_backends.fake_db_enabled():
+        return fake_backends.fake_career_choice(id)
+
     query = "SELECT career_choice FROM psychometry_data WHERE ID=%s"
 
-    df= pd.read_sql(query, engine, params=(id,))
+    df = resilience.call_with_retry(pd.read_sql, query, engine, params=(id,), breaker="postgres")
 
     if not df.empty:
         return df['career_choice'].iloc[0]
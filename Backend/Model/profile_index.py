@@ -0,0 +1,354 @@
+"""
+Nearest-neighbour index over psychometric profiles, used to warm-start roadmaps.
+
+Every user whose roadmap was generated from scratch is added to the index with their
+psychometry_data row encoded as a fixed-length float32 vector: the 1-10 scores and age
+scaled to [0, 1], plus one-hot blocks for the single-choice text columns (gender,
+education, learning style, ...). Roadmaps are career specific, so the index is
+partitioned by career and a query only scans the partition of the new user's career.
+Partitions that grow large get an inverted-file layer (k-means centroids, probe the
+closest few lists), which keeps queries well under a millisecond at a million profiles.
+
+Entries are appended to a JSONL log (NEXTPATH_PROFILE_INDEX) so other worker processes
+pick them up with refresh().
+
+Run `python profile_index.py --benchmark 1000000` for a latency benchmark.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from json_store import document_lock
+from utils import data_path
+
+INDEX_LOG_PATH = os.getenv("NEXTPATH_PROFILE_INDEX", data_path("profile_index.jsonl"))
+# Root-mean-square distance per feature below which a stored roadmap is reused.
+# 0.08 is roughly "every score within one point, same categories".
+WARM_START_MAX_DISTANCE = float(os.getenv("NEXTPATH_WARM_START_DISTANCE", "0.08"))
+
+SCORE_COLUMNS = [
+    "openness", "conscientiousness", "extraversion", "agreeableness", "neuroticism",
+    "emotional", "risk_tolerance", "stress_resilience", "logical_reasoning", "verbal_ability",
+    "numerical_ability", "creativity", "memory_attention_span", "analytical", "communication",
+    "leadership", "proble_solving", "technical_programming", "artistic_design",
+    "empathy_and_counciling_ability", "negotiation_persuation", "entrepreneurial_drive",
+]
+AGE_RANGE = (16, 45)
+CATEGORICAL_COLUMNS = {
+    "gender": ["Female", "Male"],
+    "education": ["Graduate", "High School", "PhD", "Self-taught", "Undergraduate", "Vocational"],
+    "decision_making_style": ["Analytical", "Collaborative", "Intuitive", "Risk-averse"],
+    "motivation_type": ["Extrinsic", "Intrinsic", "Mixed"],
+    "learning_style": ["Auditory", "Kinesthetic", "Reading/Writing", "Visual"],
+    "prefered_work_environment": [
+        "Creative/Artistic", "Fast-paced", "Flexible Remote", "Hands-on/Fieldwork",
+        "Independent", "Research-driven", "Structured/Organized", "Team-oriented",
+    ],
+}
+FEATURE_DIM = len(SCORE_COLUMNS) + 1 + sum(len(values) for values in CATEGORICAL_COLUMNS.values())
+
+IVF_MIN_PARTITION = 4096
+IVF_NPROBE = 8
+IVF_TAIL_LIMIT = 1024
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+
+
+def normalize_career(career) -> str:
+    return " ".join(str(career).split()).lower()
+
+
+def _number(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def encode_profile(row) -> np.ndarray:
+    """
+    Encodes one psychometry_data row (dict or pandas Series, DB column names) as a vector.
+
+    Scores are stored as TEXT in PostgreSQL, so every value is parsed; missing or unknown
+    values fall back to the middle of the scale / an all-zero one-hot block.
+    """
+    vector = np.zeros(FEATURE_DIM, dtype=np.float32)
+    for i, column in enumerate(SCORE_COLUMNS):
+        vector[i] = (min(max(_number(row.get(column), 5.5), 1.0), 10.0) - 1.0) / 9.0
+    low, high = AGE_RANGE
+    vector[len(SCORE_COLUMNS)] = (min(max(_number(row.get("age"), (low + high) / 2), low), high) - low) / (high - low)
+    offset = len(SCORE_COLUMNS) + 1
+    for column, values in CATEGORICAL_COLUMNS.items():
+        value = row.get(column)
+        if value in values:
+            vector[offset + values.index(value)] = 1.0
+        offset += len(values)
+    return vector
+
+
+def encode_profiles(frame) -> np.ndarray:
+    """Vectorized encode_profile for a DataFrame of psychometry_data rows."""
+    import pandas as pd
+
+    matrix = np.zeros((len(frame), FEATURE_DIM), dtype=np.float32)
+    for i, column in enumerate(SCORE_COLUMNS):
+        scores = pd.to_numeric(frame.get(column), errors="coerce") if column in frame else None
+        values = np.full(len(frame), 5.5) if scores is None else scores.fillna(5.5).to_numpy(dtype=float)
+        matrix[:, i] = (np.clip(values, 1.0, 10.0) - 1.0) / 9.0
+    low, high = AGE_RANGE
+    ages = pd.to_numeric(frame["age"], errors="coerce").fillna((low + high) / 2).to_numpy(dtype=float) \
+        if "age" in frame else np.full(len(frame), (low + high) / 2)
+    matrix[:, len(SCORE_COLUMNS)] = (np.clip(ages, low, high) - low) / (high - low)
+    offset = len(SCORE_COLUMNS) + 1
+    for column, values in CATEGORICAL_COLUMNS.items():
+        if column in frame:
+            codes = pd.Categorical(frame[column], categories=values).codes
+            known = codes >= 0
+            matrix[np.flatnonzero(known), offset + codes[known]] = 1.0
+        offset += len(values)
+    return matrix
+
+
+class _Partition:
+    """
+    Profiles of one career: a growable matrix plus an optional inverted-file layer.
+
+    After (re)indexing, rows are stored sorted by inverted list, so probing a list is a
+    contiguous slice and a matrix-vector product instead of a gather.
+    """
+
+    def __init__(self):
+        self.vectors = np.empty((64, FEATURE_DIM), dtype=np.float32)
+        self.sq_norms = np.empty(64, dtype=np.float32)
+        self.user_ids = []
+        self.size = 0
+        # Inverted file over rows [:ivf_size]; later rows are scanned exhaustively
+        self.centroids = None
+        self.list_offsets = None
+        self.ivf_size = 0
+        self.trained_size = 0
+
+    def add(self, user_id, vector):
+        if self.size == len(self.vectors):
+            self.vectors = np.concatenate((self.vectors, np.empty_like(self.vectors)))
+            self.sq_norms = np.concatenate((self.sq_norms, np.empty_like(self.sq_norms)))
+        self.vectors[self.size] = vector
+        self.sq_norms[self.size] = vector @ vector
+        self.user_ids.append(user_id)
+        self.size += 1
+
+    def maintain(self):
+        """Builds or extends the inverted file once enough unindexed rows piled up."""
+        if self.centroids is None:
+            if self.size >= IVF_MIN_PARTITION:
+                self._train()
+        elif self.size - self.ivf_size >= IVF_TAIL_LIMIT:
+            # Retrain once the partition doubled, otherwise file the tail under the current centroids
+            if self.size >= 2 * self.trained_size:
+                self._train()
+            else:
+                self._reindex(self._list_assignment())
+
+    def _list_assignment(self) -> np.ndarray:
+        indexed = np.repeat(np.arange(len(self.centroids)), np.diff(self.list_offsets))
+        tail = _nearest_centroid(self.vectors[self.ivf_size:self.size], self.centroids)
+        return np.concatenate((indexed, tail))
+
+    def _train(self, seed=0):
+        data = self.vectors[:self.size]
+        nlist = max(int(np.sqrt(self.size)), 1)
+        rng = np.random.default_rng(seed)
+        sample = data[rng.choice(self.size, min(self.size, nlist * KMEANS_SAMPLE_PER_LIST), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(KMEANS_ITERATIONS):
+            assignment = _nearest_centroid(sample, centroids)
+            counts = np.bincount(assignment, minlength=nlist)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, np.newaxis]
+        self.centroids = centroids
+        self.trained_size = self.size
+        self._reindex(_nearest_centroid(data, centroids))
+
+    def _reindex(self, assignment):
+        order = np.argsort(assignment, kind="stable")
+        self.vectors[:self.size] = self.vectors[order]
+        self.sq_norms[:self.size] = self.sq_norms[order]
+        self.user_ids = [self.user_ids[i] for i in order]
+        self.list_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=len(self.centroids)))))
+        self.ivf_size = self.size
+
+    def _candidate_ranges(self, vector):
+        if self.centroids is None:
+            return [(0, self.size)]
+        centroid_dist = ((self.centroids - vector) ** 2).sum(axis=1)
+        nprobe = min(IVF_NPROBE, len(centroid_dist))
+        probe = np.argpartition(centroid_dist, nprobe - 1)[:nprobe]
+        ranges = [(self.list_offsets[c], self.list_offsets[c + 1]) for c in probe]
+        ranges.append((self.ivf_size, self.size))
+        return [(lo, hi) for lo, hi in ranges if hi > lo]
+
+    def search(self, vector, k):
+        positions, distances = [], []
+        for lo, hi in self._candidate_ranges(vector):
+            # |x - q|^2 = |x|^2 - 2 x.q + |q|^2
+            distances.append(self.sq_norms[lo:hi] - 2.0 * (self.vectors[lo:hi] @ vector))
+            positions.append(np.arange(lo, hi))
+        if not positions:
+            return []
+        dist = np.concatenate(distances) + vector @ vector
+        pos = np.concatenate(positions)
+        k = min(k, len(dist))
+        top = np.argpartition(dist, k - 1)[:k]
+        top = top[np.argsort(dist[top])]
+        return [(self.user_ids[pos[i]], float(np.sqrt(max(dist[i], 0.0) / FEATURE_DIM))) for i in top]
+
+
+def _nearest_centroid(data, centroids, chunk=65536) -> np.ndarray:
+    centroid_sq = (centroids ** 2).sum(axis=1)
+    out = np.empty(len(data), dtype=np.int64)
+    for start in range(0, len(data), chunk):
+        block = data[start:start + chunk]
+        # |x - c|^2 = |x|^2 - 2 x.c + |c|^2; |x|^2 does not change the argmin
+        out[start:start + chunk] = np.argmin(centroid_sq[np.newaxis, :] - 2.0 * block @ centroids.T, axis=1)
+    return out
+
+
+class ProfileIndex:
+    def __init__(self, log_path: str | None = INDEX_LOG_PATH):
+        self.log_path = log_path
+        self._partitions = {}
+        self._known_users = set()
+        self._log_offset = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._known_users)
+
+    def _insert(self, user_id, career, vector) -> "_Partition | None":
+        if user_id in self._known_users:
+            return None
+        partition = self._partitions.setdefault(normalize_career(career), _Partition())
+        partition.add(user_id, vector)
+        self._known_users.add(user_id)
+        return partition
+
+    def add(self, user_id, career, profile_row):
+        """Indexes a user whose roadmap was generated from scratch and appends it to the log."""
+        user_id = str(user_id)
+        vector = encode_profile(profile_row)
+        with self._lock:
+            partition = self._insert(user_id, career, vector)
+            if partition is not None:
+                partition.maintain()
+        if self.log_path:
+            entry = {"user_id": user_id, "career": career, "vector": [round(float(x), 4) for x in vector]}
+            with document_lock(self.log_path):
+                with open(self.log_path, "a") as f:
+                    f.write(json.dumps(entry) + "\n")
+
+    def refresh(self):
+        """Loads entries other processes appended to the log since the last refresh."""
+        if not self.log_path or not os.path.exists(self.log_path):
+            return
+        touched = set()
+        with self._lock:
+            with open(self.log_path, "r") as f:
+                f.seek(self._log_offset)
+                for line in iter(f.readline, ""):
+                    if not line.endswith("\n"):
+                        break  # partially written line; read it next time
+                    self._log_offset = f.tell()
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    touched.add(self._insert(entry["user_id"], entry["career"],
+                                             np.asarray(entry["vector"], dtype=np.float32)))
+            # Index maintenance once per partition, not once per replayed entry
+            for partition in touched - {None}:
+                partition.maintain()
+
+    def query(self, career, profile_row, k=5) -> list[tuple[str, float]]:
+        """Returns up to k (user_id, distance) pairs of the same career, closest first."""
+        partition = self._partitions.get(normalize_career(career))
+        if partition is None:
+            return []
+        return partition.search(encode_profile(profile_row), k)
+
+    def query_vector(self, career, vector, k=5) -> list[tuple[str, float]]:
+        partition = self._partitions.get(normalize_career(career))
+        return [] if partition is None else partition.search(vector, k)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_profile_index() -> ProfileIndex:
+    """Process-wide index, loaded from the log on first use and refreshed on every call."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = ProfileIndex()
+    _index.refresh()
+    return _index
+
+
+def _synthetic_profiles(n, rng):
+    """Profiles drawn column by column from the psychometry dataset's distributions."""
+    import pandas as pd
+    import fake_backends
+
+    dataset = fake_backends.load_dataset()
+    columns = SCORE_COLUMNS + ["age"] + list(CATEGORICAL_COLUMNS)
+    return pd.DataFrame({column: rng.choice(dataset[column].to_numpy(), n) for column in columns})
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description="k-NN latency benchmark on synthetic profiles.")
+    parser.add_argument("--benchmark", type=int, default=1_000_000, help="Number of profiles to index.")
+    parser.add_argument("--careers", type=int, default=63, help="Number of careers (partitions).")
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    index = ProfileIndex(log_path=None)
+    start = time.perf_counter()
+    vectors = encode_profiles(_synthetic_profiles(args.benchmark, rng))
+    careers = [f"career {c}" for c in rng.integers(0, args.careers, args.benchmark)]
+    for i in range(args.benchmark):
+        index._insert(str(i), careers[i], vectors[i])
+    for partition in index._partitions.values():
+        partition.maintain()
+    print(f"indexed {args.benchmark} profiles in {args.careers} careers in {time.perf_counter() - start:.1f}s")
+
+    # Warm-start queries: an indexed profile with a few scores moved by one point
+    sources = rng.integers(0, args.benchmark, args.queries)
+    queries = vectors[sources].copy()
+    for q in queries:
+        moved = rng.choice(len(SCORE_COLUMNS), 3, replace=False)
+        q[moved] = np.clip(q[moved] + rng.choice([-1, 1], 3) / 9.0, 0.0, 1.0)
+
+    latencies, hits = [], 0
+    for source, vector in zip(sources, queries):
+        start = time.perf_counter()
+        found = index.query_vector(careers[source], vector, k=1)
+        latencies.append(time.perf_counter() - start)
+        partition = index._partitions[normalize_career(careers[source])]
+        exact = ((partition.vectors[:partition.size] - vector) ** 2).sum(axis=1).min()
+        hits += np.isclose(found[0][1], np.sqrt(exact / FEATURE_DIM), atol=1e-4)
+    latencies = np.array(latencies) * 1000
+    print(f"recall@1 (nearest neighbour found): {hits / len(queries):.3f}")
+    print(f"query latency: p50={np.percentile(latencies, 50):.3f}ms "
+          f"p95={np.percentile(latencies, 95):.3f}ms p99={np.percentile(latencies, 99):.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
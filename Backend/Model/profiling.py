@@ -0,0 +1,327 @@
+"""
+On-demand profiling of single requests, jobs and CLI runs.
+
+A capture is either a stack sample, taken by a background thread every few milliseconds
+from sys._current_frames() and written as folded stacks (one "frame;frame;frame count"
+line per stack, the input of flamegraph.pl, speedscope and inferno), or a cProfile run
+written as a .prof file (snakeviz, flameprof, pstats). Sampling costs little and sees
+waits (LLM calls, subprocesses, locks); cProfile counts every call exactly but slows the
+code down and only sees the thread that started it.
+
+Profiling is switched on
+    - for everything, with NEXTPATH_PROFILE=sample|cprofile (1 means sample),
+    - for one main_controller request, with the header "X-NextPath-Profile: sample|cprofile",
+      if NEXTPATH_PROFILE_HEADER=1 and the request carries the admin token; roadmap and
+      adaptation jobs started by that request are profiled too,
+    - for one run of cli.py or a generator script, with --profile or --profile=cprofile.
+
+Jobs run in their own process, so they get the flag on their command line and write
+their own capture. Captures go to NEXTPATH_PROFILE_DIR (default users_data/Profiles), which
+is kept to NEXTPATH_PROFILE_MAX_FILES files (default 100) and NEXTPATH_PROFILE_MAX_MB
+(default 200) by deleting the oldest. GET /api/admin/profiles lists them.
+
+The header and the /api/admin routes need NEXTPATH_ADMIN_TOKEN, sent as
+"X-NextPath-Admin-Token: <token>" or "Authorization: Bearer <token>". Without a configured
+token both are refused.
+
+    NEXTPATH_PROFILE_INTERVAL_MS=5   time between stack samples
+    NEXTPATH_PROFILE_HEADER=1        honour the request header (off by default)
+    NEXTPATH_ADMIN_TOKEN=...         token the header and admin routes require
+"""
+import cProfile
+import functools
+import hmac
+import inspect
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+from utils import data_path
+
+HEADER = "X-NextPath-Profile"
+CAPTURE_HEADER = "X-NextPath-Profile-Capture"
+ADMIN_TOKEN_HEADER = "X-NextPath-Admin-Token"
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+EXTENSIONS = {SAMPLE: ".folded", CPROFILE: ".prof"}
+
+PROFILE_DIR = os.getenv("NEXTPATH_PROFILE_DIR", data_path("Profiles"))
+MAX_FILES = int(os.getenv("NEXTPATH_PROFILE_MAX_FILES", "100"))
+MAX_BYTES = int(float(os.getenv("NEXTPATH_PROFILE_MAX_MB", "200")) * 1024 * 1024)
+SAMPLE_INTERVAL = float(os.getenv("NEXTPATH_PROFILE_INTERVAL_MS", "5")) / 1000
+
+# Mode asked for by the request or job being handled, passed on to the jobs it starts
+_requested = ContextVar("profile_mode", default=None)
+_prune_lock = threading.Lock()
+
+
+def normalize_mode(value) -> str | None:
+    """sample, cprofile or None for a setting such as "1", "cprofile" or "off"."""
+    value = str(value or "").strip().lower()
+    if value in (SAMPLE, CPROFILE):
+        return value
+    if value in ("1", "true", "yes", "on"):
+        return SAMPLE
+    return None
+
+
+def default_mode() -> str | None:
+    return normalize_mode(os.getenv("NEXTPATH_PROFILE"))
+
+
+def mode_from_argv(argv=None) -> str | None:
+    """Mode from a --profile[=mode] command line flag, else from NEXTPATH_PROFILE."""
+    for arg in (sys.argv if argv is None else argv)[1:]:
+        if arg == "--profile":
+            return SAMPLE
+        if arg.startswith("--profile="):
+            return normalize_mode(arg.split("=", 1)[1])
+    return default_mode()
+
+
+def requested_mode() -> str | None:
+    """Mode the current request or job asked for (not the NEXTPATH_PROFILE default)."""
+    return _requested.get()
+
+
+@contextmanager
+def requested(mode):
+    token = _requested.set(normalize_mode(mode))
+    try:
+        yield
+    finally:
+        _requested.reset(token)
+
+
+def subprocess_args() -> list:
+    """Command line flag that makes a job script profile itself like the current request."""
+    mode = requested_mode()
+    return [f"--profile={mode}"] if mode else []
+
+
+def _fold(frame) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(stack))
+
+
+class Sampler:
+    """Counts the stacks of some (or all) threads at a fixed interval."""
+
+    def __init__(self, thread_ids=None, interval: float = SAMPLE_INTERVAL):
+        self.thread_ids = set(thread_ids) if thread_ids else None
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()} if self.thread_ids is None else {}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = _fold(frame)
+                if self.thread_ids is None:
+                    stack = f"{names.get(thread_id, thread_id)};{stack}"
+                self.stacks[stack] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Capture:
+    """One running profile; stop() writes it to the profile directory and returns its path."""
+
+    def __init__(self, name: str, mode: str, all_threads: bool = False):
+        self.name = re.sub(r"[^A-Za-z0-9._-]+", "_", name).strip("_")[:80] or "capture"
+        self.mode = mode
+        self.started = time.perf_counter()
+        self.started_at = datetime.now()
+        self._profiler = None
+        self._sampler = None
+        if mode == CPROFILE:
+            try:
+                self._profiler = cProfile.Profile()
+                self._profiler.enable()
+            except ValueError:  # another profiler is active in this process
+                self._profiler = None
+                self.mode = SAMPLE
+        if self.mode == SAMPLE:
+            self._sampler = Sampler(None if all_threads else [threading.get_ident()])
+            self._sampler.start()
+
+    def stop(self) -> str | None:
+        elapsed = time.perf_counter() - self.started
+        path = os.path.join(PROFILE_DIR, f"{self.started_at:%Y%m%d-%H%M%S-%f}-{self.name}{EXTENSIONS[self.mode]}")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            if self._profiler is not None:
+                self._profiler.disable()
+                self._profiler.dump_stats(path)
+                detail = ""
+            else:
+                self._sampler.stop()
+                self._sampler.write(path)
+                detail = f", {self._sampler.samples} samples"
+        except OSError as e:
+            print(f"Could not save profile {self.name}: {e}")
+            return None
+        print(f"Profile of {self.name} ({elapsed:.2f}s{detail}) saved to {path}")
+        prune()
+        return path
+
+
+def start(name, mode=None, all_threads=False) -> Capture | None:
+    mode = normalize_mode(mode)
+    return Capture(name, mode, all_threads) if mode else None
+
+
+@contextmanager
+def profile(name, mode=None, all_threads=True):
+    """Profiles the block if mode is set; jobs it starts are profiled the same way."""
+    capture = start(name, mode, all_threads)
+    if capture is None:
+        yield None
+        return
+    try:
+        with requested(mode):
+            yield capture
+    finally:
+        capture.stop()
+
+
+def list_captures() -> list:
+    """Saved captures, newest first."""
+    captures = []
+    for entry in os.scandir(PROFILE_DIR) if os.path.isdir(PROFILE_DIR) else []:
+        mode = next((mode for mode, ext in EXTENSIONS.items() if entry.name.endswith(ext)), None)
+        if mode and entry.is_file():
+            stat = entry.stat()
+            captures.append({
+                "name": entry.name,
+                "mode": mode,
+                "bytes": stat.st_size,
+                "created_at": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            })
+    return sorted(captures, key=lambda capture: capture["created_at"], reverse=True)
+
+
+def prune():
+    """Deletes the oldest captures until the directory is within its file and size limits."""
+    with _prune_lock:
+        captures = list_captures()
+        total = sum(capture["bytes"] for capture in captures)
+        while captures and (len(captures) > MAX_FILES or total > MAX_BYTES):
+            oldest = captures.pop()
+            total -= oldest["bytes"]
+            try:
+                os.remove(os.path.join(PROFILE_DIR, oldest["name"]))
+            except FileNotFoundError:
+                pass
+
+
+def header_enabled() -> bool:
+    return os.getenv("NEXTPATH_PROFILE_HEADER", "").lower() in ("1", "true", "yes")
+
+
+def is_admin(headers) -> bool:
+    """True if the request headers carry NEXTPATH_ADMIN_TOKEN; always False when it is unset."""
+    expected = os.getenv("NEXTPATH_ADMIN_TOKEN")
+    if not expected:
+        return False
+    supplied = headers.get(ADMIN_TOKEN_HEADER)
+    authorization = headers.get("Authorization", "")
+    if not supplied and authorization.lower().startswith("bearer "):
+        supplied = authorization[len("bearer "):].strip()
+    return bool(supplied) and hmac.compare_digest(supplied.encode(), expected.encode())
+
+
+def admin_required(view):
+    """Flask or Quart (async) view decorator: 403 unless the request carries the admin token."""
+    if inspect.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            from quart import jsonify, request
+
+            if not is_admin(request.headers):
+                return jsonify({"error": "Admin token required"}), 403
+            return await view(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        from flask import jsonify, request
+
+        if not is_admin(request.headers):
+            return jsonify({"error": "Admin token required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def stats() -> dict:
+    captures = list_captures()
+    return {
+        "default_mode": default_mode(),
+        "header": HEADER if header_enabled() else None,
+        "directory": PROFILE_DIR,
+        "max_files": MAX_FILES,
+        "max_bytes": MAX_BYTES,
+        "total_bytes": sum(capture["bytes"] for capture in captures),
+        "captures": captures,
+    }
+
+
+def init_app(app):
+    """Profiles Flask requests that carry the header and admin token (or all of them with NEXTPATH_PROFILE)."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_request_profile():
+        header = request.headers.get(HEADER)
+        if header and not (header_enabled() and is_admin(request.headers)):
+            header = None
+        mode = normalize_mode(header)
+        capture = start(f"{request.method}-{request.path}", mode or default_mode())
+        if capture is not None:
+            g.profile_capture = capture
+            g.profile_token = _requested.set(mode)
+
+    @app.after_request
+    def _stop_request_profile(response):
+        capture = g.pop("profile_capture", None)
+        if capture is not None:
+            path = capture.stop()
+            if path:
+                response.headers[CAPTURE_HEADER] = os.path.basename(path)
+        return response
+
+    @app.teardown_request
+    def _end_request_profile(_):
+        capture = g.pop("profile_capture", None)
+        if capture is not None:  # the request failed before after_request
+            capture.stop()
+        token = g.pop("profile_token", None)
+        if token is not None:
+            _requested.reset(token)
@@ -0,0 +1,152 @@
+"""
+Cross-user question bank for topic-wise tests.
+
+Users heading for the same career get roadmaps with the same subtopic titles and topic
+lists, so their MCQs can be shared. Questions are stored under a normalized hash of
+(subtopic title, topic list, difficulty mix) for whole sets, and of
+(subtopic title, topic, difficulty mix) per topic. generate_quetions checks the bank
+first and only asks the LLM for topics that are not covered yet.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter
+from difflib import SequenceMatcher
+
+from json_store import atomic_write_json, read_json, update_json
+from utils import data_path
+
+QUESTION_BANK_DIR = os.getenv("NEXTPATH_QUESTION_BANK_DIR", data_path("Question_bank"))
+# Must match the difficulty distribution requested in Topicwise_Test_generator's prompt
+DIFFICULTY_MIX = (("easy", 50), ("medium", 30), ("hard", 20))
+MAX_MCQS_PER_TOPIC = 20
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def normalize(text) -> str:
+    text = re.sub(r"\s+", " ", str(text)).strip().lower()
+    return text.strip(" .:;,-")
+
+
+def _digest(*parts) -> str:
+    payload = json.dumps(parts, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def subtopic_key(title, topic_list, difficulty_mix=DIFFICULTY_MIX) -> str:
+    return _digest("subtopic", normalize(title), [normalize(t) for t in topic_list], list(difficulty_mix))
+
+
+def topic_key(title, topic, difficulty_mix=DIFFICULTY_MIX) -> str:
+    return _digest("topic", normalize(title), normalize(topic), list(difficulty_mix))
+
+
+def _subtopic_path(key):
+    return os.path.join(QUESTION_BANK_DIR, "subtopics", f"{key}.json")
+
+
+def _topic_path(key):
+    return os.path.join(QUESTION_BANK_DIR, "topics", f"{key}.json")
+
+
+def _count(name, n=1):
+    with _stats_lock:
+        _stats[name] += n
+
+
+def _assemble_from_topics(title, topic_list) -> tuple[list, list]:
+    mcqs, missing = [], []
+    for topic in topic_list:
+        stored = read_json(_topic_path(topic_key(title, topic)))
+        if stored and stored.get("mcqs"):
+            mcqs.extend(stored["mcqs"])
+        else:
+            missing.append(topic)
+    return mcqs, missing
+
+
+def lookup(title, topic_list) -> tuple[list, list]:
+    """
+    Returns (mcqs already in the bank, topics that still need questions).
+
+    An exact subtopic match returns its whole stored set; otherwise questions are
+    assembled per topic.
+    """
+    exact = read_json(_subtopic_path(subtopic_key(title, topic_list)))
+    if exact:
+        _count("subtopic_hits")
+        _count("topic_hits", len(topic_list))
+        return exact["mcqs"], []
+
+    mcqs, missing = _assemble_from_topics(title, topic_list)
+    _count("topic_hits", len(topic_list) - len(missing))
+    _count("topic_misses", len(missing))
+    _count("subtopic_hits" if not missing else "subtopic_misses")
+    return mcqs, missing
+
+
+def nearest_topic(label, topics):
+    """The topic a topic_label names: an exact match, else the most similar one."""
+    label = normalize(label)
+    by_topic = {normalize(t): t for t in topics}
+    if label in by_topic:
+        return by_topic[label]
+    words = set(label.split())
+
+    def similarity(normalized):
+        # LLMs shorten, extend or reword labels, so shared words count as much as spelling
+        overlap = len(words & set(normalized.split())) / max(len(words | set(normalized.split())), 1)
+        return max(overlap, SequenceMatcher(None, label, normalized).ratio())
+
+    return by_topic[max(by_topic, key=similarity)] if by_topic else None
+
+
+def store(title, topic_list, generated_topics, mcqs):
+    """
+    Files freshly generated MCQs.
+
+    generated_topics are the topics the LLM was asked about; each MCQ is filed under the
+    requested topic its topic_label names, or the nearest one when the label doesn't
+    match any of them. The assembled set for the full topic_list is stored as well, so
+    the next identical subtopic is a single read.
+    """
+    grouped = {}
+    for mcq in mcqs:
+        topic = nearest_topic(mcq.get("topic_label", ""), generated_topics)
+        if topic is not None:
+            grouped.setdefault(topic, []).append(mcq)
+
+    for topic, topic_mcqs in grouped.items():
+        def add(doc, topic=topic, topic_mcqs=topic_mcqs):
+            doc.setdefault("topic", topic)
+            doc.setdefault("mcqs", [])
+            # Two users may generate the same topic concurrently; keep one copy of each question
+            known = {normalize(m.get("question", "")) for m in doc["mcqs"]}
+            for mcq in topic_mcqs:
+                if len(doc["mcqs"]) < MAX_MCQS_PER_TOPIC and normalize(mcq.get("question", "")) not in known:
+                    doc["mcqs"].append(mcq)
+                    known.add(normalize(mcq.get("question", "")))
+
+        update_json(_topic_path(topic_key(title, topic)), add)
+
+    assembled, missing = _assemble_from_topics(title, topic_list)
+    if not missing:
+        atomic_write_json(
+            _subtopic_path(subtopic_key(title, topic_list)),
+            {"title": title, "topic_list": topic_list, "difficulty_mix": dict(DIFFICULTY_MIX), "mcqs": assembled},
+        )
+
+
+def stats() -> dict:
+    with _stats_lock:
+        topic_total = _stats["topic_hits"] + _stats["topic_misses"]
+        subtopic_total = _stats["subtopic_hits"] + _stats["subtopic_misses"]
+        return {
+            **{name: _stats[name] for name in ("subtopic_hits", "subtopic_misses", "topic_hits", "topic_misses")},
+            "subtopic_hit_rate": round(_stats["subtopic_hits"] / subtopic_total, 3) if subtopic_total else 0.0,
+            "topic_hit_rate": round(_stats["topic_hits"] / topic_total, 3) if topic_total else 0.0,
+        }
@@ -0,0 +1,331 @@
+"""
+Retries, backoff and circuit breakers for LLM and database calls.
+
+- classify() decides from the exception type / HTTP status whether a failure is
+  transient (overload, rate limit, timeout, dropped connection, locked database) and
+  reads the server's Retry-After (header, or Gemini's RetryInfo) when there is one.
+- RetryPolicy computes decorrelated-jitter delays; a Retry-After hint is never undercut.
+- CircuitBreaker trips after repeated transient failures of one dependency. While it
+  is open, calls fail fast with CircuitOpenError so callers can fall back instead of
+  queueing behind a provider that is down; after reset_timeout one trial call is let
+  through (half-open).
+- call_with_retry / call_with_retry_async put these together. The async variant waits
+  with asyncio.sleep, so a backoff never blocks other tasks on the event loop.
+
+Run `python resilience.py` to measure tail latency against the fake LLM under an
+injected overload (NEXTPATH_FAKE_LLM_ERROR_RATE).
+"""
+import asyncio
+import email.utils
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+MAX_RETRY_AFTER = 120.0
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a dependency whose circuit breaker is open."""
+
+    def __init__(self, name, retry_in):
+        super().__init__(f"{name} is unavailable (circuit open, retry in {retry_in:.0f}s)")
+        self.name = name
+        self.retry_in = retry_in
+
+
+# --- Classification ---
+
+def _status_code(exc):
+    for attr in ("code", "status_code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def _parse_retry_after(value):
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(str(value))
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def retry_after(exc) -> float | None:
+    """Seconds the server asked us to wait, from a Retry-After header or a RetryInfo detail."""
+    headers = getattr(getattr(exc, "response", None), "headers", None)
+    if headers is not None:
+        seconds = _parse_retry_after(headers.get("Retry-After") or headers.get("retry-after"))
+        if seconds is not None:
+            return seconds
+    details = getattr(exc, "details", None)
+    if isinstance(details, dict):
+        details = details.get("error", {}).get("details", [])
+    for detail in details if isinstance(details, list) else []:
+        if isinstance(detail, dict) and str(detail.get("@type", "")).endswith("RetryInfo"):
+            delay = str(detail.get("retryDelay", "")).rstrip("s")
+            seconds = _parse_retry_after(delay)
+            if seconds is not None:
+                return seconds
+    return None
+
+
+def is_retryable(exc) -> bool:
+    if isinstance(exc, CircuitOpenError):
+        return False  # fail fast; the breaker decides when to try again
+    if isinstance(exc, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    if isinstance(exc, sqlite3.OperationalError):
+        return "locked" in str(exc) or "busy" in str(exc)
+    status = _status_code(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    try:
+        from sqlalchemy import exc as sa_exc
+    except ImportError:
+        return False
+    if isinstance(exc, sa_exc.DBAPIError):
+        return bool(exc.connection_invalidated) or isinstance(exc, (sa_exc.OperationalError, sa_exc.InterfaceError))
+    return False
+
+
+def classify(exc) -> tuple[bool, float | None]:
+    """Returns (retryable, retry_after seconds or None)."""
+    retryable = is_retryable(exc)
+    return retryable, retry_after(exc) if retryable else None
+
+
+# --- Backoff ---
+
+class RetryPolicy:
+    """Decorrelated jitter: each delay is uniform in [base, 3 * previous], capped."""
+
+    def __init__(self, max_attempts=5, base=0.5, cap=30.0):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+
+    def next_delay(self, previous=None) -> float:
+        return min(self.cap, random.uniform(self.base, max(self.base, (previous or self.base) * 3)))
+
+    def retry_delay(self, exc, attempt, previous=None) -> float | None:
+        """
+        Delay before retrying after the failed attempt number `attempt` (0-based), or
+        None if the error is permanent or the attempts are used up.
+        """
+        retryable, hinted = classify(exc)
+        if not retryable or attempt + 1 >= self.max_attempts:
+            return None
+        delay = self.next_delay(previous)
+        if hinted is not None:
+            delay = max(delay, min(hinted, MAX_RETRY_AFTER))
+        return delay
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+
+# --- Circuit breaker ---
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        """Raises CircuitOpenError unless a call may go through now."""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+            remaining = max(self.reset_timeout - (time.monotonic() - self._opened_at), 0.0)
+            raise CircuitOpenError(self.name, remaining)
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self, exc):
+        # Permanent errors (bad request, parse errors) say nothing about the dependency's health
+        if not is_retryable(exc):
+            with self._lock:
+                self._trial_in_flight = False
+            return
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self.trips += 1
+            self._trial_in_flight = False
+
+    @contextmanager
+    def guard(self):
+        self.before_call()
+        try:
+            yield
+        except BaseException as e:
+            self.record_failure(e)
+            raise
+        self.record_success()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self._state(), "failures": self._failures, "trips": self.trips, "rejected": self.rejected}
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name, **kwargs) -> CircuitBreaker:
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **kwargs)
+        return _breakers[name]
+
+
+def breaker_stats() -> dict:
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.stats() for breaker in breakers}
+
+
+# --- Retry loops ---
+
+@contextmanager
+def _guarded(breaker):
+    if breaker is None:
+        yield
+    else:
+        with (get_breaker(breaker) if isinstance(breaker, str) else breaker).guard():
+            yield
+
+
+def call_with_retry(fn, *args, policy: RetryPolicy = DEFAULT_POLICY, breaker=None, **kwargs):
+    """
+    Calls fn, retrying transient failures with backoff in the calling thread.
+
+    breaker (a name or CircuitBreaker) guards every attempt; an open circuit is not retried.
+    """
+    delay = None
+    for attempt in range(policy.max_attempts):
+        try:
+            with _guarded(breaker):
+                return fn(*args, **kwargs)
+        except Exception as e:
+            delay = policy.retry_delay(e, attempt, delay)
+            if delay is None:
+                raise
+            print(f"Transient error ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+async def call_with_retry_async(coro_fn, *args, policy: RetryPolicy = DEFAULT_POLICY, breaker=None, **kwargs):
+    """Awaits coro_fn, retrying transient failures without blocking the event loop."""
+    delay = None
+    for attempt in range(policy.max_attempts):
+        try:
+            with _guarded(breaker):
+                return await coro_fn(*args, **kwargs)
+        except Exception as e:
+            delay = policy.retry_delay(e, attempt, delay)
+            if delay is None:
+                raise
+            print(f"Transient error ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def _simulate(calls, concurrency, policy):
+    import llm_client
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, failures = [], 0
+
+    async def one(i):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call_with_retry_async(llm_client.generate_text_async, f"roadmap {i}", policy=policy)
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    return latencies, failures
+
+
+def main():
+    import argparse
+    import os
+
+    import numpy as np
+
+    parser = argparse.ArgumentParser(description="Tail latency of LLM calls under an injected overload.")
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--error-rate", type=float, default=0.3, help="Share of fake calls failing with 503.")
+    parser.add_argument("--retry-after", type=float, default=None, help="Retry-After the fake 503s carry.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake LLM latency in seconds.")
+    parser.add_argument("--base", type=float, default=0.2)
+    parser.add_argument("--cap", type=float, default=5.0)
+    args = parser.parse_args()
+
+    os.environ["NEXTPATH_FAKE_LLM"] = "1"
+    os.environ["NEXTPATH_FAKE_LLM_LATENCY"] = str(args.latency)
+    os.environ["NEXTPATH_FAKE_LLM_ERROR_RATE"] = str(args.error_rate)
+    if args.retry_after is not None:
+        os.environ["NEXTPATH_FAKE_LLM_RETRY_AFTER"] = str(args.retry_after)
+
+    policy = RetryPolicy(base=args.base, cap=args.cap)
+    latencies, failures = asyncio.run(_simulate(args.calls, args.concurrency, policy))
+    latencies = np.array(latencies)
+    print(f"{args.calls} calls, error rate {args.error_rate:.0%}: {failures} failed")
+    print(f"latency p50={np.percentile(latencies, 50):.2f}s p95={np.percentile(latencies, 95):.2f}s "
+          f"p99={np.percentile(latencies, 99):.2f}s max={latencies.max():.2f}s")
+    # llm_client registered its breaker in the imported module, not in this __main__ copy
+    import resilience
+    print(f"breakers: {resilience.breaker_stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,434 @@
+"""
+Fan-out roadmap generation (NEXTPATH_ROADMAP_FANOUT=1).
+
+Instead of one prompt that writes the whole 12-24 month roadmap, generation runs in
+two steps:
+
+1. An outline: roadmap overview plus phase names and milestone titles only.
+2. In parallel, one request per phase for its detailed milestones and subtopics, and
+   one for the psychometric analysis and personalized recommendations.
+
+Each piece is requested with its schema from schemas.py as a structured-output constraint
+and validated on its own; an invalid subtopic is re-requested alone before the piece is
+given up on. A phase's milestones are matched to the ones its outline lists (extra ones
+are dropped, missing ones make the phase invalid) and renumbered (M<phase>.<m>,
+ST<phase>.<m>.<s>), so IDs are unique and predictable whatever the model wrote.
+
+A piece gets at most PIECE_ATTEMPTS LLM requests in total: transient errors back off with
+the retry engine's jitter, invalid responses are requested again at once. This is the
+only retry layer; the requests are not wrapped in resilience.call_with_retry as well. Only
+the pieces that fail are requested again. If a piece still fails after its attempts, the
+generation fails and nothing is saved, so the next request starts over; a roadmap is never
+saved (or indexed for warm starts) with a phase missing. The pieces are merged into the
+same schema the single-prompt generator returns, so latency is roughly outline + slowest
+phase.
+"""
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pandas as pd
+
+import model_router
+import resilience
+import schemas
+
+PIECE_ATTEMPTS = 3
+PIECE_POLICY = resilience.RetryPolicy(max_attempts=PIECE_ATTEMPTS)
+OUTLINE_PHASE_KEYS = ("phase_number", "phase_name", "description", "duration", "difficulty_level",
+                      "learning_objectives")
+PROFILE_KEYS = ("summary", "psychometric_analysis", "personalized_recommendations", "success_metrics")
+
+
+def fanout_enabled() -> bool:
+    return os.getenv("NEXTPATH_ROADMAP_FANOUT", "").lower() in ("1", "true", "yes")
+
+
+# --- Prompts ---
+
+def _profile_json(psychometry_data: pd.DataFrame) -> str:
+    return psychometry_data.to_json(orient='records', indent=2)
+
+
+def build_outline_prompt(career: str, psychometry_data: pd.DataFrame) -> str:
+    return f"""You are an expert career counselor and learning strategist. Plan the structure of a personalized learning roadmap.
+
+## ROADMAP OUTLINE ONLY
+
+**Individual's Psychometric Profile:**
+{_profile_json(psychometry_data)}
+
+**Target Career:** {career}
+
+Cover the complete journey from absolute beginner to professional-ready level over 12-24 months, in 4-8 quarterly phases
+(Beginner → Intermediate → Advanced → Professional). Give each phase 2-5 milestones. Only list milestone titles:
+the subtopics, resources and projects of every phase are written later from this outline, so milestones must not overlap.
+
+Output strictly valid JSON, no markdown, no extra text:
+
+{{
+"career_title": "{career}",
+"total_duration": "[X] months",
+"overview": "[Comprehensive description of the complete learning journey]",
+"industry_context": "[Current market demands, trends, and opportunities in this field]",
+"phases": [
+    {{
+    "phase_number": 1,
+    "phase_name": "[Phase Name]",
+    "description": "[What this phase accomplishes]",
+    "duration": "Months [X]-[Y]",
+    "difficulty_level": "[Beginner/Intermediate/Advanced/Professional]",
+    "learning_objectives": ["[Objective 1]", "[Objective 2]", "[Objective 3]"],
+    "milestones": [
+        {{"milestone_id": "M1.1", "milestone_title": "[Milestone Title]"}}
+    ]
+    }}
+]
+}}
+"""
+
+
+def build_phase_prompt(career: str, psychometry_data: pd.DataFrame, outline: dict, phase_number: int) -> str:
+    phase = next(p for p in outline["phases"] if p["phase_number"] == phase_number)
+    return f"""You are an expert career counselor and learning strategist writing one phase of a personalized learning roadmap.
+
+## PHASE DETAIL REQUEST
+
+**Target Career:** {career}
+
+**Individual's Psychometric Profile:**
+{_profile_json(psychometry_data)}
+
+**Roadmap outline (other phases are written separately; do not repeat their content):**
+{json.dumps(outline, indent=2)}
+
+**Phase to detail:** {phase_number} - {phase.get("phase_name", "")}
+
+Write every milestone of this phase, in the outline's order and with the outline's titles. Each milestone has 3-6
+subtopics. Topic lists have 5-12 specific, non-overlapping topics in learning order (no "Overview" or filler topics).
+Resources must be verified, active URLs from reliable sources (official docs, Coursera, Udemy, freeCodeCamp, MDN),
+2-3 per subtopic, free and paid clearly marked.
+
+Output strictly valid JSON, no markdown, no extra text:
+
+{{
+"phase_number": {phase_number},
+"milestones": [
+    {{
+    "milestone_id": "M{phase_number}.[Y]",
+    "milestone_title": "[Milestone Title from the outline]",
+    "description": "[What this milestone achieves in the context of the career]",
+    "duration": "[X] weeks",
+    "estimated_hours": "[X]-[Y] hours total",
+    "prerequisites": ["[Prerequisite 1]"],
+    "subtopics": [
+        {{
+        "subtopic_id": "ST{phase_number}.[Y].[Z]",
+        "title": "[Subtopic Title]",
+        "description": "[Detailed 2-3 sentence description of what will be learned and why it matters]",
+        "duration": "[X]-[Y] days",
+        "learning_objectives": ["[Specific skill]", "[Measurable outcome]", "[Practical application]"],
+        "topic_list": ["[Topic 1]", "[Topic 2]", "[Topic 3]", "[Topic 4]", "[Topic 5]"],
+        "learning_outcomes": ["[Outcome 1]", "[Outcome 2]"],
+        "resources": [
+            {{
+            "type": "[tutorial/video_course/documentation/interactive/practice/book/certification]",
+            "title": "[Resource Title]",
+            "url": "[Verified, working URL]",
+            "provider": "[Platform/Organization name]",
+            "cost": "[Free/Paid/$X]",
+            "description": "[Why it's valuable for this subtopic]",
+            "estimated_time": "[Hours/Days to complete]"
+            }}
+        ],
+        "hands_on_projects": ["[Small project 1]", "[Small project 2]"],
+        "assessment": {{"method": "[quiz/project/peer-review/certification]", "criteria": "[Success criteria]", "deliverable": "[What is produced]"}},
+        "common_challenges": ["[Challenge and quick solution]"]
+        }}
+    ],
+    "capstone_project": {{
+        "title": "[Project Title]",
+        "description": "[Project applying the milestone's learning]",
+        "duration": "[X]-[Y] days",
+        "skills_demonstrated": ["[Skill 1]", "[Skill 2]"],
+        "deliverables": ["[Deliverable 1]", "[Deliverable 2]"],
+        "evaluation_criteria": ["[Criterion 1]", "[Criterion 2]"]
+    }},
+    "success_criteria": ["[Measurable criterion 1]", "[Measurable criterion 2]"]
+    }}
+]
+}}
+"""
+
+
+def build_profile_prompt(career: str, psychometry_data: pd.DataFrame, outline: dict) -> str:
+    phase_names = [f'{p["phase_number"]}. {p.get("phase_name", "")} ({p.get("duration", "")})' for p in outline["phases"]]
+    return f"""You are an expert career counselor with deep expertise in psychometric analysis.
+
+## PERSONALIZATION ONLY
+
+**Individual's Psychometric Profile:**
+{_profile_json(psychometry_data)}
+
+**Target Career:** {career}
+
+**Roadmap phases:** {"; ".join(phase_names)}
+
+Evaluate how the personality fits the career, determine the optimal learning approach and tailor recommendations to
+the individual's strengths and challenges. Base everything on the actual profile data.
+
+Output strictly valid JSON, no markdown, no extra text:
+
+{{
+"summary": "[Personalized summary of the learning journey for this individual]",
+"psychometric_analysis": {{
+    "career_alignment_score": "[X.X]/10",
+    "alignment_explanation": "[Why this score was given]",
+    "personality_strengths": ["[Strength 1]", "[Strength 2]", "[Strength 3]"],
+    "potential_challenges": ["[Challenge 1]", "[Challenge 2]"],
+    "learning_style_profile": {{
+    "primary_style": "[Dominant learning preference]",
+    "secondary_style": "[Secondary preference]",
+    "recommended_approaches": ["[Method 1]", "[Method 2]"],
+    "learning_preferences": "[Visual/Auditory/Kinesthetic/Reading-Writing]"
+    }},
+    "psychological_considerations": "[Key insights affecting the learning approach]"
+}},
+"personalized_recommendations": {{
+    "study_schedule": {{"recommended_pattern": "...", "session_length": "...", "break_frequency": "...", "weekly_structure": "...", "intensity_level": "..."}},
+    "resource_preferences": {{"primary_resources": ["..."], "supplementary_resources": ["..."], "avoid": ["..."]}},
+    "motivation_strategies": ["...", "..."],
+    "potential_obstacles": {{"identified_challenges": ["..."], "mitigation_strategies": ["..."], "early_warning_signs": ["..."], "support_systems": ["..."]}},
+    "networking_advice": {{"personality_aligned_approaches": ["..."], "communities_to_join": ["..."], "mentorship_approach": "...", "social_learning": "..."}},
+    "career_development": {{"job_search_timeline": "...", "portfolio_building": "...", "interview_preparation": "...", "certification_priorities": ["..."]}},
+    "alternative_paths": ["...", "..."]
+}},
+"success_metrics": {{
+    "quarterly_checkpoints": {{"Q1": ["..."], "Q2": ["..."], "Q3": ["..."], "Q4": ["..."]}},
+    "skill_assessments": {{"technical_evaluations": ["..."], "soft_skill_measures": ["..."], "industry_readiness": ["..."]}},
+    "portfolio_requirements": {{"beginner_projects": ["..."], "intermediate_projects": ["..."], "advanced_projects": ["..."], "presentation_format": "...", "minimum_projects": "..."}},
+    "industry_benchmarks": {{"entry_level_standards": ["..."], "competitive_advantages": ["..."], "continuous_learning": ["..."], "salary_expectations": "..."}}
+}}
+}}
+"""
+
+
+# --- Validation ---
+
+def _problems(schema_name, document) -> list[str]:
+    if not isinstance(document, dict) or "error" in document:
+        return [str(document.get("error", "not an object")) if isinstance(document, dict) else "not an object"]
+    return [str(error) for error in schemas.validate(schema_name, document)]
+
+
+def validate_outline(outline) -> tuple[dict | None, list[str]]:
+    """Outline with phases numbered 1..n, or None and the problems found."""
+    problems = _problems("outline", outline)
+    if problems:
+        return None, problems
+    numbered = [
+        {
+            **phase,
+            "phase_number": number,
+            "milestones": [{"milestone_id": f"M{number}.{m}", "milestone_title": milestone["milestone_title"]}
+                           for m, milestone in enumerate(phase["milestones"], 1)],
+        }
+        for number, phase in enumerate(outline["phases"], 1)
+    ]
+    return {**outline, "phases": numbered}, []
+
+
+def _title_key(title) -> str:
+    return " ".join(str(title or "").lower().split())
+
+
+def normalize_phase(detail, outline_phase: dict) -> tuple[dict | None, list[str]]:
+    """
+    Merges a phase's detail into its outline entry and renumbers milestone and subtopic
+    IDs. Generated milestones are matched to the outline's by title (by position when the
+    counts agree and a title was reworded); ones the outline doesn't list are dropped.
+    Returns (phase, []) or (None, problems).
+    """
+    problems = _problems("phase_detail", detail)
+    if problems:
+        return None, problems
+    number = outline_phase["phase_number"]
+    generated = detail["milestones"]
+    by_title = {_title_key(milestone["milestone_title"]): milestone for milestone in generated}
+    matched = []
+    for position, planned in enumerate(outline_phase["milestones"]):
+        milestone = by_title.get(_title_key(planned["milestone_title"]))
+        if milestone is None and len(generated) == len(outline_phase["milestones"]):
+            milestone = generated[position]
+        if milestone is None:
+            problems.append(f"milestone {planned['milestone_title']!r} of the outline is missing")
+        matched.append(milestone)
+    if problems:
+        return None, problems
+
+    normalized = [
+        {
+            **milestone,
+            "milestone_id": f"M{number}.{m_idx}",
+            "milestone_title": planned["milestone_title"],
+            "subtopics": [
+                {**subtopic, "subtopic_id": f"ST{number}.{m_idx}.{s_idx}"}
+                for s_idx, subtopic in enumerate(milestone["subtopics"], 1)
+            ],
+        }
+        for m_idx, (planned, milestone) in enumerate(zip(outline_phase["milestones"], matched), 1)
+    ]
+    phase = {key: outline_phase[key] for key in OUTLINE_PHASE_KEYS if key in outline_phase}
+    phase["milestones"] = normalized
+    return phase, []
+
+
+def validate_profile(profile) -> tuple[dict | None, list[str]]:
+    problems = _problems("profile", profile)
+    if problems:
+        return None, problems
+    return {key: profile[key] for key in PROFILE_KEYS}, []
+
+
+def merge(career: str, outline: dict, phases: list[dict], profile: dict) -> dict:
+    """Assembles the pieces into the schema of build_roadmap_prompt's response."""
+    roadmap = {key: value for key, value in outline.items() if key != "phases"}
+    roadmap["career_title"] = roadmap.get("career_title") or career
+    roadmap["phases"] = phases
+    return {
+        "career_title": career,
+        "created_at": datetime.now().isoformat(),
+        "summary": profile["summary"],
+        "psychometric_analysis": profile["psychometric_analysis"],
+        "roadmap": roadmap,
+        "personalized_recommendations": profile["personalized_recommendations"],
+        "success_metrics": profile["success_metrics"],
+    }
+
+
+# --- Generation ---
+
+def _generate_piece(name, route, prompt, schema, validate) -> tuple[dict | None, list[str]]:
+    """
+    Generates and validates one piece in at most PIECE_ATTEMPTS requests. Invalid
+    subtopics are re-requested alone; the piece is regenerated only if it is still invalid.
+    """
+    problems, delay = [], None
+    for attempt in range(PIECE_ATTEMPTS):
+        try:
+            response = model_router.generate_json(route, prompt, schema=schema)
+        except Exception as e:
+            problems = [str(e)]
+            delay = PIECE_POLICY.retry_delay(e, attempt, delay)
+            if delay is None:
+                break
+            print(f"Roadmap {name} attempt {attempt + 1} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        try:
+            response = schemas.checked(response, schema, schemas.llm_repairer(route, f"roadmap {name}"))
+        except Exception as e:
+            response = {"error": str(e)}
+        piece, problems = validate(response)
+        if piece is not None:
+            return piece, []
+        print(f"Roadmap {name} attempt {attempt + 1} failed: {'; '.join(problems)}")
+    return None, problems
+
+
+async def _generate_piece_async(name, route, prompt, schema, validate, executor) -> tuple[dict | None, list[str]]:
+    problems, delay = [], None
+    for attempt in range(PIECE_ATTEMPTS):
+        try:
+            response = await model_router.generate_json_async(route, prompt, executor=executor, schema=schema)
+        except Exception as e:
+            problems = [str(e)]
+            delay = PIECE_POLICY.retry_delay(e, attempt, delay)
+            if delay is None:
+                break
+            print(f"Roadmap {name} attempt {attempt + 1} failed ({e}); retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            continue
+        try:
+            response = await schemas.checked_async(response, schema,
+                                                   schemas.llm_repairer_async(route, f"roadmap {name}", executor))
+        except Exception as e:
+            response = {"error": str(e)}
+        piece, problems = validate(response)
+        if piece is not None:
+            return piece, []
+        print(f"Roadmap {name} attempt {attempt + 1} failed: {'; '.join(problems)}")
+    return None, problems
+
+
+def generate_profile(career: str, psychometry_data: pd.DataFrame, outline: dict) -> dict | None:
+    """The personalization sections (PROFILE_KEYS) for a profile and an existing outline, or None."""
+    profile, problems = _generate_piece("personalization", "roadmap_profile",
+                                        build_profile_prompt(career, psychometry_data, outline), "profile",
+                                        validate_profile)
+    return profile
+
+
+def _phase_validator(outline, phase_number):
+    outline_phase = outline["phases"][phase_number - 1]
+    return lambda detail: normalize_phase(detail, outline_phase)
+
+
+def _result(career, outline, phase_results, profile_result) -> dict:
+    failed = [f"phase {n}: {'; '.join(problems)}" for n, (phase, problems) in enumerate(phase_results, 1) if phase is None]
+    if profile_result[0] is None:
+        failed.append(f"personalization: {'; '.join(profile_result[1])}")
+    if failed:
+        return {"error": "Roadmap generation failed for " + " | ".join(failed)}
+    return merge(career, outline, [phase for phase, _ in phase_results], profile_result[0])
+
+
+def generate_roadmap(career: str, psychometry_data: pd.DataFrame) -> dict:
+    """Outline first, then every phase and the personalization in parallel."""
+    outline, problems = _generate_piece("outline", "roadmap_outline",
+                                        build_outline_prompt(career, psychometry_data), "outline", validate_outline)
+    if outline is None:
+        return {"error": f"Roadmap outline failed: {'; '.join(problems)}"}
+    print(f"Roadmap outline ready: {len(outline['phases'])} phases, generating them in parallel...")
+
+    numbers = [phase["phase_number"] for phase in outline["phases"]]
+    with ThreadPoolExecutor(max_workers=len(numbers) + 1, thread_name_prefix="roadmap-fanout") as pool:
+        profile_future = pool.submit(_generate_piece, "personalization", "roadmap_profile",
+                                     build_profile_prompt(career, psychometry_data, outline), "profile",
+                                     validate_profile)
+        phase_futures = [
+            pool.submit(_generate_piece, f"phase {n}", "roadmap_phase",
+                        build_phase_prompt(career, psychometry_data, outline, n), "phase_detail",
+                        _phase_validator(outline, n))
+            for n in numbers
+        ]
+        phase_results = [future.result() for future in phase_futures]
+        profile_result = profile_future.result()
+    return _result(career, outline, phase_results, profile_result)
+
+
+async def generate_roadmap_async(career: str, psychometry_data: pd.DataFrame, executor=None) -> dict:
+    """Non-blocking generate_roadmap; JSON is parsed on `executor`."""
+    outline, problems = await _generate_piece_async("outline", "roadmap_outline",
+                                                    build_outline_prompt(career, psychometry_data),
+                                                    "outline", validate_outline, executor)
+    if outline is None:
+        return {"error": f"Roadmap outline failed: {'; '.join(problems)}"}
+    print(f"Roadmap outline ready: {len(outline['phases'])} phases, generating them in parallel...")
+
+    numbers = [phase["phase_number"] for phase in outline["phases"]]
+    profile_result, *phase_results = await asyncio.gather(
+        _generate_piece_async("personalization", "roadmap_profile",
+                              build_profile_prompt(career, psychometry_data, outline), "profile",
+                              validate_profile, executor),
+        *(
+            _generate_piece_async(f"phase {n}", "roadmap_phase",
+                                  build_phase_prompt(career, psychometry_data, outline, n), "phase_detail",
+                                  _phase_validator(outline, n), executor)
+            for n in numbers
+        ),
+    )
+    return _result(career, outline, phase_results, profile_result)
@@ -0,0 +1,389 @@
+"""
+Typed, compact in-memory model of a roadmap document.
+
+Roadmaps are saved as {"roadmap": {"phases": [...]}}, and the prompt's format puts the
+phases under "roadmap_data" (at the top or inside "roadmap"), so every reader used to
+probe for each shape and walk phases > milestones > subtopics itself. Roadmap.parse finds
+the phases once and builds Phase, Milestone and Subtopic objects with __slots__. Keys and
+short strings that repeat across roadmaps (IDs, durations, topic names) are interned.
+Subtopics are indexed by ID and by title.
+
+Fields the model has no attribute for stay on their node, and every node remembers its
+key order, so to_dict() gives back the JSON that was parsed (plus any changes).
+
+load_roadmap(path) keeps parsed roadmaps until their file changes, so a long-running
+server parses each roadmap once. Cached roadmaps are shared: code that changes a roadmap
+parses its own copy (Roadmap.parse) and saves to_dict().
+
+Screens that need only part of a roadmap read a view of it: project() keeps some phases
+or milestones and some fields, and outline() is the skeleton of titles and statuses.
+view_from_query() turns the ?fields=&phase=&milestone= parameters of the roadmap
+endpoints into such a view.
+"""
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import test_store
+from json_store import read_json
+
+ROADMAP_CACHE_SIZE = 256
+INTERN_MAX_LENGTH = 120  # longer strings (descriptions) hardly ever repeat
+
+# Where the phases list lives, in the order readers have always probed for it
+PHASES_PATHS = (("roadmap",), ("roadmap", "roadmap_data"), ("roadmap_data",), ())
+
+# What the outline keeps of every node, besides IDs
+OUTLINE_FIELDS = frozenset((
+    "phase_name", "duration", "milestone_title", "title",
+    "adaptive_status", "adaptive_priority", "block_progression", "adjusted_duration",
+))
+
+_shapes = {}
+_roadmap_cache = OrderedDict()
+_roadmap_cache_lock = threading.Lock()
+
+
+def _intern(value):
+    """Copy of a JSON value with its keys and short strings interned."""
+    if isinstance(value, str):
+        return sys.intern(value) if len(value) <= INTERN_MAX_LENGTH else value
+    if isinstance(value, list):
+        return [_intern(item) for item in value]
+    if isinstance(value, dict):
+        return {sys.intern(key): _intern(item) for key, item in value.items()}
+    return value
+
+
+def _plain(value):
+    """Copy of a JSON value, so callers can change what to_dict() returns."""
+    if isinstance(value, list):
+        return [_plain(item) for item in value]
+    if isinstance(value, dict):
+        return {key: _plain(item) for key, item in value.items()}
+    return value
+
+
+def _without_phases(document: dict, path: tuple) -> dict:
+    """Copy of the objects along path with the phases list left out (its key keeps its place)."""
+    if not path:
+        return {**document, "phases": None}
+    return {**document, path[0]: _without_phases(document[path[0]], path[1:])}
+
+
+def _project_holders(document: dict, path: tuple, fields) -> dict:
+    """The objects along path, each with only the next key on the path and the given fields."""
+    if not path:
+        return {key: _plain(value) for key, value in document.items() if key == "phases" or key in fields}
+    return {
+        key: _project_holders(value, path[1:], fields) if key == path[0] else _plain(value)
+        for key, value in document.items() if key == path[0] or key in fields
+    }
+
+
+def _shape(keys) -> tuple:
+    """Key order of a node, one tuple shared by all nodes with the same keys."""
+    keys = tuple(keys)
+    return _shapes.setdefault(keys, keys)
+
+
+class _Node:
+    """A JSON object whose known fields are attributes; the others are kept in `extra`."""
+
+    FIELDS = frozenset()
+    ID_FIELD = None  # always kept by project()
+    CHILDREN = None  # key of the list of child nodes
+    CHILD = None
+    __slots__ = ("_keys", "extra")
+
+    def __init__(self, data: dict):
+        self.extra = None
+        for field in self.FIELDS:
+            setattr(self, field, None)
+        children = data.get(self.CHILDREN) if self.CHILDREN else None
+        if isinstance(children, list) and all(isinstance(child, dict) for child in children):
+            setattr(self, self.CHILDREN, [self._child(child, index) for index, child in enumerate(children)])
+        elif self.CHILDREN:
+            setattr(self, self.CHILDREN, [])
+            children = None
+        keys = []
+        for key, value in data.items():
+            key = sys.intern(key)
+            keys.append(key)
+            if key in self.FIELDS:
+                setattr(self, key, _intern(value))
+            elif key != self.CHILDREN or children is None:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = _intern(value)
+        self._keys = _shape(keys)
+
+    def _child(self, data, index):
+        child = self.CHILD(data)
+        child._attach(self, index)
+        return child
+
+    def _attach(self, parent, index):
+        raise NotImplementedError
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __getitem__(self, key):
+        if key not in self._keys:
+            raise KeyError(key)
+        return self.get(key)
+
+    def get(self, key, default=None):
+        if key in self.FIELDS or key == self.CHILDREN:
+            value = getattr(self, key)
+            return default if value is None and key not in self._keys else value
+        return (self.extra or {}).get(key, default)
+
+    def __setitem__(self, key, value):
+        key = sys.intern(key)
+        if key not in self._keys:
+            self._keys = _shape(self._keys + (key,))
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def project(self, fields=None, children=None) -> dict:
+        """This node with only its ID and the given fields (None: all), and the given child dicts."""
+        data = {}
+        for key in self._keys:
+            if key == self.CHILDREN and (self.extra is None or key not in self.extra):
+                data[key] = children if children is not None else []
+            elif fields is None or key == self.ID_FIELD or key in fields:
+                data[key] = _plain(self.get(key))
+        return data
+
+    def to_dict(self) -> dict:
+        data = {}
+        for key in self._keys:
+            if key == self.CHILDREN and (self.extra is None or key not in self.extra):
+                data[key] = [child.to_dict() for child in getattr(self, key)]
+            elif key in self.FIELDS:
+                data[key] = _plain(getattr(self, key))
+            else:
+                data[key] = _plain(self.extra[key])
+        for field in self.FIELDS - set(self._keys):  # set as attributes after parsing
+            if getattr(self, field) is not None:
+                data[field] = _plain(getattr(self, field))
+        return data
+
+
+class Subtopic(_Node):
+    FIELDS = frozenset(("subtopic_id", "title", "description", "duration", "topic_list", "resources"))
+    ID_FIELD = "subtopic_id"
+    __slots__ = (*FIELDS, "milestone", "index", "ordinal")
+
+    def _attach(self, milestone, index):
+        self.milestone, self.index = milestone, index
+
+    @property
+    def phase(self) -> "Phase":
+        return self.milestone.phase
+
+    @property
+    def indexes(self) -> tuple[int, int, int]:
+        """(phase_idx, milestone_idx, subtopic_idx) in the roadmap's lists."""
+        return self.milestone.phase.index, self.milestone.index, self.index
+
+    @property
+    def key(self) -> tuple[str, str, str]:
+        """The subtopic's key in test_store."""
+        return test_store.test_key(self.phase.phase_number, self.milestone.milestone_id, self.subtopic_id)
+
+    def __repr__(self):
+        return f"Subtopic({self.subtopic_id!r}, {self.title!r})"
+
+
+class Milestone(_Node):
+    FIELDS = frozenset(("milestone_id", "milestone_title", "duration"))
+    ID_FIELD = "milestone_id"
+    CHILDREN = "subtopics"
+    CHILD = Subtopic
+    __slots__ = (*FIELDS, "subtopics", "phase", "index")
+
+    def _attach(self, phase, index):
+        self.phase, self.index = phase, index
+
+    def __repr__(self):
+        return f"Milestone({self.milestone_id!r}, {self.milestone_title!r})"
+
+
+class Phase(_Node):
+    FIELDS = frozenset(("phase_number", "phase_name", "duration"))
+    ID_FIELD = "phase_number"
+    CHILDREN = "milestones"
+    CHILD = Milestone
+    __slots__ = (*FIELDS, "milestones", "roadmap", "index")
+
+    def _attach(self, roadmap, index):
+        self.roadmap, self.index = roadmap, index
+
+    def __repr__(self):
+        return f"Phase({self.phase_number!r}, {self.phase_name!r})"
+
+
+class Roadmap:
+    """A parsed roadmap document: its phases, a flat list of subtopics and lookups by ID and title."""
+
+    __slots__ = ("document", "path", "phases", "subtopics", "by_id", "by_title")
+
+    def __init__(self, document: dict, path: tuple | None, phases: list):
+        self.document = document  # everything but the phases; they are a placeholder in it
+        self.path = path          # keys leading to the object that holds "phases"
+        self.phases = phases
+        for index, phase in enumerate(phases):
+            phase._attach(self, index)
+        self.subtopics = [subtopic for phase in phases for milestone in phase.milestones
+                          for subtopic in milestone.subtopics]
+        self.by_id = {}
+        self.by_title = {}
+        for ordinal, subtopic in enumerate(self.subtopics):
+            subtopic.ordinal = ordinal
+            self.by_id.setdefault(subtopic.subtopic_id, subtopic)
+            self.by_title.setdefault(subtopic.title, []).append(subtopic)
+
+    @classmethod
+    def parse(cls, document) -> "Roadmap":
+        """Builds the model of a roadmap JSON document in any of its shapes."""
+        if not isinstance(document, dict):
+            return cls({}, None, [])
+        for path in PHASES_PATHS:
+            holder = document
+            for key in path:
+                holder = holder.get(key) if isinstance(holder, dict) else None
+            phases = holder.get("phases") if isinstance(holder, dict) else None
+            if phases and isinstance(phases, list) and all(isinstance(phase, dict) for phase in phases):
+                return cls(_intern(_without_phases(document, path)), path, [Phase(phase) for phase in phases])
+        return cls(_intern(document), None, [])
+
+    @classmethod
+    def of(cls, roadmap) -> "Roadmap":
+        """`roadmap` itself if it is already parsed, else its model."""
+        return roadmap if isinstance(roadmap, cls) else cls.parse(roadmap)
+
+    def get(self, key, default=None):
+        """A top-level field of the document."""
+        return self.document.get(key, default)
+
+    def __setitem__(self, key, value):
+        self.document[key] = value
+
+    def find(self, subtopic_id) -> Subtopic | None:
+        return self.by_id.get(subtopic_id)
+
+    def with_title(self, title) -> list[Subtopic]:
+        return self.by_title.get(title, [])
+
+    def at(self, phase_idx, milestone_idx, subtopic_idx) -> Subtopic:
+        return self.phases[phase_idx].milestones[milestone_idx].subtopics[subtopic_idx]
+
+    def to_dict(self) -> dict:
+        """The roadmap as the JSON it was parsed from, including any changes made since."""
+        document = _plain(self.document)
+        if self.path is not None:
+            holder = document
+            for key in self.path:
+                holder = holder[key]
+            holder["phases"] = [phase.to_dict() for phase in self.phases]
+        return document
+
+    def project(self, fields=None, phases=None, milestones=None) -> dict:
+        """
+        The document with only the given phases (phase numbers) and milestones (IDs), and on
+        every node only its ID, the given fields and its children. None selects everything.
+        Top-level fields are kept only if they are named in fields.
+        """
+        if self.path is None:
+            return _plain(self.document) if fields is None else {}
+        document = _plain(self.document) if fields is None else _project_holders(self.document, self.path, fields)
+        holder = document
+        for key in self.path:
+            holder = holder[key]
+        holder["phases"] = self._project_phases(fields, phases, milestones)
+        return document
+
+    def _project_phases(self, fields=None, phases=None, milestones=None) -> list:
+        selected = []
+        for phase in self.phases:
+            if phases is not None and str(phase.phase_number) not in phases:
+                continue
+            kept = [milestone for milestone in phase.milestones
+                    if milestones is None or milestone.milestone_id in milestones]
+            if milestones is not None and not kept:
+                continue
+            selected.append(phase.project(fields, [
+                milestone.project(fields, [subtopic.project(fields) for subtopic in milestone.subtopics])
+                for milestone in kept
+            ]))
+        return selected
+
+    def outline(self) -> dict:
+        """IDs, titles, durations and adaptive status of every phase, milestone and subtopic."""
+        holder = self.document
+        for key in self.path or ():
+            holder = holder[key]
+        return {
+            "career_title": self.get("career_title") or holder.get("career_title"),
+            "last_adapted": (self.get("adaptive_metadata") or {}).get("last_updated"),
+            "total_phases": len(self.phases),
+            "total_milestones": sum(len(phase.milestones) for phase in self.phases),
+            "total_subtopics": len(self.subtopics),
+            "phases": self._project_phases(OUTLINE_FIELDS),
+        }
+
+
+def outline_of(document) -> dict:
+    return Roadmap.parse(document).outline()
+
+
+def view_from_query(args) -> tuple:
+    """
+    (transform, tag) for http_cache.json_file_response from a request's fields, phase and
+    milestone parameters (comma-separated), or (None, "") when they ask for the whole roadmap.
+    """
+    def values(name):
+        raw = args.get(name)
+        return frozenset(value.strip() for value in raw.split(",") if value.strip()) if raw else None
+
+    fields, phases, milestones = values("fields"), values("phase"), values("milestone")
+    if fields is None and phases is None and milestones is None:
+        return None, ""
+    canonical = "&".join(f"{name}={','.join(sorted(selected))}"
+                         for name, selected in (("fields", fields), ("phase", phases), ("milestone", milestones))
+                         if selected is not None)
+    tag = "view-" + hashlib.sha1(canonical.encode()).hexdigest()[:12]
+    return (lambda document: Roadmap.parse(document).project(fields, phases, milestones)), tag
+
+
+def load_roadmap(path) -> Roadmap | None:
+    """The parsed roadmap saved at path (None if there is none), parsed again only when the file changed."""
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _roadmap_cache_lock:
+        cached = _roadmap_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            _roadmap_cache.move_to_end(path)
+            return cached[1]
+
+    document = read_json(path)
+    if not isinstance(document, dict):
+        return None
+    roadmap = Roadmap.parse(document)
+    with _roadmap_cache_lock:
+        _roadmap_cache[path] = (signature, roadmap)
+        if len(_roadmap_cache) > ROADMAP_CACHE_SIZE:
+            _roadmap_cache.popitem(last=False)
+    return roadmap
@@ -0,0 +1,453 @@
+"""
+Schemas of the generated documents, compiled validators and subtree-only repair.
+
+Every schema is defined once here, in a small JSON-Schema subset (type, properties,
+required, items, enum, minItems, minLength) plus two extensions:
+
+    "check"       a function(value) -> message or None for cross-field rules
+                  (an MCQ's answer must be one of its option keys)
+    "repairable"  marks a subtree (a subtopic, an MCQ) that can be re-requested on its own
+
+response_schema() converts a schema to Gemini's structured-output format, so the model is
+constrained to it where the tier supports that. VALIDATORS holds each schema compiled
+once into nested closures; validating a document walks it once without interpreting the
+schema again. Each error carries the innermost repairable unit around it, so repair()
+re-requests only the invalid subtopics or MCQs instead of the whole document, and prune()
+drops units that could not be repaired.
+"""
+import json
+from typing import NamedTuple
+
+REPAIR_ROUNDS = 2
+# Kept from the original fragment: the model must not renumber a repaired unit
+ID_FIELDS = ("subtopic_id", "milestone_id")
+
+
+def _string(**kwargs):
+    return {"type": "string", **kwargs}
+
+
+def _strings(min_items=0):
+    return {"type": "array", "items": _string(minLength=1), **({"minItems": min_items} if min_items else {})}
+
+
+def _object(properties, required=(), **kwargs):
+    return {"type": "object", "properties": properties, "required": list(required), **kwargs}
+
+
+# --- Roadmap ---
+
+RESOURCE = _object({
+    "type": _string(),
+    "title": _string(),
+    "url": _string(),
+    "provider": _string(),
+    "cost": _string(),
+    "description": _string(),
+    "estimated_time": _string(),
+}, required=["title", "url"])
+
+SUBTOPIC = _object({
+    "subtopic_id": _string(minLength=1),
+    "title": _string(minLength=1),
+    "description": _string(),
+    "duration": _string(),
+    "learning_objectives": _strings(),
+    "topic_list": _strings(min_items=1),
+    "learning_outcomes": _strings(),
+    "resources": {"type": "array", "items": RESOURCE},
+    "hands_on_projects": _strings(),
+    "assessment": _object({"method": _string(), "criteria": _string(), "deliverable": _string()}),
+    "common_challenges": _strings(),
+}, required=["subtopic_id", "title", "topic_list"], repairable="subtopic")
+
+MILESTONE = _object({
+    "milestone_id": _string(minLength=1),
+    "milestone_title": _string(minLength=1),
+    "description": _string(),
+    "duration": _string(),
+    "estimated_hours": _string(),
+    "prerequisites": _strings(),
+    "subtopics": {"type": "array", "items": SUBTOPIC, "minItems": 1},
+    "capstone_project": _object({
+        "title": _string(),
+        "description": _string(),
+        "duration": _string(),
+        "skills_demonstrated": _strings(),
+        "deliverables": _strings(),
+        "evaluation_criteria": _strings(),
+    }),
+    "success_criteria": _strings(),
+}, required=["milestone_id", "milestone_title", "subtopics"])
+
+PHASE = _object({
+    "phase_number": {"type": "integer"},
+    "phase_name": _string(minLength=1),
+    "description": _string(),
+    "duration": _string(),
+    "difficulty_level": _string(),
+    "learning_objectives": _strings(),
+    "milestones": {"type": "array", "items": MILESTONE, "minItems": 1},
+}, required=["phase_number", "phase_name", "milestones"])
+
+ROADMAP_DATA = _object({
+    "career_title": _string(),
+    "total_duration": _string(),
+    "overview": _string(),
+    "industry_context": _string(),
+    "phases": {"type": "array", "items": PHASE, "minItems": 1},
+}, required=["phases"])
+
+# The personalization sections are free-form, so the full document is validated but not
+# sent as a structured-output constraint (Gemini needs properties for every object).
+ROADMAP = _object({
+    "career_title": _string(),
+    "created_at": _string(),
+    "summary": _string(),
+    "psychometric_analysis": {"type": "object"},
+    "roadmap": ROADMAP_DATA,
+    "personalized_recommendations": {"type": "object"},
+    "success_metrics": {"type": "object"},
+}, required=["roadmap"])
+
+# Pieces of a fan-out generation (roadmap_fanout)
+OUTLINE = _object({
+    "career_title": _string(),
+    "total_duration": _string(),
+    "overview": _string(),
+    "industry_context": _string(),
+    "phases": {"type": "array", "minItems": 1, "items": _object({
+        "phase_number": {"type": "integer"},
+        "phase_name": _string(minLength=1),
+        "description": _string(),
+        "duration": _string(),
+        "difficulty_level": _string(),
+        "learning_objectives": _strings(),
+        "milestones": {"type": "array", "minItems": 1, "items": _object({
+            "milestone_id": _string(),
+            "milestone_title": _string(minLength=1),
+        }, required=["milestone_title"])},
+    }, required=["phase_name", "milestones"])},
+}, required=["phases"])
+
+PHASE_DETAIL = _object({
+    "phase_number": {"type": "integer"},
+    "milestones": {"type": "array", "items": MILESTONE, "minItems": 1},
+}, required=["milestones"])
+
+PROFILE = _object({
+    "summary": _string(),
+    "psychometric_analysis": {"type": "object"},
+    "personalized_recommendations": {"type": "object"},
+    "success_metrics": {"type": "object"},
+}, required=["summary", "psychometric_analysis", "personalized_recommendations", "success_metrics"])
+
+
+# --- MCQs ---
+
+def _answer_in_options(mcq):
+    options = mcq.get("options")
+    if isinstance(options, dict) and str(mcq.get("answer")) not in options:
+        return f"answer {mcq.get('answer')!r} is not one of the option keys {sorted(options)}"
+    return None
+
+
+MCQ = _object({
+    "question": _string(minLength=1),
+    "options": _object({key: _string(minLength=1) for key in ("1", "2", "3", "4", "5")}, required=["1", "2", "3"]),
+    "answer": _string(enum=["1", "2", "3", "4", "5"]),
+    "topic_label": _string(minLength=1),
+    "difficulty": _string(enum=["easy", "medium", "hard"]),
+}, required=["question", "options", "answer", "topic_label", "difficulty"],
+    check=_answer_in_options, repairable="mcq")
+
+MCQ_SET = _object({
+    "phase_number": {"type": "integer"},
+    "milestone_id": _string(),
+    "subtopic_id": _string(),
+    "subtopic_name": _string(),
+    "career_title": _string(),
+    "created_at": _string(),
+    "mcqs": {"type": "array", "items": MCQ, "minItems": 1},
+}, required=["mcqs"])
+
+SCHEMAS = {
+    "roadmap": ROADMAP,
+    "outline": OUTLINE,
+    "phase_detail": PHASE_DETAIL,
+    "profile": PROFILE,
+    "mcq_set": MCQ_SET,
+}
+REPAIRABLE_UNITS = {"subtopic": SUBTOPIC, "mcq": MCQ}
+
+
+# --- Compiled validation ---
+
+class ValidationError(NamedTuple):
+    path: tuple
+    message: str
+    unit: tuple | None  # (unit name, path of the unit) of the innermost repairable subtree
+
+    def __str__(self):
+        return f"{format_path(self.path) or '<root>'}: {self.message}"
+
+
+def format_path(path) -> str:
+    return "".join(f"[{part}]" if isinstance(part, int) else f".{part}" for part in path).lstrip(".")
+
+
+_PYTHON_TYPES = {"object": dict, "array": list, "string": str, "integer": int, "number": (int, float), "boolean": bool}
+
+
+def _compile(schema):
+    kind = schema.get("type")
+    expected = _PYTHON_TYPES.get(kind)
+    enum = frozenset(schema["enum"]) if "enum" in schema else None
+    min_length = schema.get("minLength", 0)
+    min_items = schema.get("minItems", 0)
+    required = tuple(schema.get("required", ()))
+    properties = tuple((key, _compile(sub)) for key, sub in schema.get("properties", {}).items())
+    items = _compile(schema["items"]) if "items" in schema else None
+    check = schema.get("check")
+    repairable = schema.get("repairable")
+
+    def validate(value, path, unit, errors):
+        if repairable:
+            unit = (repairable, path)
+        if expected is not None and (not isinstance(value, expected) or (kind != "boolean" and isinstance(value, bool))):
+            errors.append(ValidationError(path, f"expected {kind}, got {type(value).__name__}", unit))
+            return
+        if enum is not None and value not in enum:
+            errors.append(ValidationError(path, f"{value!r} is not one of {sorted(enum)}", unit))
+        if kind == "string":
+            if len(value.strip()) < min_length:
+                errors.append(ValidationError(path, "is empty", unit))
+        elif kind == "object":
+            for key in required:
+                if value.get(key) is None:
+                    errors.append(ValidationError(path + (key,), "is missing", unit))
+            for key, validate_property in properties:
+                if value.get(key) is not None:
+                    validate_property(value[key], path + (key,), unit, errors)
+        elif kind == "array":
+            if len(value) < min_items:
+                errors.append(ValidationError(path, f"needs at least {min_items} item(s)", unit))
+            if items is not None:
+                for i, item in enumerate(value):
+                    items(item, path + (i,), unit, errors)
+        if check is not None:
+            message = check(value)
+            if message:
+                errors.append(ValidationError(path, message, unit))
+
+    return validate
+
+
+class Validator:
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self._validate = _compile(schema)
+
+    def errors(self, document) -> list[ValidationError]:
+        errors = []
+        self._validate(document, (), None, errors)
+        return errors
+
+    def is_valid(self, document) -> bool:
+        return not self.errors(document)
+
+
+VALIDATORS = {name: Validator(schema) for name, schema in SCHEMAS.items()}
+UNIT_VALIDATORS = {name: Validator(schema) for name, schema in REPAIRABLE_UNITS.items()}
+
+
+def validate(schema_name, document) -> list[ValidationError]:
+    return VALIDATORS[schema_name].errors(document)
+
+
+# --- Structured output ---
+
+_RESPONSE_SCHEMA_KEYS = {"minItems": "min_items", "minLength": "min_length", "enum": "enum", "required": "required"}
+
+
+def _to_response_schema(schema) -> dict:
+    converted = {"type": schema["type"].upper()}
+    for key, target in _RESPONSE_SCHEMA_KEYS.items():
+        if schema.get(key):
+            converted[target] = list(schema[key]) if isinstance(schema[key], (list, tuple)) else schema[key]
+    if "properties" in schema:
+        converted["properties"] = {key: _to_response_schema(sub) for key, sub in schema["properties"].items()}
+        converted["property_ordering"] = list(schema["properties"])
+    elif schema["type"] == "object":
+        raise ValueError("Structured output needs properties for every object")
+    if "items" in schema:
+        converted["items"] = _to_response_schema(schema["items"])
+    return converted
+
+
+def response_schema(name) -> dict | None:
+    """Gemini response_schema for a document or unit schema, None if it has free-form objects."""
+    try:
+        return _to_response_schema(SCHEMAS.get(name) or REPAIRABLE_UNITS[name])
+    except ValueError:
+        return None
+
+
+# --- Repair ---
+
+def get_path(document, path):
+    for part in path:
+        document = document[part]
+    return document
+
+
+def _set_path(document, path, value):
+    get_path(document, path[:-1])[path[-1]] = value
+
+
+def _group_by_unit(errors) -> dict:
+    units = {}
+    for error in errors:
+        units.setdefault(error.unit, []).append(error)
+    return units
+
+
+def build_repair_prompt(unit_name, fragment, problems, context) -> str:
+    relative = [f"- {problem}" for problem in problems]
+    return f"""## REPAIR
+One {unit_name} of a generated {context} is invalid. Return the corrected {unit_name} as a single JSON object.
+Keep every field that is already valid, fix only these problems:
+{chr(10).join(relative)}
+
+Invalid {unit_name}:
+{json.dumps(fragment, indent=2, ensure_ascii=False)}
+
+Output valid JSON only. No explanations.
+"""
+
+
+def _repaired(fragment, fixed):
+    if isinstance(fragment, dict) and isinstance(fixed, dict):
+        return {**fixed, **{key: fragment[key] for key in ID_FIELDS if key in fragment}}
+    return fixed
+
+
+def _problems(unit_path, unit_errors):
+    return [str(error._replace(path=error.path[len(unit_path):])) for error in unit_errors]
+
+
+def repair(document, schema_name, regenerate, rounds=REPAIR_ROUNDS) -> tuple[dict, list[ValidationError]]:
+    """
+    Re-requests only the invalid repairable subtrees of a document.
+
+    regenerate(unit_name, fragment, problems) returns the replacement fragment. Errors
+    outside any repairable unit (e.g. no phases at all) are returned untouched, since
+    only regenerating the whole document fixes them. Returns (document, errors left).
+    """
+    validator = VALIDATORS[schema_name]
+    errors = validator.errors(document)
+    for _ in range(rounds):
+        units = _group_by_unit(errors)
+        if not errors or None in units:
+            break
+        for (unit_name, unit_path), unit_errors in units.items():
+            fragment = get_path(document, unit_path)
+            try:
+                fixed = regenerate(unit_name, fragment, _problems(unit_path, unit_errors))
+            except Exception as e:
+                print(f"Could not repair {unit_name} at {format_path(unit_path)}: {e}")
+                continue
+            _set_path(document, unit_path, _repaired(fragment, fixed))
+        errors = validator.errors(document)
+    return document, errors
+
+
+async def repair_async(document, schema_name, regenerate, rounds=REPAIR_ROUNDS) -> tuple[dict, list[ValidationError]]:
+    """repair() with an async regenerate; the invalid units of a round are re-requested concurrently."""
+    import asyncio
+
+    validator = VALIDATORS[schema_name]
+    errors = validator.errors(document)
+    for _ in range(rounds):
+        units = _group_by_unit(errors)
+        if not errors or None in units:
+            break
+        keys = list(units)
+        results = await asyncio.gather(
+            *(regenerate(name, get_path(document, path), _problems(path, units[(name, path)])) for name, path in keys),
+            return_exceptions=True,
+        )
+        for (unit_name, unit_path), fixed in zip(keys, results):
+            if isinstance(fixed, Exception):
+                print(f"Could not repair {unit_name} at {format_path(unit_path)}: {fixed}")
+                continue
+            _set_path(document, unit_path, _repaired(get_path(document, unit_path), fixed))
+        errors = validator.errors(document)
+    return document, errors
+
+
+def prune(document, errors) -> dict:
+    """Removes the repairable units that are still invalid from their parent lists."""
+    paths = sorted({error.unit[1] for error in errors if error.unit is not None}, reverse=True)
+    for path in paths:
+        parent = get_path(document, path[:-1])
+        if isinstance(parent, list):
+            del parent[path[-1]]
+    return document
+
+
+def llm_repairer(route, context):
+    """regenerate function for repair() that asks the route's model for one unit."""
+    import model_router
+
+    def regenerate(unit_name, fragment, problems):
+        fixed = model_router.generate_json(route, build_repair_prompt(unit_name, fragment, problems, context),
+                                           schema=unit_name)
+        if isinstance(fixed, dict) and "error" in fixed:
+            raise ValueError(fixed["error"])
+        return fixed
+
+    return regenerate
+
+
+def llm_repairer_async(route, context, executor=None):
+    import model_router
+
+    async def regenerate(unit_name, fragment, problems):
+        fixed = await model_router.generate_json_async(
+            route, build_repair_prompt(unit_name, fragment, problems, context), executor=executor, schema=unit_name
+        )
+        if isinstance(fixed, dict) and "error" in fixed:
+            raise ValueError(fixed["error"])
+        return fixed
+
+    return regenerate
+
+
+def checked(document, schema_name, regenerate) -> dict:
+    """
+    Validates a generated document, repairs invalid units, drops the ones that stay
+    invalid and returns the document, or {"error": ...} if it is still not valid.
+    """
+    if not isinstance(document, dict) or "error" in document:
+        return document if isinstance(document, dict) else {"error": "Response is not a JSON object."}
+    document, errors = repair(document, schema_name, regenerate)
+    return _finish(document, schema_name, errors)
+
+
+async def checked_async(document, schema_name, regenerate) -> dict:
+    if not isinstance(document, dict) or "error" in document:
+        return document if isinstance(document, dict) else {"error": "Response is not a JSON object."}
+    document, errors = await repair_async(document, schema_name, regenerate)
+    return _finish(document, schema_name, errors)
+
+
+def _finish(document, schema_name, errors):
+    if errors and None not in _group_by_unit(errors):
+        print(f"Dropping {len({e.unit for e in errors})} invalid unit(s) that could not be repaired")
+        document = prune(document, errors)
+        errors = VALIDATORS[schema_name].errors(document)
+    if errors:
+        shown = "; ".join(str(error) for error in errors[:5])
+        return {"error": f"Invalid {schema_name}: {shown}" + (f" (+{len(errors) - 5} more)" if len(errors) > 5 else "")}
+    return document
@@ -1,19 +1,32 @@
 from flask import Flask, request, jsonify
 from Roadmap_generator import get_or_generate_roadmap
 from flask_cors import CORS
+from singleflight import generation_jobs
 import os
 import json
+from utils import get_roadmap_path, is_safe_id
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+@app.before_request
+def reject_unsafe_user_id():
+    """User IDs name files, so one that could leave the data folder is refused"""
+    user_id = (request.view_args or {}).get("user_id")
+    if user_id is not None and not is_safe_id(user_id):
+        return jsonify({'error': 'Invalid user ID'}), 400
+
 @app.route('/generate_roadmap', methods=['POST'])
 def generate_roadmap_endpoint():
     user_id = request.json.get('user_id')
     if not user_id:
         return jsonify({'error': 'User ID is required'}), 400
+    if not is_safe_id(user_id):
+        return jsonify({'error': 'Invalid user ID'}), 400
 
-    roadmap = get_or_generate_roadmap(user_id)
+    # Concurrent requests for the same user share one generation; its tests are generated
+    # in the background, as on the ASGI server, so both answer once the roadmap exists
+    roadmap = generation_jobs.do((user_id, "roadmap"), get_or_generate_roadmap, user_id, True)
     if 'error' in roadmap:
         return jsonify(roadmap), 500
     
@@ -21,7 +34,7 @@ def generate_roadmap_endpoint():
 
 @app.route('/check_roadmap/<user_id>', methods=['GET'])
 def check_roadmap_endpoint(user_id):
-    roadmap_file = os.path.join("D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Roadmap_data", f"{user_id}.json")
+    roadmap_file = get_roadmap_path(user_id)
     if os.path.exists(roadmap_file):
         return jsonify({'exists': True}), 200
     else:
@@ -29,7 +42,7 @@ def check_roadmap_endpoint(user_id):
 
 @app.route('/roadmap/<user_id>', methods=['GET'])
 def get_roadmap_data(user_id):
-    roadmap_file = os.path.join("D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Roadmap_data", f"{user_id}.json")
+    roadmap_file = get_roadmap_path(user_id)
     try:
         with open(roadmap_file, 'r') as f:
             roadmap_data = json.load(f)
@@ -41,5 +54,9 @@ def get_roadmap_data(user_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/jobs/stats', methods=['GET'])
+def job_stats_endpoint():
+    return jsonify(generation_jobs.stats()), 200
+
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
\ No newline at end of file
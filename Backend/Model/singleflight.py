@@ -0,0 +1,94 @@
+"""
+Request coalescing for generation jobs.
+
+Calls are keyed by (user_id, job_type). While a job for a key is in flight, further
+calls for the same key do not start another one: they attach to the running job and
+receive its result (or exception). The counters record how many calls were
+deduplicated this way.
+"""
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self.executed = Counter()
+        self.deduplicated = Counter()
+
+    def _attach_or_lead(self, key):
+        """Returns (future, is_leader) for key, registering a new future if none is in flight."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.deduplicated[key[1]] += 1
+                return future, False
+            future = Future()
+            self._calls[key] = future
+            self.executed[key[1]] += 1
+            return future, True
+
+    def _run(self, key, future, fn, args, kwargs):
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Runs fn in the calling thread, or waits for the in-flight call with the same key."""
+        future, is_leader = self._attach_or_lead(key)
+        if is_leader:
+            self._run(key, future, fn, args, kwargs)
+        return future.result()
+
+    def start(self, key, fn, *args, **kwargs) -> tuple[Future, bool]:
+        """
+        Starts fn in a background thread unless a call with the same key is in flight.
+
+        Returns the job's future and whether this call started it.
+        """
+        future, is_leader = self._attach_or_lead(key)
+        if is_leader:
+            threading.Thread(target=self._run, args=(key, future, fn, args, kwargs), daemon=True).start()
+        return future, is_leader
+
+    async def do_async(self, key, coro_fn, *args, **kwargs):
+        """Awaits coro_fn, or the in-flight task with the same key, on the running event loop."""
+        task = self._async_calls.get(key)
+        if task is not None:
+            self.deduplicated[key[1]] += 1
+        else:
+            self.executed[key[1]] += 1
+            task = asyncio.ensure_future(coro_fn(*args, **kwargs))
+            self._async_calls[key] = task
+            task.add_done_callback(lambda _: self._async_calls.pop(key, None))
+        # Shield so a caller that disconnects does not cancel the job the others share.
+        return await asyncio.shield(task)
+
+    def in_flight(self, key) -> bool:
+        return key in self._calls or key in self._async_calls
+
+    def stats(self) -> dict:
+        with self._lock:
+            in_flight = len(self._calls) + len(self._async_calls)
+            job_types = set(self.executed) | set(self.deduplicated)
+            return {
+                "in_flight": in_flight,
+                "executed": sum(self.executed.values()),
+                "deduplicated": sum(self.deduplicated.values()),
+                "by_job_type": {
+                    job_type: {"executed": self.executed[job_type], "deduplicated": self.deduplicated[job_type]}
+                    for job_type in sorted(job_types)
+                },
+            }
+
+
+# Shared by the Flask apps, the ASGI app and the generators in this process.
+generation_jobs = SingleFlight()
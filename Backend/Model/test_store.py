@@ -0,0 +1,162 @@
+"""
+Hierarchical store of generated tests, one file per subtopic.
+
+Every test is written once, straight to its place in the phase > milestone > subtopic
+hierarchy:
+
+    users_data/Test_data/<user_id>/<phase>/<milestone_id>/<subtopic_id>.json
+
+Inserting a test is one atomic file write, whatever else the user has, and reading one
+is one file read, so there is no flat _Tests.json to re-read, nest and rewrite after
+generation, and readers never have to guess the layout. Keys are canonical: the phase
+is always the string form of phase_number (JSON object keys were strings, so callers
+used str(phase)), and IDs are made safe to use as path components.
+
+A user's old <user_id>_Tests.json, flat or nested, is imported into the store the first
+time the user's tests are accessed.
+"""
+import os
+import re
+import threading
+
+from json_store import atomic_write_json, document_lock, read_json
+from utils import data_path
+
+TEST_DATA_FOLDER = data_path("Test_data")
+TEST_SUFFIX = ".json"
+
+_migrated = set()
+_migrated_lock = threading.Lock()
+
+
+def test_key(phase, milestone_id, subtopic_id) -> tuple[str, str, str]:
+    return str(phase), str(milestone_id), str(subtopic_id)
+
+
+def key_of(test: dict) -> tuple[str, str, str]:
+    return test_key(test.get("phase_number"), test.get("milestone_id"), test.get("subtopic_id"))
+
+
+def _component(part: str) -> str:
+    safe = re.sub(r"[^A-Za-z0-9._-]", "_", part)
+    return "_" if safe in ("", ".", "..") else safe
+
+
+def user_dir(user_id, root=None) -> str:
+    return os.path.join(root or TEST_DATA_FOLDER, _component(str(user_id)))
+
+
+def test_path(user_id, key, root=None) -> str:
+    phase, milestone_id, subtopic_id = (_component(part) for part in key)
+    return os.path.join(user_dir(user_id, root), phase, milestone_id, subtopic_id + TEST_SUFFIX)
+
+
+def legacy_path(user_id, root=None) -> str:
+    return os.path.join(root or TEST_DATA_FOLDER, f"{_component(str(user_id))}_Tests.json")
+
+
+def _legacy_tests(document):
+    """Tests of an old _Tests.json, either the flat list or the phase > milestone > subtopic nesting."""
+    if isinstance(document, list):
+        yield from (test for test in document if isinstance(test, dict))
+    elif isinstance(document, dict):
+        for value in document.values():
+            if isinstance(value, dict) and "subtopic_id" in value:
+                yield value
+            else:
+                yield from _legacy_tests(value)
+
+
+def migrate_legacy(user_id, root=None) -> int:
+    """Imports the user's old _Tests.json into the store once. Returns the number of tests imported."""
+    legacy = legacy_path(user_id, root)
+    marker = os.path.join(user_dir(user_id, root), ".migrated")
+    with _migrated_lock:
+        if (legacy, root) in _migrated:
+            return 0
+        _migrated.add((legacy, root))
+    if not os.path.exists(legacy) or os.path.exists(marker):
+        return 0
+    imported = 0
+    with document_lock(legacy):
+        if os.path.exists(marker):
+            return 0
+        for test in _legacy_tests(read_json(legacy, [])):
+            if test.get("status") == "pending" or not test.get("subtopic_id"):
+                continue
+            path = test_path(user_id, key_of(test), root)
+            if not os.path.exists(path):  # tests written since are newer
+                atomic_write_json(path, test)
+                imported += 1
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        open(marker, "w").close()
+    print(f"Imported {imported} test(s) of user {user_id} from {legacy}")
+    return imported
+
+
+def put_test(user_id, test: dict, key=None, root=None) -> tuple[str, str, str]:
+    """Writes one test at its key (default: from its phase_number, milestone_id, subtopic_id)."""
+    key = key or key_of(test)
+    atomic_write_json(test_path(user_id, key, root), test)
+    return key
+
+
+def stored_test_path(user_id, phase, milestone_id, subtopic_id, root=None) -> str:
+    """Path of a test's file, for readers that serve or cache the file itself."""
+    migrate_legacy(user_id, root)
+    return test_path(user_id, test_key(phase, milestone_id, subtopic_id), root)
+
+
+def get_test(user_id, phase, milestone_id, subtopic_id, root=None) -> dict | None:
+    return read_json(stored_test_path(user_id, phase, milestone_id, subtopic_id, root))
+
+
+def get_tests(user_id, keys, root=None) -> dict:
+    """Several tests of one user, each file read once: {key: test or None}."""
+    migrate_legacy(user_id, root)
+    return {key: read_json(test_path(user_id, key, root)) for key in dict.fromkeys(keys)}
+
+
+def iter_keys(user_id, root=None):
+    """Yields the key of every stored test of a user."""
+    migrate_legacy(user_id, root)
+    yield from _dir_keys(user_dir(user_id, root))
+
+
+def _dir_keys(base):
+    for phase in sorted(os.listdir(base)) if os.path.isdir(base) else []:
+        phase_dir = os.path.join(base, phase)
+        if not os.path.isdir(phase_dir):
+            continue
+        for milestone_id in sorted(os.listdir(phase_dir)):
+            milestone_dir = os.path.join(phase_dir, milestone_id)
+            if not os.path.isdir(milestone_dir):
+                continue
+            for name in sorted(os.listdir(milestone_dir)):
+                if name.endswith(TEST_SUFFIX) and not name.startswith("."):
+                    yield phase, milestone_id, name[:-len(TEST_SUFFIX)]
+
+
+def find_test(user_id, subtopic_id, root=None) -> tuple[str, str, str] | None:
+    """Key of the user's test for a subtopic ID, or None."""
+    name = _component(str(subtopic_id))
+    for key in iter_keys(user_id, root):
+        if key[2] == name:
+            return key
+    return None
+
+
+def load_tests(user_id, root=None) -> dict:
+    """All tests of a user as {phase: {milestone_id: {subtopic_id: test}}}."""
+    migrate_legacy(user_id, root)
+    return load_user_dir(user_dir(user_id, root))
+
+
+def load_user_dir(base) -> dict:
+    """load_tests for a user's directory, e.g. in an export of a copied data folder."""
+    nested = {}
+    for phase, milestone_id, subtopic_id in _dir_keys(base):
+        test = read_json(os.path.join(base, phase, milestone_id, subtopic_id + TEST_SUFFIX))
+        if test is not None:
+            nested.setdefault(phase, {}).setdefault(milestone_id, {})[subtopic_id] = test
+    return nested
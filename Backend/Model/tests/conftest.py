@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# The modules are imported flat, as the servers run them from Backend/Model
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Keep anything a test writes out of the real users_data folder
+os.environ.setdefault("NEXTPATH_DATA_ROOT", tempfile.mkdtemp(prefix="nextpath-tests-"))
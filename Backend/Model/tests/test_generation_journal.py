@@ -0,0 +1,39 @@
+import json
+
+from generation_journal import DONE, GenerationJournal
+
+
+def entry(subtopic_id):
+    return json.dumps({"event": DONE, "subtopic_id": subtopic_id, "key": ["1", "m1", subtopic_id]}) + "\n"
+
+
+def test_torn_lines_are_skipped_not_truncated(tmp_path):
+    path = tmp_path / "u_Tests.journal.jsonl"
+    path.write_text(entry("s1") + '{"event": "do\n' + entry("s2"))
+
+    journal = GenerationJournal(str(path))
+
+    assert journal.done == {"s1", "s2"}
+    assert path.read_text().endswith(entry("s2"))
+
+
+def test_append_after_torn_last_line(tmp_path):
+    path = tmp_path / "u_Tests.journal.jsonl"
+    path.write_text(entry("s1") + '{"event": "do')
+
+    journal = GenerationJournal(str(path))
+    journal.record_done("s2", ("1", "m1", "s2"))
+
+    assert GenerationJournal(str(path)).done == {"s1", "s2"}
+
+
+def test_refresh_reads_entries_of_other_writers(tmp_path):
+    path = str(tmp_path / "u_Tests.journal.jsonl")
+    reader = GenerationJournal(path)
+    GenerationJournal(path).record_done("s1", ("1", "m1", "s1"))
+    GenerationJournal(path).record_pending("s2")
+
+    reader.refresh()
+
+    assert reader.done == {"s1"}
+    assert reader.pending == {"s2"}
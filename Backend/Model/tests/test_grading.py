@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import test_store
+from grading import AnswerKey, SubmissionError, grade, grade_batch, grade_submissions, normalize_timings
+from json_store import read_json
+from utils import get_test_scores_path
+
+MCQS = [
+    {"question": "q1", "answer": "A", "topic_label": "Loops"},
+    {"question": "q2", "answer": "B", "topic_label": "Loops"},
+    {"question": "q3", "answer": "C", "topic_label": "Loops"},
+    {"question": "q4", "answer": "D", "topic_label": "Recursion"},
+    {"question": "q5", "answer": "A", "topic_label": "Recursion"},
+    {"question": "q6", "answer": "B", "topic_label": "Sorting"},
+]
+TEST = {"subtopic_name": "Control flow", "career_title": "Developer", "phase_number": 1,
+        "milestone_id": "m1", "subtopic_id": "s1", "mcqs": MCQS}
+
+
+def test_grade_scores_and_per_topic_accuracy():
+    result, submitted = grade(AnswerKey(TEST), ["A", "B", "X", "D", "X", "B"])
+
+    assert result["score"] == 66.67
+    assert result["correct_answers"] == 4
+    assert result["total_questions"] == 6
+    assert result["passed"] is False
+    assert result["topic_accuracy"] == {"Loops": 66.67, "Recursion": 50.0, "Sorting": 100.0}
+    assert result["weak_topics"] == ["Loops", "Recursion"]
+    assert list(submitted) == ["A", "B", "X", "D", "X", "B"]
+
+
+def test_grade_accepts_numbered_answers_and_records():
+    key = AnswerKey(TEST)
+    by_number, _ = grade(key, {"1": "A", "6": "B"})
+    records, _ = grade(key, [{"question_number": 4, "user_answer": "D"}, {"question_number": 5, "user_answer": "A"}])
+
+    assert by_number["correct_answers"] == 2
+    assert by_number["topic_accuracy"] == {"Loops": 33.33, "Recursion": 0.0, "Sorting": 100.0}
+    assert records["topic_accuracy"] == {"Loops": 0.0, "Recursion": 100.0, "Sorting": 0.0}
+
+
+def test_grade_batch_matches_grade():
+    key = AnswerKey(TEST)
+    submissions = [["A", "B", "C", "D", "A", "B"], ["X"] * 6, {"2": "B"}]
+    batch = grade_batch(key, submissions)
+
+    assert [result for result, _ in batch] == [grade(key, answers)[0] for answers in submissions]
+    assert batch[0][0]["score"] == 100.0 and batch[0][0]["passed"] is True
+    assert batch[1][0]["score"] == 0.0
+
+
+def test_malformed_submissions_are_rejected():
+    key = AnswerKey(TEST)
+    with pytest.raises(SubmissionError):
+        grade(key, "ABCDAB")
+    with pytest.raises(SubmissionError):
+        grade(key, [{"user_answer": "A"}])
+
+
+def test_normalize_timings():
+    seconds = normalize_timings({"1": 12, "3": "bad"}, 3)
+    assert seconds[0] == 12.0
+    assert np.isnan(seconds[1]) and np.isnan(seconds[2])
+
+
+def test_grade_submissions_stores_scores():
+    test_store.put_test("grader", TEST)
+    results, graded_users = grade_submissions([
+        {"userId": "grader", "phase": 1, "milestone": "m1", "subtopic": "s1",
+         "answers": ["A", "B", "X", "D", "X", "B"], "timeTaken": [10, 20, 30, 40, 50, 60]},
+        {"userId": "grader", "phase": 1, "milestone": "m1", "subtopic": "missing", "answers": ["A"]},
+        {"userId": "../grader", "phase": 1, "milestone": "m1", "subtopic": "s1", "answers": ["A"]},
+    ])
+
+    assert results[0]["score"] == 66.67
+    assert results[0]["topic_accuracy"] == {"Loops": 66.67, "Recursion": 50.0, "Sorting": 100.0}
+    assert results[1]["error"] == "Test not found for this topic"
+    assert results[2]["error"] == "Invalid userId"
+    assert graded_users == {"grader"}
+
+    answers = read_json(get_test_scores_path("grader"))["1"]["m1"]["s1"]["answers"]
+    assert [record["is_correct"] for record in answers] == [True, True, False, True, False, True]
+    assert [record["time_taken"] for record in answers] == [10, 20, 30, 40, 50, 60]
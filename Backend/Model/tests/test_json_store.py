@@ -0,0 +1,64 @@
+import json
+import multiprocessing
+import os
+import threading
+
+from json_store import _stress_writer, _thread_locks, atomic_write_json, read_json, remove_json, update_json
+
+WRITERS = 8
+UPDATES = 50
+
+
+def test_concurrent_writer_processes_lose_no_updates(tmp_path):
+    path = str(tmp_path / "counter.json")
+    writers = [multiprocessing.Process(target=_stress_writer, args=(path, i, UPDATES)) for i in range(WRITERS)]
+    for p in writers:
+        p.start()
+    for p in writers:
+        p.join()
+    assert all(p.exitcode == 0 for p in writers)
+
+    doc = read_json(path)
+    assert doc["count"] == WRITERS * UPDATES
+    assert len(doc["entries"]) == WRITERS * UPDATES
+
+
+def test_concurrent_writer_threads_lose_no_updates(tmp_path):
+    path = str(tmp_path / "counter.json")
+
+    def increment():
+        for _ in range(UPDATES):
+            update_json(path, lambda doc: {"count": doc.get("count", 0) + 1})
+
+    threads = [threading.Thread(target=increment) for _ in range(WRITERS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert read_json(path) == {"count": WRITERS * UPDATES}
+    assert os.path.abspath(path) not in _thread_locks  # released once nobody waits
+
+
+def test_read_json_default_for_missing_or_invalid(tmp_path):
+    path = tmp_path / "doc.json"
+    assert read_json(str(path), {}) == {}
+    path.write_text("{not json")
+    assert read_json(str(path), []) == []
+
+
+def test_atomic_write_leaves_no_temp_files(tmp_path):
+    path = str(tmp_path / "doc.json")
+    atomic_write_json(path, {"a": 1})
+    atomic_write_json(path, {"a": 2})
+    assert json.loads((tmp_path / "doc.json").read_text()) == {"a": 2}
+    assert sorted(os.listdir(tmp_path)) == ["doc.json"]
+
+
+def test_remove_json_keeps_lock_file(tmp_path):
+    path = str(tmp_path / "doc.json")
+    update_json(path, lambda doc: {"a": 1})
+    remove_json(path)
+    remove_json(path)  # already gone
+    assert not os.path.exists(path)
+    assert os.path.exists(f"{path}.lock")
@@ -1,3 +1,5 @@
+import os
+import re
 import sys
 import time
 import threading
@@ -35,3 +37,42 @@ def spinner_with_timer(msg: str = "Processing...") -> Callable[[], None]:
         sys.stdout.write(f"\r{msg} Done! ({green_color}{elapsed_time}s{reset_color})\n")
         sys.stdout.flush()
     return stop
+
+# --- User data paths ---
+# Every data file lives under DATA_ROOT: the users_data folder next to this module, or
+# NEXTPATH_DATA_ROOT if set. Paths do not depend on the working directory.
+# User and session IDs come from request bodies, so the per-user helpers refuse any ID
+# that is not a plain file name component (no separators, no "..").
+
+DATA_ROOT = os.getenv("NEXTPATH_DATA_ROOT", os.path.join(os.path.dirname(os.path.abspath(__file__)), "users_data"))
+_SAFE_ID = re.compile(r"[A-Za-z0-9._-]+")
+
+def data_path(*parts):
+    return os.path.join(DATA_ROOT, *parts)
+
+def is_safe_id(value) -> bool:
+    text = str(value)
+    return bool(_SAFE_ID.fullmatch(text)) and text not in (".", "..")
+
+def safe_id(value) -> str:
+    if not is_safe_id(value):
+        raise ValueError(f"Invalid ID: {value!r}")
+    return str(value)
+
+def get_roadmaps_folder():
+    return data_path("Roadmap_data")
+
+def get_roadmap_path(user_id):
+    return data_path("Roadmap_data", f"{safe_id(user_id)}.json")
+
+def get_adaptive_roadmap_path(user_id):
+    return data_path("Adaptive_Roadmaps_data", f"{safe_id(user_id)}_Adaptive.json")
+
+def get_scores_folder():
+    return data_path("Test_scores_data")
+
+def get_test_scores_path(user_id):
+    return data_path("Test_scores_data", f"{safe_id(user_id)}_Scores.json")
+
+def get_test_session_path(session_id):
+    return data_path("Test_sessions", f"{safe_id(session_id)}.json")
@@ -1,15 +1,16 @@
 import sys
-import os
-import json
 import time
 sys.path.append('D:\\Adaptive_Learning_model_V2\\Backend\\Model')
 from Roadmap_generator import get_or_generate_roadmap
+from Test_engine import AdaptiveTest
+from roadmap_model import Roadmap
+import profiling
+import test_store
 from utils import spinner_with_timer
 
 def display_roadmap(roadmap_data):
     """Displays the roadmap in a linear format."""
-    roadmap_inner = roadmap_data.get('roadmap_data', roadmap_data)
-    phases = roadmap_inner.get('phases', [])
+    phases = Roadmap.of(roadmap_data).phases
 
     if not phases:
         print("Invalid roadmap format: 'phases' key not found.")
@@ -17,11 +18,11 @@ def display_roadmap(roadmap_data):
 
     print("\n--- Your Learning Roadmap ---")
     for phase in phases:
-        print(f"\nPhase {phase.get('phase_number')}: {phase.get('phase_name')}")
-        for milestone in phase.get('milestones', []):
-            print(f"  Milestone {milestone.get('milestone_id')}: {milestone.get('milestone_title')}")
-            for subtopic in milestone.get('subtopics', []):
-                print(f"    Subtopic {subtopic.get('subtopic_id')}: {subtopic.get('title')}")
+        print(f"\nPhase {phase.phase_number}: {phase.phase_name}")
+        for milestone in phase.milestones:
+            print(f"  Milestone {milestone.milestone_id}: {milestone.milestone_title}")
+            for subtopic in milestone.subtopics:
+                print(f"    Subtopic {subtopic.subtopic_id}: {subtopic.title}")
 
 def display_results_table(results):
     """Displays the test results in a formatted table."""
@@ -36,7 +37,7 @@ def display_results_table(results):
     print(f"  │ Average Time/Question │ {results['avg_time_per_question']:.2f} seconds   │")
     print("  └───────────────────────┴────────────────┘")
 
-def select_test(user_id):
+def select_test(user_id, adaptive=False):
     """Prompts the user to select a test to take."""
     while True:
         selection = input("\nEnter the [Phase].[Milestone].[Subtopic] ID to take a test (e.g., 1.1.1), or 'q' to quit: ")
@@ -49,29 +50,23 @@ def select_test(user_id):
             
             confirm = input(f"You have selected test {test_id}. Take this test? (yes/no): ")
             if confirm.lower() == 'yes':
-                run_test(user_id, test_id)
+                run_test(user_id, test_id, adaptive)
         except ValueError:
             print("Invalid format. Please use the format [Phase].[Milestone].[Subtopic] (e.g., 1.1.1)")
 
-def run_test(user_id, test_id):
-    """Runs the selected test."""
-    test_data_file = f"D:\\Adaptive_Learning_model_V2\\Backend\\Model\\users_data\\Test_data\\{user_id}_Tests.json"
-    if not os.path.exists(test_data_file):
-        print("Test data not found for this user.")
-        return
-
-    with open(test_data_file, "r") as f:
-        all_tests = json.load(f)
+def run_test(user_id, test_id, adaptive=False):
+    """
+    Runs the selected test.
 
-    test_questions = None
-    for phase in all_tests.values():
-        for milestone in phase.values():
-            if test_id in milestone:
-                test_questions = milestone[test_id]['mcqs']
-                break
-        if test_questions:
-            break
+    In adaptive mode questions are picked one at a time by AdaptiveTest, and the test
+    stops as soon as the pass/fail decision is clear.
+    """
+    key = test_store.find_test(user_id, test_id)
+    if key is None:
+        print("Test not found.")
+        return
 
+    test_questions = (test_store.get_test(user_id, *key) or {}).get('mcqs')
     if not test_questions:
         print("Test not found.")
         return
@@ -80,8 +75,20 @@ def run_test(user_id, test_id):
     total_time = 0
     weak_topics = set()
 
-    for i, question in enumerate(test_questions):
-        print(f"\nQuestion {i + 1}/{len(test_questions)}: {question['question']}")
+    if adaptive:
+        adaptive_test = AdaptiveTest(test_questions)
+        question_order = iter(adaptive_test.next_item, None)
+    else:
+        question_order = iter(range(len(test_questions)))
+
+    asked = 0
+    for i in question_order:
+        question = test_questions[i]
+        asked += 1
+        if adaptive:
+            print(f"\nQuestion {asked}: {question['question']}")
+        else:
+            print(f"\nQuestion {asked}/{len(test_questions)}: {question['question']}")
         options = question['options']
         for key, value in options.items():
             print(f"  {key}. {value}")
@@ -102,12 +109,19 @@ def run_test(user_id, test_id):
             score += 1
         else:
             weak_topics.add(question['topic_label'])
+        if adaptive:
+            adaptive_test.record(i, answer == question['answer'])
 
-    percentage_score = (score / len(test_questions)) * 100
-    avg_time_per_question = total_time / len(test_questions)
+    percentage_score = (score / asked) * 100
+    avg_time_per_question = total_time / asked
+    passed = percentage_score >= 85
+    if adaptive:
+        adaptive_result = adaptive_test.result()
+        passed = adaptive_result['passed']
+        weak_topics = adaptive_result['weak_topics']
 
     results = {
-        'total_questions': len(test_questions),
+        'total_questions': asked,
         'correct_answers': score,
         'percentage_score': percentage_score,
         'avg_time_per_question': avg_time_per_question
@@ -115,7 +129,7 @@ def run_test(user_id, test_id):
 
     display_results_table(results)
 
-    if percentage_score < 85:
+    if not passed:
         print("\nYou scored {:.2f}%. Let's strengthen your understanding in these areas.".format(percentage_score))
         print("\nWeak Topics Identified:")
         for topic in weak_topics:
@@ -139,7 +153,8 @@ def main():
 
     print("\nGenerating your personalized roadmap... This may take a moment.")
     stop_spinner = spinner_with_timer()
-    roadmap_data = get_or_generate_roadmap(user_id)
+    with profiling.profile(f"cli-roadmap-{user_id}", profiling.mode_from_argv()):
+        roadmap_data = get_or_generate_roadmap(user_id)
     stop_spinner()
 
     if 'error' in roadmap_data:
@@ -148,7 +163,7 @@ def main():
 
     print("\nDone!")
     display_roadmap(roadmap_data)
-    select_test(user_id)
+    select_test(user_id, adaptive='--adaptive' in sys.argv[1:])
 
 if __name__ == '__main__':
     main()
\ No newline at end of file